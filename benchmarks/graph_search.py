@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# benchmarks/graph_search.py
+"""
+Compare the full-text part search with the old CONTAINS label scan.
+Reports latency and hit rate (queries returning at least one part) over a set
+of realistic customer messages. Needs a populated Neo4j (python -m utils.db.graph_builder).
+
+    python -m benchmarks.graph_search --repeat 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from utils.db.graph_retriever import graph_retriever
+
+LEGACY_QUERY = """
+MATCH (p:Part)-[:MANUFACTURED_BY]->(b:Brand)
+WHERE toLower(p.name) CONTAINS toLower($part_name)
+RETURN b.name AS brand, p.name AS part_name, p.product_code AS code, p.wholesale_price AS price
+LIMIT 5
+"""
+
+SAMPLE_MESSAGES: list[str] = [
+    "bei ya battery N50",
+    "mna tyres 195/65R15?",
+    "How much is POW-35-MF-NSL",
+    "I need 4 apollo tyres 175/70R13",
+    "powerlast N120",
+    "Nataka Wolverine 5W-30 engine oil",
+    "exide maxx N50",
+    "falken 205/55R16 bei gani",
+    "045MF NSL POWERLAST",
+    "triangle tyre 185/65 R14",
+    "gs yuasa N150 battery price",
+    "wiper blades",
+]
+
+
+async def legacy_search(message: str) -> list:
+    async with graph_retriever._driver.session() as session:
+        result = await session.run(LEGACY_QUERY, part_name=message)
+        return [record.values() for record in await result.fetch(5)]
+
+
+async def fulltext_search(message: str) -> list:
+    values, _ = await graph_retriever.search_parts_by_name(message)
+    return values
+
+
+async def measure(search, repeat: int) -> tuple[list[float], float]:
+    latencies: list[float] = []
+    hits = 0
+    for message in SAMPLE_MESSAGES:
+        for i in range(repeat):
+            start = time.perf_counter()
+            values = await search(message)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if i == 0 and values:
+                hits += 1
+    return latencies, hits / len(SAMPLE_MESSAGES)
+
+
+async def main(repeat: int) -> None:
+    for name, search in (("contains-scan", legacy_search), ("fulltext", fulltext_search)):
+        latencies, hit_rate = await measure(search, repeat)
+        p95 = statistics.quantiles(latencies, n=20)[-1]
+        print(
+            f"{name:<14} p50={statistics.median(latencies):7.2f}ms "
+            f"p95={p95:7.2f}ms hit_rate={hit_rate:.0%}"
+        )
+    await graph_retriever.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.repeat))
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# benchmarks/last_order_explain.py
+"""
+Compare get_last_order's old JSON_AGG join with the customer_last_order read.
+Loads the schema from utils/db/init_db.sql into a scratch database, fills it
+with synthetic customers, orders and items, then reports EXPLAIN ANALYZE
+execution time and buffers per lookup for each variant, plus the cost the
+triggers add to writing new orders.
+
+The schema script drops the tables first, so never point this at a real database:
+    createdb lane_bench
+    python -m benchmarks.last_order_explain --dsn postgresql://postgres@localhost/lane_bench --orders 1000000
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from pathlib import Path
+
+import asyncpg
+
+INIT_SQL = Path(__file__).resolve().parent.parent / "utils" / "db" / "init_db.sql"
+# The dummy data that follows this line in init_db.sql is not loaded
+DUMMY_DATA_MARKER = "-- SQL for inserting realistic Kenyan dummy data"
+
+LEGACY_QUERY = """
+SELECT
+    o.quote_id,
+    o.total_amount,
+    o.payment_status,
+    o.created_at AS order_date,
+    c.name AS customer_name,
+    c.location,
+    JSON_AGG(
+        JSON_BUILD_OBJECT(
+            'item_name', oi.item_name,
+            'product_code', oi.product_code,
+            'quantity', oi.quantity,
+            'unit_price', oi.unit_price
+        )
+    ) AS items
+FROM customers c
+JOIN orders o ON c.id = o.customer_id
+JOIN order_items oi ON o.id = oi.order_id
+WHERE c.phone_number = $1
+GROUP BY o.id, c.id
+ORDER BY o.created_at DESC
+LIMIT 1
+"""
+
+LAST_ORDER_QUERY = """
+SELECT quote_id, total_amount, payment_status, order_date, customer_name, location, items
+FROM customer_last_order
+WHERE phone_number = $1
+"""
+
+SEED_STATEMENTS: list[str] = [
+    "SELECT setseed(0.42)",
+    """
+    INSERT INTO customers (name, phone_number, location, account_type, is_repeat_customer)
+    SELECT
+        'Customer ' || g,
+        '2547' || LPAD(g::TEXT, 8, '0'),
+        (ARRAY['Nairobi', 'Mombasa', 'Kisumu', 'Nakuru', 'Eldoret'])[1 + g % 5],
+        CASE WHEN g % 4 = 0 THEN 'B2B' ELSE 'B2C' END,
+        g % 3 = 0
+    FROM generate_series(1, $1) AS g
+    """,
+    """
+    INSERT INTO orders (quote_id, customer_id, total_amount, payment_status, created_at)
+    SELECT
+        'BENCH-' || g,
+        1 + FLOOR(RANDOM() * $2::INT)::INT,
+        ROUND((RANDOM() * 100000)::NUMERIC, 2),
+        (ARRAY['paid', 'pending', 'cancelled'])[1 + g % 3],
+        NOW() - RANDOM() * INTERVAL '730 days'
+    FROM generate_series(1, $1) AS g
+    """,
+    """
+    INSERT INTO order_items (order_id, item_name, product_code, quantity, unit_price, line_total)
+    SELECT o.id, 'Part ' || i, 'BENCH-' || (o.id % 5000) || '-' || i, i, 1500.00, 1500.00 * i
+    FROM orders o CROSS JOIN generate_series(1, $1) AS i
+    """,
+]
+
+
+def schema_sql() -> str:
+    """The table, index, function and trigger definitions without psql meta-commands."""
+    script = INIT_SQL.read_text().split(DUMMY_DATA_MARKER)[0]
+    return "\n".join(line for line in script.splitlines() if not line.startswith("\\"))
+
+
+async def seed(conn: asyncpg.Connection, customers: int, orders: int, items_per_order: int) -> None:
+    start = time.perf_counter()
+    await conn.execute(schema_sql())
+    # Bulk load with the triggers off, then rebuild the table in one pass
+    await conn.execute("ALTER TABLE orders DISABLE TRIGGER USER")
+    await conn.execute("ALTER TABLE order_items DISABLE TRIGGER USER")
+    await conn.execute(SEED_STATEMENTS[0])
+    await conn.execute(SEED_STATEMENTS[1], customers)
+    await conn.execute(SEED_STATEMENTS[2], orders, customers)
+    await conn.execute(SEED_STATEMENTS[3], items_per_order)
+    await conn.execute("ALTER TABLE orders ENABLE TRIGGER USER")
+    await conn.execute("ALTER TABLE order_items ENABLE TRIGGER USER")
+    await conn.execute("SELECT rebuild_customer_last_order()")
+    await conn.execute("VACUUM ANALYZE")
+    print(
+        f"Seeded {customers:,} customers, {orders:,} orders, {orders * items_per_order:,} items "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+
+async def explain(conn: asyncpg.Connection, query: str, phone_number: str) -> dict:
+    rows = await conn.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", phone_number)
+    return (json.loads(rows) if isinstance(rows, str) else rows)[0]
+
+
+async def measure(conn: asyncpg.Connection, name: str, query: str, phone_numbers: list[str]) -> None:
+    plans = [await explain(conn, query, phone_number) for phone_number in phone_numbers]
+    execution = [plan["Execution Time"] for plan in plans]
+    planning = [plan["Planning Time"] for plan in plans]
+    buffers = [
+        plan["Plan"].get("Shared Hit Blocks", 0) + plan["Plan"].get("Shared Read Blocks", 0)
+        for plan in plans
+    ]
+    p95 = statistics.quantiles(execution, n=20)[-1]
+    print(
+        f"{name:<28} exec p50={statistics.median(execution):7.3f}ms p95={p95:7.3f}ms "
+        f"plan p50={statistics.median(planning):6.3f}ms buffers={statistics.mean(buffers):8.1f} "
+        f"top={plans[0]['Plan']['Node Type']}"
+    )
+
+
+async def measure_writes(conn: asyncpg.Connection, orders: int, items_per_order: int) -> None:
+    """Time inserting orders with their items, with and without the triggers."""
+    customer_ids = [
+        row["id"] for row in await conn.fetch("SELECT id FROM customers ORDER BY RANDOM() LIMIT $1", orders)
+    ]
+    for triggers in ("ENABLE", "DISABLE"):
+        tr = conn.transaction()
+        await tr.start()
+        try:
+            await conn.execute(f"ALTER TABLE orders {triggers} TRIGGER USER")
+            await conn.execute(f"ALTER TABLE order_items {triggers} TRIGGER USER")
+            start = time.perf_counter()
+            for n, customer_id in enumerate(customer_ids):
+                order_id = await conn.fetchval(
+                    "INSERT INTO orders (quote_id, customer_id, total_amount) VALUES ($1, $2, 1500.00) RETURNING id",
+                    f"BENCH-W-{n}",
+                    customer_id,
+                )
+                await conn.executemany(
+                    "INSERT INTO order_items (order_id, item_name, quantity, unit_price, line_total) "
+                    "VALUES ($1, $2, 1, 1500.00, 1500.00)",
+                    [(order_id, f"Part {i}") for i in range(items_per_order)],
+                )
+            elapsed = (time.perf_counter() - start) * 1000 / len(customer_ids)
+            print(f"order write, triggers {triggers.lower()}d: {elapsed:.3f}ms per order")
+        finally:
+            await tr.rollback()
+
+
+async def main(args: argparse.Namespace) -> None:
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        if not args.skip_seed:
+            await seed(conn, args.customers, args.orders, args.items_per_order)
+        phone_numbers = [
+            row["phone_number"]
+            for row in await conn.fetch(
+                "SELECT phone_number FROM customer_last_order ORDER BY RANDOM() LIMIT $1", args.samples
+            )
+        ]
+        # Warm the cache so every variant is measured on hot buffers
+        for query in (LEGACY_QUERY, LAST_ORDER_QUERY):
+            for phone_number in phone_numbers:
+                await conn.fetch(query, phone_number)
+
+        # The old schema indexed orders on customer_id alone; DDL rolls back with the transaction
+        tr = conn.transaction()
+        await tr.start()
+        try:
+            await conn.execute("DROP INDEX idx_orders_customer_created")
+            await conn.execute("CREATE INDEX idx_orders_customer_id ON orders (customer_id)")
+            await conn.execute("ANALYZE orders")
+            await measure(conn, "join, customer_id index", LEGACY_QUERY, phone_numbers)
+        finally:
+            await tr.rollback()
+        await measure(conn, "join, composite index", LEGACY_QUERY, phone_numbers)
+        await measure(conn, "customer_last_order", LAST_ORDER_QUERY, phone_numbers)
+        await measure_writes(conn, args.write_orders, args.items_per_order)
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="Scratch database; its tables are dropped")
+    parser.add_argument("--customers", type=int, default=100_000)
+    parser.add_argument("--orders", type=int, default=1_000_000)
+    parser.add_argument("--items-per-order", type=int, default=3)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--write-orders", type=int, default=500)
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse the data from a previous run")
+    args = parser.parse_args()
+    asyncio.run(main(args))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# benchmarks/mock_graph_api.py
+"""
+Exercise WhatsAppSender against a local mock of the Graph API messages endpoint.
+The mock fails a share of requests with 429/500 so the outbox retry path runs.
+
+    python -m benchmarks.mock_graph_api --messages 200 --rate 40 --valkey-url redis://localhost:6379/0
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import redis.asyncio as redis
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from utils.whatsapp import OUTBOX_KEY, OUTBOX_QUEUE_KEY, WhatsAppSender, text_payload
+
+MOCK_PORT = 8765
+RECIPIENT = "254700000000"
+
+
+def build_mock(failure_rate: float) -> tuple[FastAPI, dict[str, int]]:
+    stats: dict[str, int] = {"received": 0, "delivered": 0, "rejected": 0}
+    delivered: set[str] = set()
+    app = FastAPI()
+
+    @app.post("/{version}/{phone_number_id}/messages")
+    async def messages(request: Request):
+        body = await request.json()
+        stats["received"] += 1
+        if random.random() < failure_rate:
+            stats["rejected"] += 1
+            status = random.choice([429, 500])
+            return JSONResponse({"error": {"code": status}}, status_code=status)
+        delivered.add(body["text"]["body"])
+        stats["delivered"] = len(delivered)
+        return {"messages": [{"id": f"wamid.mock-{stats['received']}"}]}
+
+    return app, stats
+
+
+async def main(messages: int, rate: float, failure_rate: float, valkey_url: str | None) -> int:
+    app, stats = build_mock(failure_rate)
+    server = uvicorn.Server(uvicorn.Config(app, port=MOCK_PORT, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    sender = WhatsAppSender(
+        access_token="mock-token",
+        phone_number_id=1,
+        base_url=f"http://127.0.0.1:{MOCK_PORT}",
+        rate_per_second=rate,
+    )
+    outbox = redis.from_url(valkey_url, decode_responses=True) if valkey_url else None
+    if outbox is not None:
+        await outbox.delete(OUTBOX_KEY, OUTBOX_QUEUE_KEY.format(to=RECIPIENT))
+        sender.set_outbox(outbox)
+
+    start = time.perf_counter()
+    results = await sender.send_batch(
+        [text_payload(f"message {i}", RECIPIENT) for i in range(messages)]
+    )
+    elapsed = time.perf_counter() - start
+    print(f"first pass: {sum(results)}/{messages} ok in {elapsed:.2f}s ({messages / elapsed:.1f} msg/s, limit {rate}/s)")
+
+    if outbox is not None:
+        deadline = time.perf_counter() + 120
+        while await outbox.zcard(OUTBOX_KEY) and time.perf_counter() < deadline:
+            await sender.flush_outbox()
+            await asyncio.sleep(0.5)
+        print(f"after outbox retries: {stats['delivered']}/{messages} delivered")
+        await outbox.close()
+
+    print(f"mock stats: {stats}")
+    await sender.close()
+    server.should_exit = True
+    await server_task
+
+    too_fast = elapsed < (messages - rate) / rate * 0.9
+    if too_fast:
+        print("FAIL: sender exceeded the configured rate")
+        return 1
+    if outbox is not None and stats["delivered"] < messages:
+        print("FAIL: some messages were never delivered")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=40)
+    parser.add_argument("--failure-rate", type=float, default=0.1)
+    parser.add_argument("--valkey-url", default=None)
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(main(args.messages, args.rate, args.failure_rate, args.valkey_url)))
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# benchmarks/webhook_ack_latency.py
+"""
+Regression benchmark: webhook ACK and /health latency must stay flat while
+LLM generations are in flight.
+
+Generation runs in worker.py, so the workers must be up: the benchmark checks
+the job stream's consumer group for a live worker and waits until the queued
+messages have been picked up before measuring. Each message comes from its own
+sender number, since a worker coalesces one customer's messages into a single
+generation.
+
+Run against a live stack (docker-compose up, API and llm_worker):
+    python -m benchmarks.webhook_ack_latency --url http://localhost:8000 --valkey-url redis://localhost:6379/0 --inflight 8
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import httpx
+import redis.asyncio as redis
+from redis.exceptions import ResponseError
+
+from utils.job_queue import CONSUMER_GROUP, JOB_STREAM, RETRY_CONSUMER
+
+TEST_NUMBER = "254700000000"
+# A worker that has not polled the stream for this long is taken to be down
+WORKER_IDLE_LIMIT_MS: int = 15_000
+
+
+def bench_number(i: int) -> str:
+    """A distinct, unassigned sender number per in-flight generation."""
+    return f"2547999{i:05d}"
+
+
+def text_message_payload(body: str, sender: str = TEST_NUMBER) -> dict:
+    """A minimal WhatsApp text message webhook that triggers a full generation."""
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [
+            {
+                "id": "0",
+                "changes": [
+                    {
+                        "field": "messages",
+                        "value": {
+                            "messaging_product": "whatsapp",
+                            "contacts": [{"wa_id": sender, "profile": {"name": "bench"}}],
+                            "messages": [
+                                {
+                                    "from": sender,
+                                    "id": f"wamid.bench-{uuid.uuid4().hex}",
+                                    "timestamp": str(int(time.time())),
+                                    "type": "text",
+                                    "text": {"body": body},
+                                }
+                            ],
+                        },
+                    }
+                ],
+            }
+        ],
+    }
+
+
+def status_payload() -> dict:
+    """A delivery status callback: acknowledged without any LLM work."""
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [
+            {
+                "id": "0",
+                "changes": [
+                    {
+                        "field": "messages",
+                        "value": {
+                            "messaging_product": "whatsapp",
+                            "statuses": [
+                                {
+                                    "id": f"wamid.bench-{uuid.uuid4().hex}",
+                                    "status": "delivered",
+                                    "recipient_id": TEST_NUMBER,
+                                }
+                            ],
+                        },
+                    }
+                ],
+            }
+        ],
+    }
+
+
+async def sample_latency(client: httpx.AsyncClient, samples: int) -> dict[str, list[float]]:
+    """Measure ACK latency of a status webhook and /health, in milliseconds."""
+    timings: dict[str, list[float]] = {"webhook_ack": [], "health": []}
+    for _ in range(samples):
+        start = time.perf_counter()
+        await client.post("/webhooks", json=status_payload())
+        timings["webhook_ack"].append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await client.get("/health")
+        timings["health"].append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.05)
+    return timings
+
+
+async def live_workers(valkey: redis.Redis) -> list[str]:
+    """Consumers in the job group that have polled the stream recently."""
+    try:
+        consumers = await valkey.xinfo_consumers(JOB_STREAM, CONSUMER_GROUP)
+    except ResponseError:
+        return []
+    return [
+        consumer["name"]
+        for consumer in consumers
+        if consumer["name"] != RETRY_CONSUMER and consumer["idle"] < WORKER_IDLE_LIMIT_MS
+    ]
+
+
+async def pending_jobs(valkey: redis.Redis) -> int:
+    """Jobs delivered to a worker and not acked yet."""
+    return (await valkey.xpending(JOB_STREAM, CONSUMER_GROUP))["pending"]
+
+
+async def wait_for_pickup(valkey: redis.Redis, baseline: int, expected: int, timeout: float = 30.0) -> int:
+    """Wait until the workers hold `expected` more jobs than the baseline; returns how many they took."""
+    deadline = time.perf_counter() + timeout
+    picked_up = 0
+    while time.perf_counter() < deadline:
+        picked_up = await pending_jobs(valkey) - baseline
+        if picked_up >= expected:
+            break
+        await asyncio.sleep(0.2)
+    return picked_up
+
+
+def summarise(label: str, timings: dict[str, list[float]]) -> dict[str, float]:
+    summary: dict[str, float] = {}
+    for name, values in timings.items():
+        p50 = statistics.median(values)
+        p95 = statistics.quantiles(values, n=20)[-1] if len(values) > 1 else values[0]
+        summary[name] = p95
+        print(f"{label:>10} {name:<12} p50={p50:8.1f}ms p95={p95:8.1f}ms max={max(values):8.1f}ms")
+    return summary
+
+
+async def main(url: str, valkey_url: str, inflight: int, samples: int, tolerance: float) -> int:
+    valkey = redis.from_url(valkey_url, decode_responses=True)
+    try:
+        workers = await live_workers(valkey)
+        if not workers:
+            print(f"FAIL: no worker is consuming {JOB_STREAM}; start llm_worker first")
+            return 1
+        print(f"workers: {', '.join(workers)}")
+        async with httpx.AsyncClient(base_url=url, timeout=30.0) as client:
+            idle = summarise("idle", await sample_latency(client, samples))
+
+            # Queue N generations for N customers, then measure again while they are running
+            baseline = await pending_jobs(valkey)
+            await asyncio.gather(
+                *(
+                    client.post(
+                        "/webhooks",
+                        # "yangu" (my) keeps it out of the response cache, so every run generates
+                        json=text_message_payload(f"bei ya battery N50 ya gari yangu #{i}", sender=bench_number(i)),
+                    )
+                    for i in range(inflight)
+                )
+            )
+            picked_up = await wait_for_pickup(valkey, baseline, inflight)
+            if picked_up < inflight:
+                print(f"FAIL: workers picked up {picked_up}/{inflight} messages")
+                return 1
+            loaded = summarise(f"{inflight} gens", await sample_latency(client, samples))
+    finally:
+        await valkey.close()
+
+    failed = [
+        name for name in idle if loaded[name] > max(idle[name] * tolerance, idle[name] + 50)
+    ]
+    if failed:
+        print(f"FAIL: p95 latency regressed under load for {failed}")
+        return 1
+    print("OK: ACK latency stayed flat under load")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--valkey-url", default="redis://localhost:6379/0", help="the stack's Valkey, to check the workers")
+    parser.add_argument("--inflight", type=int, default=8)
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--tolerance", type=float, default=3.0, help="allowed p95 ratio loaded/idle")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(main(args.url, args.valkey_url, args.inflight, args.samples, args.tolerance)))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# benchmarks/webhook_parsing.py
+"""
+Throughput of the webhook intake parsing: status filter, json.loads, ID
+collection for dedup and parse_webhook, over the recorded payloads in
+benchmarks/sample_payloads. No services needed.
+
+    python -m benchmarks.webhook_parsing --repeat 20000
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+from utils.webhook_parser import is_status_callback, iter_messages, parse_webhook
+
+SAMPLE_DIR = Path(__file__).parent / "sample_payloads"
+
+
+def intake(body: bytes) -> int:
+    """The same work handle_whatsapp_message does before touching Valkey."""
+    if is_status_callback(body):
+        return 0
+    data = json.loads(body)
+    message_ids = {message["id"] for message in iter_messages(data) if message.get("id")}
+    return len(parse_webhook(data, message_ids=message_ids))
+
+
+def main(repeat: int) -> None:
+    total_payloads = 0
+    total_messages = 0
+    total_seconds = 0.0
+    for path in sorted(SAMPLE_DIR.glob("*.json")):
+        body = path.read_bytes()
+        messages = intake(body)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            intake(body)
+        elapsed = time.perf_counter() - start
+        total_payloads += repeat
+        total_messages += messages * repeat
+        total_seconds += elapsed
+        print(
+            f"{path.name:<18} {len(body):>6}B messages={messages} "
+            f"{elapsed / repeat * 1e6:8.2f}us/payload {repeat / elapsed:>10,.0f} payloads/s"
+        )
+    print(
+        f"{'all':<18} {total_payloads / total_seconds:,.0f} payloads/s "
+        f"{total_messages / total_seconds:,.0f} messages/s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+    main(args.repeat)
@@ -18,20 +18,47 @@ import os
 import redis.asyncio as redis
 from middleware.auth_middleware import auth_middleware
 from utils.llm.llm_base import chat_history
-from utils.routers import auth, webhooks, pages
+from utils.routers import api, auth, webhooks, pages
+from utils.db.customer_cache import customer_cache
+from utils.db.embedding_cache import embedding_cache
+from utils.cache import webhook_stats
+from utils.llm.agent import agent_stats
+from utils.llm.response_cache import response_cache
+from utils.llm.tool_executor import TOOL_PROCESS_WORKERS, tool_executor, tool_stats
+from utils.metrics import run_flusher
+from utils.whatsapp import whatsapp_sender
+from utils.catalog import product_catalog
+from utils.db.chunking import KNOWLEDGE_BASE
+from utils.db.indexer import reindex
 from utils.db.qdrant import HybridRetriever
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Define knowledge base files
-knowledge_base: list[str] = ["utils/data/data.json", "utils/data/tires.json", "utils/data/hiview_tyres.txt", "utils/data/hiview_care.txt", "utils/data/green_lubes.txt", "utils/data/dealer_tyres.txt"]
+knowledge_base: list[str] = KNOWLEDGE_BASE
 #knowledge_base: list[str] = ["utils/data/green_lubes.txt"]
 #knowledge_base: list[Any]=[]
 retriever: HybridRetriever = HybridRetriever()
 
 VALKEY_HOST: str = os.getenv("VALKEY_HOST", "")
 VALKEY_PORT: int = int(os.getenv("VALKEY_PORT", 6379))
+REINDEX_ON_STARTUP: bool = os.getenv("REINDEX_ON_STARTUP", "false").lower() == "true"
+REINDEX_LOCK_KEY = "lock:reindex"
+
+
+async def reindex_in_background(redis_client: redis.Redis) -> None:
+    """Incrementally reindex the knowledge base without holding up startup."""
+    # Only one of the uvicorn workers should do the work
+    if not await redis_client.set(REINDEX_LOCK_KEY, os.getpid(), nx=True, ex=1800):
+        logger.info("Reindex already running in another worker, skipping.")
+        return
+    try:
+        await reindex(knowledge_paths=knowledge_base, retriever=retriever)
+    except Exception as e:
+        logger.error(f"Background reindex failed: {e}")
+    finally:
+        await redis_client.delete(REINDEX_LOCK_KEY)
 
 
 # --- Application Lifespan ---
@@ -40,8 +67,9 @@ async def lifespan(app: FastAPI):
     """Handles application startup and shutdown events."""
     logger.info("Starting application...")
 
-    # Initialize a process pool executor
-    # app.state.process_pool = ProcessPoolExecutor(max_workers=7)
+    # Initialize a process pool executor for CPU-bound tools
+    app.state.process_pool = ProcessPoolExecutor(max_workers=TOOL_PROCESS_WORKERS)
+    tool_executor.set_process_pool(app.state.process_pool)
     # --- Initialize Clients ---
     app.state.llm_client = AsyncClient(host=os.getenv("OLLAMA_HOST"))
     # app.state.embedding_client = AsyncClient(host=os.getenv("OLLAMA_EMBEDDING_HOST"))
@@ -51,17 +79,25 @@ async def lifespan(app: FastAPI):
         host=VALKEY_HOST, port=VALKEY_PORT, db=0, decode_responses=True
     )
     app.state.redis = redis.Redis(connection_pool=redis_pool)
+    # Failed sends from the API (/api, broadcasts) are parked here; the workers retry them
+    whatsapp_sender.set_outbox(app.state.redis)
+    # Push this process's cache counters to Valkey for /metrics
+    app.state.metrics_task = asyncio.create_task(run_flusher(app.state.redis))
+    # Drop cached customer profiles when their rows change in Postgres
+    app.state.customer_listener = asyncio.create_task(customer_cache.listen_for_changes())
 
     try:
         # Await the knowledge vector_database init and setup
             # Initialize the vector database in the background
         collections = await retriever.initialize()
         logger.info(f"the collections are {collections}")
-        #chunks: list[dict[str, int | str | list[float]]] = (
-        #    await retriever.initialize_knowledge_base(knowledge_base)
-        #)
-        #await retriever.setup_qdrant_collection(collection_name="lane_data_collection",chunks=chunks)
-        
+        # Load the price lists into memory before the first message arrives
+        product_catalog.load()
+        if REINDEX_ON_STARTUP:
+            app.state.reindex_task = asyncio.create_task(
+                reindex_in_background(app.state.redis)
+            )
+
         logger.info("Vector DB initialization complete. Application is ready.")
 
         yield {"retriever": retriever}
@@ -70,9 +106,16 @@ async def lifespan(app: FastAPI):
         raise
     # Initialize the vector database in the background
     # --- Shutdown logic ---
-    # if app.state.process_pool:
-    #    app.state.process_pool.shutdown(wait=True)
+    if app.state.process_pool:
+        app.state.process_pool.shutdown(wait=True)
+    tool_executor.shutdown()
+    if getattr(app.state, "reindex_task", None):
+        app.state.reindex_task.cancel()
+    app.state.metrics_task.cancel()
+    app.state.customer_listener.cancel()
+    await asyncio.gather(app.state.metrics_task, app.state.customer_listener, return_exceptions=True)
     logger.info("...Application shutdown complete.")
+    await whatsapp_sender.close()
     await app.state.redis.close()
     await retriever.close()
     logger.info("All connections closed.")
@@ -111,6 +154,7 @@ app.mount("/static", StaticFiles(directory="templates"), name="static")
 # app.include_router(auth.router)
 app.include_router(pages.router)
 app.include_router(webhooks.router)
+app.include_router(api.router)
 
 
 # --- Health Check Endpoint ---
@@ -118,3 +162,17 @@ app.include_router(webhooks.router)
 async def health_check():
     """Simple health check endpoint to confirm the API is running."""
     return {"status": "healthy"}
+
+
+@app.get("/metrics", tags=["Health"])
+async def metrics():
+    """Counters for the caches and pipeline stages, summed across the API and workers."""
+    return {
+        "embedding_cache": await embedding_cache.stats(app.state.redis),
+        "customer_cache": await customer_cache.stats(app.state.redis),
+        "response_cache": await response_cache.stats(app.state.redis),
+        # Written by the workers, so read from Valkey
+        "agent": await agent_stats(app.state.redis),
+        "webhook": await webhook_stats(app.state.redis),
+        "tools": await tool_stats(app.state.redis),
+    }
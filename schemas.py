@@ -58,4 +58,6 @@ class LlmRequestPayload(BaseModel):
     customer_details:list[dict[str, str|int|bool|datetime]]
     media_file_path:str 
     image_caption:str
+    # False for cacheable questions: no profile, last order or history in the prompt
+    personal_context:bool = True
 
@@ -0,0 +1,86 @@
+# tests/test_agent.py
+"""AgentRun.stream against a scripted model instead of Ollama."""
+import asyncio
+from types import SimpleNamespace
+
+from utils.llm import agent
+from utils.llm.text_processing import IncrementalReadableConverter
+
+ANSWER = (
+    "The Bosch spark plug FR7DC+ is in stock at KES 450 each. "
+    "It fits the Toyota Probox 1NZ engine you mentioned, and we can deliver to Westlands tomorrow. "
+    "A set of four comes to KES 1,800. Would you like me to prepare a quote?"
+)
+
+
+def chunk(content: str = "", tool_calls: list | None = None) -> SimpleNamespace:
+    return SimpleNamespace(content=content, tool_calls=tool_calls)
+
+
+def tool_call(name: str) -> SimpleNamespace:
+    return SimpleNamespace(function=SimpleNamespace(name=name, arguments={}))
+
+
+def scripted_model(calls: list[list[SimpleNamespace]], progress: dict):
+    """A stream_chat stand-in replaying one chunk list per call, word by word."""
+
+    async def stream_chat(client, messages, deadline, use_tools=True):
+        for message in calls[progress["calls"]]:
+            yield message
+            await asyncio.sleep(0)
+        progress["calls"] += 1
+        progress["finished"] = progress["calls"] == len(calls)
+
+    return stream_chat
+
+
+def words(text: str) -> list[SimpleNamespace]:
+    return [chunk(word + " ") for word in text.split(" ")]
+
+
+def run(monkeypatch, calls: list[list[SimpleNamespace]]) -> tuple[list[str], list[bool]]:
+    progress = {"calls": 0, "finished": False}
+
+    async def prepare_messages(request, payload):
+        return [], {"sections": []}
+
+    async def execute_tool_calls(tool_calls):
+        return [{"role": "tool", "content": "ok", "tool_name": tool.function.name} for tool in tool_calls]
+
+    monkeypatch.setattr(agent, "prepare_messages", prepare_messages)
+    monkeypatch.setattr(agent, "execute_tool_calls", execute_tool_calls)
+    monkeypatch.setattr(agent, "stream_chat", scripted_model(calls, progress))
+
+    async def consume() -> tuple[list[str], list[bool]]:
+        request = SimpleNamespace(app=SimpleNamespace(state=SimpleNamespace(llm_client=None)))
+        converter = IncrementalReadableConverter()
+        segments: list[str] = []
+        finished_at_segment: list[bool] = []
+        async for delta in agent.AgentRun(request, None).stream():
+            for segment in converter.feed(delta):
+                segments.append(segment)
+                finished_at_segment.append(progress["finished"])
+        segments.extend(converter.flush())
+        return segments, finished_at_segment
+
+    return asyncio.run(consume())
+
+
+def test_answer_streams_before_generation_ends(monkeypatch):
+    segments, finished_at_segment = run(monkeypatch, [[chunk("<think>stock, price</think>\n\n"), *words(ANSWER)]])
+
+    assert finished_at_segment and finished_at_segment[0] is False
+    assert " ".join(segments).split() == ANSWER.split()
+
+
+def test_preamble_before_tool_call_is_dropped(monkeypatch):
+    segments, _ = run(
+        monkeypatch,
+        [
+            [chunk("<think>need stock</think>\n\nLet me check that for you."), chunk(tool_calls=[tool_call("check_stock")])],
+            words(ANSWER),
+        ],
+    )
+
+    assert "Let me check" not in " ".join(segments)
+    assert " ".join(segments).split() == ANSWER.split()
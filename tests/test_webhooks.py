@@ -0,0 +1,51 @@
+# tests/test_webhooks.py
+"""
+Webhook intake on the recorded payloads in benchmarks/sample_payloads.
+The router reads the WhatsApp secret at import, so run these where the app
+runs (e.g. `docker compose run --rm api python -m pytest tests`).
+"""
+import asyncio
+from pathlib import Path
+from types import SimpleNamespace
+
+from utils.cache import WEBHOOK_METRICS_KEY
+from utils.webhook_parser import is_status_callback
+
+SAMPLE_DIR = Path(__file__).resolve().parent.parent / "benchmarks" / "sample_payloads"
+
+
+class FakeValkey:
+    """Just the hash commands the status path touches."""
+
+    def __init__(self):
+        self.hashes: dict[str, dict[str, int]] = {}
+
+    async def hincrby(self, key: str, field: str, amount: int = 1) -> int:
+        fields = self.hashes.setdefault(key, {})
+        fields[field] = fields.get(field, 0) + amount
+        return fields[field]
+
+
+class FakeRequest:
+    def __init__(self, body: bytes, client: FakeValkey):
+        self._body = body
+        self.app = SimpleNamespace(state=SimpleNamespace(redis=client))
+
+    async def body(self) -> bytes:
+        return self._body
+
+
+def test_only_status_payload_takes_fast_path():
+    matched = {path.name for path in SAMPLE_DIR.glob("*.json") if is_status_callback(path.read_bytes())}
+    assert matched == {"status.json"}
+
+
+def test_status_callback_is_counted():
+    from utils.routers.webhooks import handle_whatsapp_message
+
+    client = FakeValkey()
+    request = FakeRequest((SAMPLE_DIR / "status.json").read_bytes(), client)
+    response = asyncio.run(handle_whatsapp_message(request))
+
+    assert response.status_code == 200
+    assert client.hashes[WEBHOOK_METRICS_KEY]["status_callbacks"] == 1
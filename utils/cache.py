@@ -1,50 +1,291 @@
 # ericcharagu-autoparts/utils/cache.py
+import asyncio
+import contextlib
+import json
+import time
+from typing import Any, AsyncContextManager, Callable
+
 from dependancies import embedding_client
+import msgpack
+from ollama import AsyncClient
 import redis.asyncio as redis
 from loguru import logger
-import json
 import os
 
 from utils.db.qdrant import embedding_model_name
+from utils.llm.text_processing import convert_llm_output_to_readable
+
+try:
+    import zstandard
+except ImportError:  # Compression is optional; entries are stored as plain msgpack
+    zstandard = None
+
+# Meta keeps retrying unacknowledged webhooks for hours, so remember IDs for a day
+MESSAGE_ID_EXPIRATION_SECONDS: int = int(os.getenv("MESSAGE_ID_EXPIRATION_SECONDS", 24 * 3600))
+WEBHOOK_METRICS_KEY = "metrics:webhook"
+# KEYS[1] is the metrics hash, the rest are wamid keys. Returns 1 per newly claimed ID.
+CLAIM_MESSAGE_IDS_SCRIPT = """
+local flags = {}
+local duplicates = 0
+for i = 2, #KEYS do
+    if redis.call('SET', KEYS[i], 1, 'NX', 'EX', ARGV[1]) then
+        flags[i - 1] = 1
+    else
+        flags[i - 1] = 0
+        duplicates = duplicates + 1
+    end
+end
+if duplicates > 0 then
+    redis.call('HINCRBY', KEYS[1], 'duplicates_suppressed', duplicates)
+end
+return flags
+"""
+VALKEY_HOST: str = os.getenv("VALKEY_HOST", "")
+VALKEY_PORT: int = int(os.getenv("VALKEY_PORT", 6379))
+# Raw turns put in the prompt; older ones are folded into the rolling summary
+HISTORY_PROMPT_TURNS: int = int(os.getenv("HISTORY_PROMPT_TURNS", 5))
+# Turns allowed to pile up past HISTORY_PROMPT_TURNS before a fold is scheduled
+HISTORY_FOLD_BATCH: int = int(os.getenv("HISTORY_FOLD_BATCH", 5))
+# Hard cap on stored turns in case summaries cannot be produced
+HISTORY_MAX_TURNS: int = int(os.getenv("HISTORY_MAX_TURNS", 50))
+HISTORY_TTL_SECONDS: int = int(os.getenv("HISTORY_TTL_SECONDS", 30 * 24 * 3600))
+HISTORY_COMPRESS_MIN_BYTES = 256
+# How long shutdown waits for pending folds before cancelling them
+HISTORY_FOLD_DRAIN_SECONDS: float = float(os.getenv("HISTORY_FOLD_DRAIN_SECONDS", 30))
+# JSON list written before ChatHistoryStore; moved over on a customer's next message
+LEGACY_HISTORY_KEY = "chat_history:{user_number}"
+HISTORY_SUMMARY_MODEL: str = os.getenv("HISTORY_SUMMARY_MODEL", "qwen3:8b")
+HISTORY_SUMMARY_PROMPT = """/no_think
+You keep notes for a sales assistant at Lane Auto Parts. Update the summary of this customer's conversation.
+Keep part names, product codes, tyre sizes, quantities, quoted prices, vehicle details, delivery location and anything still unresolved. Drop greetings and small talk.
+Write at most 120 words.
+
+Current summary:
+{summary}
+
+Earlier messages, oldest first:
+{turns}
+
+Updated summary:"""
+async def claim_message_ids(client: redis.Redis, message_ids: list[str]) -> list[str]:
+    """
+    Claim every wamid in one round trip and return the ones seen for the first time.
+    Meta redelivers webhooks it thinks were not acknowledged; the rest are duplicates
+    and are added to the suppressed counter by the same script.
+    """
+    if not message_ids:
+        return []
+    claim = client.register_script(CLAIM_MESSAGE_IDS_SCRIPT)
+    flags = await claim(
+        keys=[WEBHOOK_METRICS_KEY, *(f"processed_wamid:{message_id}" for message_id in message_ids)],
+        args=[MESSAGE_ID_EXPIRATION_SECONDS],
+    )
+    fresh = [message_id for message_id, flag in zip(message_ids, flags) if int(flag)]
+    if len(fresh) < len(message_ids):
+        logger.warning(f"Ignored {len(message_ids) - len(fresh)} duplicate message IDs")
+    return fresh
+
+
+async def release_message_ids(client: redis.Redis, message_ids: list[str]) -> None:
+    """Undo a claim when the messages could not be queued, so a redelivery is processed."""
+    if message_ids:
+        await client.delete(*(f"processed_wamid:{message_id}" for message_id in message_ids))
+
 
-MESSAGE_ID_EXPIRATION_SECONDS = 300
 async def is_message_processed(client: redis.Redis, message_id: str) -> bool:
-    key = f"processed_wamid:{message_id}"
-    # It will only succeed (return True) if the key does not already exist.
-    was_set = await client.set(key, 1, ex=MESSAGE_ID_EXPIRATION_SECONDS, nx=True)
-    if was_set:
+    # True only the first time the message ID is seen
+    if await claim_message_ids(client, [message_id]):
         logger.info(f"New message ID acquired for processing: {message_id}")
         return True
-    
-    logger.warning(f"Duplicate message ID detected and ignored: {message_id}")
     return False
 
-async def get_chat_history(client:redis.Redis, user_number: str, limit: int = 5) -> list:
-    """Retrieves the last N messages for a user from Valkey."""
-    key = f"chat_history:{user_number}"
-    try:
-        # LTRIM keeps the list size fixed, preventing it from growing indefinitely
-        await client.ltrim(key, 0, limit - 1) 
-        history_json = await client.lrange(key, 0, limit - 1)
-        # Messages are stored as JSON strings, so we parse them back
-        history = [json.loads(msg) for msg in history_json]
-        history.reverse() # Reverse to get the chronological order
-        logger.info(f"Retrieved {len(history)} messages for user {user_number}")
-        return history
-    except Exception as e:
-        logger.error(f"Failed to get chat history for {user_number}: {e}")
-        return []
 
-async def add_to_chat_history(client:redis.Redis, user_number: str, user_message: str, llm_response: str):
-    """Adds a new user/llm message pair to the user's chat history."""
-    key = f"chat_history:{user_number}"
-    message_pair = {
-        "user_message": user_message, 
-        "llm_response": llm_response
-    }
+async def count_webhook_event(client: redis.Redis, field: str, amount: int = 1) -> None:
     try:
-        # LPUSH adds the new message to the beginning of the list
-        await client.lpush(key, json.dumps(message_pair))
-        logger.info(f"Added new message to history for user {user_number}")
+        await client.hincrby(WEBHOOK_METRICS_KEY, field, amount)
     except Exception as e:
-        logger.error(f"Failed to add to chat history for {user_number}: {e}")
+        logger.warning(f"Failed to count webhook event {field}: {e}")
+
+
+async def webhook_stats(client: redis.Redis) -> dict[str, int]:
+    return {key: int(value) for key, value in (await client.hgetall(WEBHOOK_METRICS_KEY)).items()}
+
+
+class ChatHistoryStore:
+    """
+    Per-user chat history in Valkey.
+    Turns are msgpack entries (zstd-compressed when long and zstandard is
+    installed) in a list, newest first, next to a rolling text summary.
+    Reads and writes are one pipelined round trip each. Once enough turns
+    pile up, the oldest are folded into the summary by a background task, so
+    the prompt holds the summary plus the last few turns however long the
+    customer has been talking to us. Every turn not yet folded is returned
+    by get(), so nothing drops out between the window and the summary.
+    """
+
+    def __init__(self, prompt_turns: int = HISTORY_PROMPT_TURNS, ttl: int = HISTORY_TTL_SECONDS):
+        self.prompt_turns = prompt_turns
+        self.ttl = ttl
+        self._redis: redis.Redis | None = None
+        self._compressor = zstandard.ZstdCompressor(level=3) if zstandard else None
+        self._decompressor = zstandard.ZstdDecompressor() if zstandard else None
+        self._folds: set[asyncio.Task] = set()
+        self._llm_slot: Callable[[], AsyncContextManager[None]] = contextlib.nullcontext
+
+    @property
+    def redis(self) -> redis.Redis:
+        # Binary-safe client: entries are packed bytes
+        if self._redis is None:
+            self._redis = redis.Redis(host=VALKEY_HOST, port=VALKEY_PORT, db=0)
+        return self._redis
+
+    def set_llm_slot(self, slot: Callable[[], AsyncContextManager[None]]) -> None:
+        """Attach the generation slot folds must hold, e.g. a low-priority ValkeySemaphore slot."""
+        self._llm_slot = slot
+
+    @staticmethod
+    def _keys(user_number: str) -> tuple[str, str]:
+        return f"chat:{user_number}:turns", f"chat:{user_number}:summary"
+
+    def pack(self, turn: dict[str, Any]) -> bytes:
+        raw = msgpack.packb(turn, use_bin_type=True)
+        if self._compressor and len(raw) >= HISTORY_COMPRESS_MIN_BYTES:
+            return b"z" + self._compressor.compress(raw)
+        return b"m" + raw
+
+    def unpack(self, blob: bytes) -> dict[str, Any]:
+        kind, body = blob[:1], blob[1:]
+        if kind == b"z":
+            if self._decompressor is None:
+                raise ValueError("zstandard is needed to read compressed history")
+            body = self._decompressor.decompress(body)
+        return msgpack.unpackb(body, raw=False)
+
+    async def get(self, user_number: str) -> dict[str, Any]:
+        """
+        The rolling summary and every turn not folded into it yet, in
+        chronological order: normally prompt_turns, up to prompt_turns +
+        HISTORY_FOLD_BATCH while a fold is due. The prompt builder keeps the
+        newest ones that fit its budget.
+        """
+        turns_key, summary_key = self._keys(user_number)
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.lrange(turns_key, 0, HISTORY_MAX_TURNS - 1)
+                pipe.get(summary_key)
+                blobs, summary = await pipe.execute()
+            if not blobs and summary is None:
+                blobs = await self._migrate_legacy(user_number)
+            turns = [self.unpack(blob) for blob in reversed(blobs)]
+            logger.info(f"Retrieved {len(turns)} messages for user {user_number}")
+            return {"summary": summary.decode("utf-8") if summary else "", "turns": turns}
+        except Exception as e:
+            logger.error(f"Failed to get chat history for {user_number}: {e}")
+            return {"summary": "", "turns": []}
+
+    async def _migrate_legacy(self, user_number: str) -> list[bytes]:
+        """Repack a pre-existing chat_history:{n} JSON list into the turns list and drop it."""
+        legacy_key = LEGACY_HISTORY_KEY.format(user_number=user_number)
+        entries = await self.redis.lrange(legacy_key, 0, HISTORY_MAX_TURNS - 1)
+        if not entries:
+            return []
+        blobs = [self.pack(json.loads(entry)) for entry in entries]
+        turns_key, _ = self._keys(user_number)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            # Both lists are newest first, so RPUSH keeps the order
+            pipe.rpush(turns_key, *blobs)
+            pipe.expire(turns_key, self.ttl)
+            pipe.delete(legacy_key)
+            await pipe.execute()
+        logger.info(f"Migrated {len(blobs)} legacy history entries for user {user_number}")
+        return blobs
+
+    async def append(
+        self,
+        user_number: str,
+        user_message: str,
+        llm_response: str,
+        llm_client: AsyncClient | None = None,
+    ) -> None:
+        """Store a turn; with an llm_client, older turns get folded into the summary."""
+        turns_key, summary_key = self._keys(user_number)
+        turn = {"user_message": user_message, "llm_response": llm_response, "ts": int(time.time())}
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.lpush(turns_key, self.pack(turn))
+                pipe.ltrim(turns_key, 0, HISTORY_MAX_TURNS - 1)
+                pipe.expire(turns_key, self.ttl)
+                pipe.expire(summary_key, self.ttl)
+                length, *_ = await pipe.execute()
+            logger.info(f"Added new message to history for user {user_number}")
+        except Exception as e:
+            logger.error(f"Failed to add to chat history for {user_number}: {e}")
+            return
+        if llm_client is not None and length >= self.prompt_turns + HISTORY_FOLD_BATCH:
+            task = asyncio.create_task(self.fold(user_number, llm_client))
+            self._folds.add(task)
+            task.add_done_callback(self._folds.discard)
+
+    async def fold(self, user_number: str, llm_client: AsyncClient) -> None:
+        """Summarize everything older than the prompt window and drop those turns."""
+        turns_key, summary_key = self._keys(user_number)
+        lock_key = f"chat:{user_number}:fold_lock"
+        try:
+            # Shares the Ollama host with replies, so it waits its turn like they do
+            async with self._llm_slot():
+                if not await self.redis.set(lock_key, 1, nx=True, ex=300):
+                    return
+                try:
+                    await self._summarize(user_number, llm_client, turns_key, summary_key)
+                finally:
+                    await self.redis.delete(lock_key)
+        except Exception as e:
+            logger.error(f"Failed to summarize chat history for {user_number}: {e}")
+
+    async def _summarize(
+        self, user_number: str, llm_client: AsyncClient, turns_key: str, summary_key: str
+    ) -> None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.lrange(turns_key, self.prompt_turns, -1)
+            pipe.get(summary_key)
+            blobs, summary = await pipe.execute()
+        if not blobs:
+            return
+        older = [self.unpack(blob) for blob in reversed(blobs)]
+        transcript = "\n".join(
+            f"Customer: {turn['user_message']}\nAssistant: {turn['llm_response']}" for turn in older
+        )
+        response = await llm_client.generate(
+            model=HISTORY_SUMMARY_MODEL,
+            prompt=HISTORY_SUMMARY_PROMPT.format(
+                summary=summary.decode("utf-8") if summary else "(none)", turns=transcript
+            ),
+            options={"temperature": 0.1},
+        )
+        new_summary = convert_llm_output_to_readable(response["response"])
+        if not new_summary:
+            return
+        # New turns are pushed at the head, so the folded ones are still the tail
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(summary_key, new_summary, ex=self.ttl)
+            pipe.ltrim(turns_key, 0, -(len(blobs) + 1))
+            await pipe.execute()
+        logger.info(f"Folded {len(blobs)} turns into the summary for user {user_number}")
+
+    async def drain(self, timeout: float = HISTORY_FOLD_DRAIN_SECONDS) -> None:
+        """
+        Wait up to timeout for pending folds, then cancel the rest. A cancelled
+        fold leaves its turns in place and runs again on the customer's next message.
+        """
+        if not self._folds:
+            return
+        _, pending = await asyncio.wait(list(self._folds), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if pending:
+            logger.info(f"Cancelled {len(pending)} pending history folds")
+
+
+# Shared instance used by the pipeline and the workers
+history_store: ChatHistoryStore = ChatHistoryStore()
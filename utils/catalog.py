@@ -0,0 +1,274 @@
+# utils/catalog.py
+"""
+In-memory product catalog built from the CSV price lists.
+Columns are held as NumPy arrays with hash indexes on product code, tyre size
+and brand plus a trigram index on item names, so pricing lookups never leave
+the process.
+"""
+import bisect
+import csv
+import hashlib
+import os
+import re
+from collections import defaultdict
+from typing import Any
+
+import numpy as np
+from loguru import logger
+
+from utils.db.lexical import TYRE_SIZE_PATTERN, normalize_code, normalize_tyre_size
+
+CATALOG_FILES: list[str] = ["utils/data/data.csv", "utils/data/tires.csv"]
+NUMERIC_COLUMNS: list[str] = [
+    "retail_selling_price",
+    "wholesale_selling_price",
+    "buying_price",
+    "units",
+    "minimum_order_quantity",
+    "discount",
+]
+# Columns safe to show customers; buying_price is our cost
+PUBLIC_COLUMNS: list[str] = [
+    "retail_selling_price",
+    "wholesale_selling_price",
+    "units",
+    "minimum_order_quantity",
+    "discount",
+]
+
+
+def parse_number(value: str | None) -> float:
+    """Parse price list numbers such as '5,281', '41,760.00' or ''."""
+    if not value:
+        return float("nan")
+    try:
+        return float(value.replace(",", "").strip())
+    except ValueError:
+        return float("nan")
+
+
+def trigrams(text: str) -> set[str]:
+    padded = f"  {text.lower()} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class ProductCatalog:
+    def __init__(self, paths: list[str] = CATALOG_FILES):
+        self.paths = paths
+        self.names: list[str] = []
+        self.codes: list[str] = []
+        self.brands: list[str] = []
+        self.columns: dict[str, np.ndarray] = {}
+        # A code can map to several rows: the price lists repeat some codes and
+        # use placeholders such as "Universal" for others
+        self.code_index: dict[str, list[int]] = {}
+        self.size_index: dict[str, list[int]] = {}
+        self.brand_index: dict[str, list[int]] = {}
+        self.trigram_index: dict[str, list[int]] = {}
+        self._sorted_names: list[tuple[str, int]] = []
+        self._signature: tuple = ()
+        # Content hash of the price lists; changes whenever a price or item does
+        self.version: str = ""
+        self.loaded = False
+
+    def _source_signature(self) -> tuple:
+        signature = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append((path, None, None))
+        return tuple(signature)
+
+    def load(self) -> None:
+        signature = self._source_signature()
+        names: list[str] = []
+        codes: list[str] = []
+        values: dict[str, list[float]] = {column: [] for column in NUMERIC_COLUMNS}
+        digest = hashlib.sha256()
+        for path in self.paths:
+            with open(path, mode="rb") as file:
+                digest.update(file.read())
+            with open(path, mode="r", encoding="utf-8") as file:
+                for row in csv.DictReader(file):
+                    if not row.get("item_name") or not row.get("product_code"):
+                        continue
+                    names.append(row["item_name"].strip())
+                    codes.append(row["product_code"].strip())
+                    for column in NUMERIC_COLUMNS:
+                        values[column].append(parse_number(row.get(column)))
+
+        size_index: dict[str, list[int]] = defaultdict(list)
+        brand_index: dict[str, list[int]] = defaultdict(list)
+        trigram_index: dict[str, list[int]] = defaultdict(list)
+        code_index: dict[str, list[int]] = defaultdict(list)
+        brands: list[str] = []
+        for row, (name, code) in enumerate(zip(names, codes)):
+            if normalized := normalize_code(code):
+                code_index[normalized].append(row)
+            # Same brand convention as the graph builder: first word of the item name
+            brand = name.split(" ")[0].strip().title()
+            brands.append(brand)
+            brand_index[brand.lower()].append(row)
+            for match in TYRE_SIZE_PATTERN.finditer(name):
+                size_index[normalize_tyre_size(match)].append(row)
+            for gram in trigrams(name):
+                trigram_index[gram].append(row)
+
+        self.names, self.codes, self.brands = names, codes, brands
+        self.columns = {
+            column: np.asarray(column_values, dtype=np.float64)
+            for column, column_values in values.items()
+        }
+        self.code_index = dict(code_index)
+        self.size_index = dict(size_index)
+        self.brand_index = dict(brand_index)
+        self.trigram_index = dict(trigram_index)
+        self._sorted_names = sorted((name.lower(), row) for row, name in enumerate(names))
+        self._signature = signature
+        self.version = digest.hexdigest()[:16]
+        self.loaded = True
+        logger.info(f"Catalog {self.version} loaded: {len(names)} products from {self.paths}")
+        duplicates = {codes[rows[0]]: len(rows) for rows in code_index.values() if len(rows) > 1}
+        if duplicates:
+            logger.warning(f"Product codes shared by several items, not priced by code: {duplicates}")
+
+    def _ensure_loaded(self) -> None:
+        """Load on first use and reload when the price lists change on disk."""
+        if not self.loaded or self._source_signature() != self._signature:
+            self.load()
+
+    def current_version(self) -> str:
+        self._ensure_loaded()
+        return self.version
+
+    def record(self, row: int) -> dict[str, Any]:
+        """Customer-facing view of a row."""
+        record: dict[str, Any] = {
+            "item_name": self.names[row],
+            "product_code": self.codes[row],
+            "brand": self.brands[row],
+        }
+        for column in PUBLIC_COLUMNS:
+            value = self.columns[column][row]
+            record[column] = None if np.isnan(value) else float(value)
+        return record
+
+    def by_code(self, code: str) -> list[dict[str, Any]]:
+        """Every item listed under the code; more than one means the code is ambiguous."""
+        self._ensure_loaded()
+        return [self.record(row) for row in self.code_index.get(normalize_code(code), [])]
+
+    def by_tyre_size(self, size: str) -> list[dict[str, Any]]:
+        self._ensure_loaded()
+        match = TYRE_SIZE_PATTERN.search(size)
+        if not match:
+            return []
+        return [self.record(row) for row in self.size_index.get(normalize_tyre_size(match), [])]
+
+    def by_brand(self, brand: str) -> list[dict[str, Any]]:
+        self._ensure_loaded()
+        return [self.record(row) for row in self.brand_index.get(brand.strip().lower(), [])]
+
+    def by_prefix(self, prefix: str, limit: int = 10) -> list[dict[str, Any]]:
+        """Items whose name starts with prefix (case-insensitive)."""
+        self._ensure_loaded()
+        prefix = prefix.strip().lower()
+        start = bisect.bisect_left(self._sorted_names, (prefix, -1))
+        rows: list[int] = []
+        for name, row in self._sorted_names[start:]:
+            if not name.startswith(prefix) or len(rows) >= limit:
+                break
+            rows.append(row)
+        return [self.record(row) for row in rows]
+
+    def search_name(self, query: str, limit: int = 5, min_similarity: float = 0.3) -> list[dict[str, Any]]:
+        """Fuzzy item name search by trigram overlap."""
+        self._ensure_loaded()
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        overlap = np.zeros(len(self.names), dtype=np.int32)
+        for gram in query_grams:
+            rows = self.trigram_index.get(gram)
+            if rows:
+                overlap[rows] += 1
+        similarity = overlap / len(query_grams)
+        top = np.argsort(-similarity)[:limit]
+        return [self.record(int(row)) for row in top if similarity[row] >= min_similarity]
+
+    def lookup_message(self, message: str, limit: int = 5) -> list[dict[str, Any]]:
+        """Products mentioned in a free-form customer message, by code first, then tyre size."""
+        self._ensure_loaded()
+        rows: list[int] = []
+        for token in re.findall(r"[A-Za-z0-9][A-Za-z0-9\-]{3,}", message):
+            for row in self.code_index.get(normalize_code(token), []):
+                if row not in rows:
+                    rows.append(row)
+        for match in TYRE_SIZE_PATTERN.finditer(message):
+            for row in self.size_index.get(normalize_tyre_size(match), []):
+                if row not in rows:
+                    rows.append(row)
+        return [self.record(row) for row in rows[:limit]]
+
+    def quote(
+        self,
+        product_codes: list[str],
+        quantities: list[int],
+        price_column: str = "wholesale_selling_price",
+        extra_discount_pct: float = 0.0,
+    ) -> dict[str, Any]:
+        """
+        Vectorized line totals with each product's catalog discount applied.
+        Only lines with a unique code and a price count towards the total; codes
+        not in the catalog are listed under "missing", codes shared by several
+        items under "ambiguous" with the candidates, and items without a price
+        under "unpriced".
+        """
+        if len(product_codes) != len(quantities):
+            raise ValueError("Product codes and quantities must have the same length")
+        self._ensure_loaded()
+        missing: list[str] = []
+        ambiguous: dict[str, list[dict[str, Any]]] = {}
+        found: list[int] = []
+        found_qty: list[int] = []
+        for code, quantity in zip(product_codes, quantities):
+            rows = self.code_index.get(normalize_code(code), [])
+            if not rows:
+                missing.append(code)
+            elif len(rows) > 1:
+                ambiguous[code] = [self.record(row) for row in rows]
+            else:
+                found.append(rows[0])
+                found_qty.append(quantity)
+        found_rows = np.asarray(found, dtype=np.int64)
+        qty = np.asarray(found_qty, dtype=np.float64)
+        unit_price = self.columns[price_column][found_rows]
+        priced = ~np.isnan(unit_price)
+        unpriced = [self.codes[row] for row in found_rows[~priced]]
+        found_rows, qty, unit_price = found_rows[priced], qty[priced], unit_price[priced]
+        discount = np.nan_to_num(self.columns["discount"][found_rows]) + extra_discount_pct
+        line_total = np.round(unit_price * qty * (1 - discount / 100), 2)
+        lines = [
+            {
+                "product_code": self.codes[row],
+                "item_name": self.names[row],
+                "quantity": int(q),
+                "unit_price": float(price),
+                "discount_pct": float(d),
+                "line_total": float(total),
+            }
+            for row, q, price, d, total in zip(found_rows, qty, unit_price, discount, line_total)
+        ]
+        return {
+            "lines": lines,
+            "total": float(line_total.sum()),
+            "missing": missing,
+            "ambiguous": ambiguous,
+            "unpriced": unpriced,
+        }
+
+
+# Shared instance, loaded on first use
+product_catalog: ProductCatalog = ProductCatalog()
@@ -0,0 +1,144 @@
+# utils/db/chunking.py
+"""
+Structure-aware chunking for the knowledge base sources.
+Catalog files (JSON/CSV) become one chunk per product; OCR'd brochure text is
+split on page headers and '###' delimiters, then windowed by line with overlap.
+"""
+import csv
+import hashlib
+import json
+import os
+import re
+import uuid
+from typing import Any, Iterator
+
+from loguru import logger
+
+# Default knowledge base, shared by the indexer, the lexical index and main.py
+KNOWLEDGE_BASE: list[str] = [
+    "utils/data/data.json",
+    "utils/data/tires.json",
+    "utils/data/hiview_tyres.txt",
+    "utils/data/hiview_care.txt",
+    "utils/data/green_lubes.txt",
+    "utils/data/dealer_tyres.txt",
+]
+CHUNK_MAX_CHARS: int = int(os.getenv("CHUNK_MAX_CHARS", 1200))
+CHUNK_OVERLAP: int = int(os.getenv("CHUNK_OVERLAP", 150))
+
+PAGE_HEADER = re.compile(r"^--- Information from (.+?) ---\s*$", re.MULTILINE)
+SECTION_DELIMITER = "###"
+
+# Catalog columns exposed in chunk text. buying_price is our cost and stays out.
+CATALOG_FIELDS: dict[str, str] = {
+    "product_code": "Code",
+    "retail_selling_price": "Retail price (Ksh)",
+    "wholesale_selling_price": "Wholesale price (Ksh)",
+    "units": "Units in stock",
+    "minimum_order_quantity": "Minimum order",
+    "discount": "Discount (%)",
+}
+
+
+def point_id(source_file: str, text: str) -> str:
+    """Stable Qdrant point ID derived from the chunk's source and content."""
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{source_file}#{digest}"))
+
+
+def product_chunk(record: dict[str, str]) -> dict[str, Any]:
+    """Render one catalog record as a single self-contained chunk."""
+    name = (record.get("item_name") or "").strip()
+    fields = [
+        f"{label}: {record[key].strip()}"
+        for key, label in CATALOG_FIELDS.items()
+        if (record.get(key) or "").strip()
+    ]
+    return {
+        "text": " | ".join([name, *fields]),
+        "metadata": {"product_code": record.get("product_code", ""), "kind": "product"},
+    }
+
+
+def _iter_catalog_records(path: str) -> Iterator[dict[str, str]]:
+    with open(path, mode="r", encoding="utf-8") as file:
+        if path.endswith(".json"):
+            yield from json.load(file)
+        else:
+            yield from csv.DictReader(file)
+
+
+def _window_lines(text: str, max_chars: int, overlap: int) -> Iterator[str]:
+    """Greedily pack whole lines into windows, repeating the tail of each window in the next."""
+    lines: list[str] = []
+    for line in text.splitlines():
+        # OCR output sometimes has single lines far longer than a window
+        while len(line) > max_chars:
+            lines.append(line[:max_chars])
+            line = line[max_chars - overlap :]
+        lines.append(line)
+
+    window: list[str] = []
+    size = 0
+    for line in lines:
+        if window and size + len(line) + 1 > max_chars:
+            yield "\n".join(window)
+            # Carry trailing lines forward as overlap
+            carried: list[str] = []
+            carried_size = 0
+            for previous in reversed(window):
+                if carried_size + len(previous) + 1 > overlap:
+                    break
+                carried.insert(0, previous)
+                carried_size += len(previous) + 1
+            window, size = carried, carried_size
+        window.append(line)
+        size += len(line) + 1
+    if any(line.strip() for line in window):
+        yield "\n".join(window)
+
+
+def _iter_sections(text: str) -> Iterator[tuple[str, str]]:
+    """Yield (page, section_text) for every page header / '###' section."""
+    parts = PAGE_HEADER.split(text)
+    # re.split with one group gives [preamble, page1, body1, page2, body2, ...]
+    pages = [("", parts[0])] + list(zip(parts[1::2], parts[2::2]))
+    for page, body in pages:
+        for section in body.split(SECTION_DELIMITER):
+            if section.strip():
+                yield page, section.strip()
+
+
+def iter_document_chunks(
+    path: str, max_chars: int = CHUNK_MAX_CHARS, overlap: int = CHUNK_OVERLAP
+) -> Iterator[dict[str, Any]]:
+    """Yield chunks for one source file, picking the strategy from its extension."""
+    if path.endswith((".json", ".csv")):
+        for record in _iter_catalog_records(path):
+            if record.get("item_name"):
+                yield product_chunk(record)
+        return
+
+    with open(path, mode="r", encoding="utf-8") as file:
+        text = file.read()
+    for page, section in _iter_sections(text):
+        for window in _window_lines(section, max_chars, overlap):
+            yield {
+                "text": f"[{page}]\n{window}" if page else window,
+                "metadata": {"page": page, "kind": "section"},
+            }
+
+
+def iter_chunks(
+    knowledge_paths: list[str],
+    max_chars: int = CHUNK_MAX_CHARS,
+    overlap: int = CHUNK_OVERLAP,
+) -> Iterator[dict[str, Any]]:
+    """Yield chunks with their source file for every knowledge base path."""
+    for path in knowledge_paths:
+        try:
+            for chunk in iter_document_chunks(path, max_chars, overlap):
+                chunk["source_file"] = path
+                yield chunk
+        except (OSError, ValueError) as e:
+            logger.error(f"Error processing {path}: {str(e)}")
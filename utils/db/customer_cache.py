@@ -0,0 +1,152 @@
+# utils/db/customer_cache.py
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+from loguru import logger
+
+from utils.db.base import async_engine
+from utils.metrics import SharedCounters, hit_rate
+
+# Load environment
+load_dotenv()
+
+VALKEY_HOST: str = os.getenv("VALKEY_HOST", "")
+VALKEY_PORT: int = int(os.getenv("VALKEY_PORT", 6379))
+CUSTOMER_LRU_SIZE: int = int(os.getenv("CUSTOMER_LRU_SIZE", 5_000))
+# Other processes only see an invalidation once their local copy expires
+CUSTOMER_LOCAL_TTL_SECONDS: int = int(os.getenv("CUSTOMER_LOCAL_TTL_SECONDS", 30))
+CUSTOMER_CACHE_TTL_SECONDS: int = int(os.getenv("CUSTOMER_CACHE_TTL_SECONDS", 600))
+# Unknown numbers are remembered for less time so new sign-ups show up quickly
+CUSTOMER_NEGATIVE_TTL_SECONDS: int = int(os.getenv("CUSTOMER_NEGATIVE_TTL_SECONDS", 120))
+# pg_notify channel written by the customers_notify_change trigger in init_db.sql
+CUSTOMER_CHANGES_CHANNEL = "customer_changed"
+CUSTOMER_METRICS_KEY = "metrics:customer_cache"
+
+
+def customer_key(phone_number: str) -> str:
+    return f"customer:{phone_number}"
+
+
+class CustomerCache:
+    """
+    Read-through cache for customer profiles keyed by phone number.
+    A short-lived in-process LRU sits in front of Valkey. Unknown numbers are
+    cached as empty results too, so a stranger messaging repeatedly costs one
+    query per TTL. Rows are written outside the app, so listen_for_changes()
+    invalidates customers as Postgres reports changes to them.
+    """
+
+    def __init__(self, lru_size: int = CUSTOMER_LRU_SIZE):
+        self.lru_size = lru_size
+        self._lru: OrderedDict[str, tuple[float, list[dict[str, Any]]]] = OrderedDict()
+        self._redis: redis.Redis | None = None
+        self._pending: set[asyncio.Task] = set()
+        self.counters = SharedCounters(CUSTOMER_METRICS_KEY, ["memory_hits", "valkey_hits", "misses"])
+
+    @property
+    def redis(self) -> redis.Redis:
+        if self._redis is None:
+            self._redis = redis.Redis(
+                host=VALKEY_HOST, port=VALKEY_PORT, db=0, decode_responses=True
+            )
+        return self._redis
+
+    def _remember(self, phone_number: str, rows: list[dict[str, Any]]) -> None:
+        self._lru[phone_number] = (time.monotonic() + CUSTOMER_LOCAL_TTL_SECONDS, rows)
+        self._lru.move_to_end(phone_number)
+        if len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    async def get(
+        self,
+        phone_number: str,
+        load: Callable[[str], Awaitable[list[dict[str, Any]]]],
+    ) -> list[dict[str, Any]]:
+        """Cached rows for the number, calling load(phone_number) on a miss."""
+        if cached := self._lru.get(phone_number):
+            expires_at, rows = cached
+            if expires_at > time.monotonic():
+                self._lru.move_to_end(phone_number)
+                self.counters["memory_hits"] += 1
+                return rows
+            del self._lru[phone_number]
+
+        try:
+            if (blob := await self.redis.get(customer_key(phone_number))) is not None:
+                rows = json.loads(blob)
+                self._remember(phone_number, rows)
+                self.counters["valkey_hits"] += 1
+                return rows
+        except Exception as e:
+            logger.warning(f"Customer cache Valkey read failed: {e}")
+
+        self.counters["misses"] += 1
+        rows = await load(phone_number)
+        self._remember(phone_number, rows)
+        try:
+            await self.redis.set(
+                customer_key(phone_number),
+                json.dumps(rows, default=str),
+                ex=CUSTOMER_CACHE_TTL_SECONDS if rows else CUSTOMER_NEGATIVE_TTL_SECONDS,
+            )
+        except Exception as e:
+            logger.warning(f"Customer cache Valkey write failed: {e}")
+        return rows
+
+    async def invalidate(self, phone_number: str) -> None:
+        """Drop a customer everywhere we can reach; call after any write to their row."""
+        self._lru.pop(phone_number, None)
+        try:
+            await self.redis.delete(customer_key(phone_number))
+        except Exception as e:
+            logger.warning(f"Customer cache invalidation failed for {phone_number}: {e}")
+
+    async def listen_for_changes(self, stop: asyncio.Event | None = None) -> None:
+        """
+        Invalidate customers named on CUSTOMER_CHANGES_CHANNEL until stopped.
+        Every process runs one so its own LRU is cleared too. Notifications
+        sent while disconnected are lost, so the LRU is emptied on each
+        (re)connect; Valkey entries missed that way expire with their TTL.
+        """
+        stop = stop or asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        def on_change(connection, pid, channel, phone_number) -> None:
+            task = loop.create_task(self.invalidate(phone_number))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+        while not stop.is_set():
+            try:
+                async with async_engine.connect() as conn:
+                    driver = (await conn.get_raw_connection()).driver_connection
+                    await driver.add_listener(CUSTOMER_CHANGES_CHANNEL, on_change)
+                    self._lru.clear()
+                    try:
+                        while not stop.is_set() and not driver.is_closed():
+                            try:
+                                await asyncio.wait_for(stop.wait(), timeout=30)
+                            except asyncio.TimeoutError:
+                                pass
+                    finally:
+                        if not driver.is_closed():
+                            await driver.remove_listener(CUSTOMER_CHANGES_CHANNEL, on_change)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Customer change listener failed, reconnecting: {e}")
+                await asyncio.sleep(5)
+
+    async def stats(self, client: redis.Redis) -> dict[str, float]:
+        counters = await self.counters.read(client)
+        return {**counters, "hit_rate": hit_rate(counters, ["memory_hits", "valkey_hits"])}
+
+
+# Shared instance used by get_customer_details
+customer_cache: CustomerCache = CustomerCache()
@@ -0,0 +1,135 @@
+# utils/db/embedding_cache.py
+import hashlib
+import os
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+from loguru import logger
+
+from utils.metrics import SharedCounters, hit_rate
+
+# Load environment
+load_dotenv()
+
+VALKEY_HOST: str = os.getenv("VALKEY_HOST", "")
+VALKEY_PORT: int = int(os.getenv("VALKEY_PORT", 6379))
+EMBEDDING_LRU_SIZE: int = int(os.getenv("EMBEDDING_LRU_SIZE", 20_000))
+EMBEDDING_CACHE_TTL_SECONDS: int = int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+EMBEDDING_CACHE_MAX_ENTRIES: int = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 500_000))
+INDEX_KEY = "emb:index"
+EMBEDDING_METRICS_KEY = "metrics:embedding_cache"
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form used for cache keys: NFKC, case-folded, single-spaced."""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+def cache_key(model: str, text: str) -> str:
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"emb:{model}:{digest}"
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache keyed by (model, hash of normalized text).
+    An in-process LRU sits in front of Valkey, where vectors are stored as
+    packed float32 with a TTL. The Valkey tier is capped at max_entries by
+    evicting the least recently written keys.
+    """
+
+    def __init__(
+        self,
+        lru_size: int = EMBEDDING_LRU_SIZE,
+        ttl: int = EMBEDDING_CACHE_TTL_SECONDS,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+    ):
+        self.lru_size = lru_size
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lru: OrderedDict[str, list[float]] = OrderedDict()
+        self._redis: redis.Redis | None = None
+        self.counters = SharedCounters(EMBEDDING_METRICS_KEY, ["memory_hits", "valkey_hits", "misses"])
+
+    @property
+    def redis(self) -> redis.Redis:
+        # Binary-safe client: vectors are stored as raw bytes
+        if self._redis is None:
+            self._redis = redis.Redis(host=VALKEY_HOST, port=VALKEY_PORT, db=0)
+        return self._redis
+
+    def _remember(self, key: str, vector: list[float]) -> None:
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    async def get_many(self, model: str, texts: list[str]) -> list[list[float] | None]:
+        """Look up every text, returning None where the embedding is not cached."""
+        keys = [cache_key(model, text) for text in texts]
+        results: list[list[float] | None] = [None] * len(keys)
+        remote: list[int] = []
+        for i, key in enumerate(keys):
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                results[i] = self._lru[key]
+                self.counters["memory_hits"] += 1
+            else:
+                remote.append(i)
+
+        if remote:
+            try:
+                blobs = await self.redis.mget([keys[i] for i in remote])
+            except Exception as e:
+                logger.warning(f"Embedding cache Valkey read failed: {e}")
+                blobs = [None] * len(remote)
+            for i, blob in zip(remote, blobs):
+                if blob is None:
+                    self.counters["misses"] += 1
+                    continue
+                vector = array("f", blob).tolist()
+                results[i] = vector
+                self._remember(keys[i], vector)
+                self.counters["valkey_hits"] += 1
+        return results
+
+    async def put_many(
+        self, model: str, texts: list[str], vectors: list[list[float]]
+    ) -> None:
+        """Store embeddings in both tiers."""
+        keys = [cache_key(model, text) for text in texts]
+        for key, vector in zip(keys, vectors):
+            self._remember(key, vector)
+        try:
+            now = time.time()
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, vector in zip(keys, vectors):
+                    pipe.set(key, array("f", vector).tobytes(), ex=self.ttl)
+                pipe.zadd(INDEX_KEY, {key: now for key in keys})
+                # Scores are write times, so anything older than the TTL has already expired
+                pipe.zremrangebyscore(INDEX_KEY, "-inf", now - self.ttl)
+                pipe.zcard(INDEX_KEY)
+                *_, size = await pipe.execute()
+            if size > self.max_entries:
+                evicted = await self.redis.zpopmin(INDEX_KEY, size - self.max_entries)
+                if evicted:
+                    await self.redis.delete(*(key for key, _ in evicted))
+        except Exception as e:
+            logger.warning(f"Embedding cache Valkey write failed: {e}")
+
+    async def stats(self, client: redis.Redis) -> dict[str, float]:
+        """Hit counts across all processes, plus the Valkey tier's size."""
+        counters = await self.counters.read(client)
+        return {
+            **counters,
+            "valkey_entries": await client.zcard(INDEX_KEY),
+            "hit_rate": hit_rate(counters, ["memory_hits", "valkey_hits"]),
+        }
+
+
+# Shared instance used by the retriever and ingestion
+embedding_cache: EmbeddingCache = EmbeddingCache()
@@ -1,17 +1,101 @@
+import asyncio
 import os
 import csv
+import hashlib
 import re
 import json
+import math
+import time
 from neo4j import GraphDatabase
 from dotenv import load_dotenv
 from loguru import logger
-from ollama import Client
+from ollama import AsyncClient
+from utils.catalog import parse_number
+from utils.db.graph_retriever import PART_FULLTEXT_INDEX
 from utils.llm.llm_base import (
     llm_model,
-)  # Use the synchronous client for a one-off script
+)
 
 load_dotenv()
 
+# Rows written per UNWIND transaction
+GRAPH_BATCH_SIZE: int = int(os.getenv("GRAPH_BATCH_SIZE", 500))
+# Concurrent extraction requests to Ollama and where their results are kept
+EXTRACTION_CONCURRENCY: int = int(os.getenv("EXTRACTION_CONCURRENCY", 4))
+EXTRACTION_CACHE_DIR: str = os.getenv("EXTRACTION_CACHE_DIR", "utils/data/extraction_cache")
+CSV_SOURCES: dict[str, str] = {
+    "utils/data/tires.csv": "Tire",
+    "utils/data/data.csv": "Part",
+}
+TEXT_SOURCES: list[str] = [
+    "utils/data/green_lubes.txt",
+    # Add more .txt files here
+    "utils/data/dealer_tyres.txt",
+    "utils/data/hiview_care.txt",
+    "utils/data/hiview_tyres.txt",
+]
+
+CSV_INGEST_QUERY = """
+UNWIND $rows AS row
+MERGE (b:Brand {name: row.brand_name})
+MERGE (c:Category {name: row.category})
+MERGE (p:Part {product_code: row.product_code})
+ON CREATE SET p.name = row.item_name, p.wholesale_price = row.wholesale_price, p.retail_price = row.retail_price, p.stock = row.units
+MERGE (p)-[:MANUFACTURED_BY]->(b)
+MERGE (p)-[:BELONGS_TO]->(c)
+MERGE (s:Specification {type: 'Tire Size', value: row.tire_size})
+MERGE (p)-[:HAS_SPEC]->(s)
+"""
+
+CSV_UPDATE_QUERY = """
+UNWIND $rows AS row
+MATCH (p:Part {product_code: row.product_code})
+SET p.name = row.item_name, p.wholesale_price = row.wholesale_price, p.retail_price = row.retail_price, p.stock = row.units
+"""
+
+CSV_DELETE_QUERY = """
+UNWIND $rows AS code
+MATCH (p:Part {product_code: code})
+DETACH DELETE p
+"""
+
+# Labels written by the builder. A full rebuild writes them with a staging
+# prefix and swaps them in one transaction, so readers never see a partial graph.
+GRAPH_LABELS: list[str] = ["Part", "Brand", "Category", "Specification", "Feature"]
+STAGING_PREFIX = "Staged"
+LABEL_PATTERN = re.compile(r":(" + "|".join(GRAPH_LABELS) + r")\b")
+# Fields compared when syncing the CSV catalog against existing Part nodes
+SYNC_FIELDS: list[str] = ["item_name", "wholesale_price", "retail_price", "units"]
+
+PRODUCT_INGEST_QUERY = """
+UNWIND $rows AS row
+MERGE (b:Brand {name: row.brand_name})
+MERGE (c:Category {name: row.category})
+MERGE (p:Part {name: row.product_name})
+ON CREATE SET p.description = row.description, p.source_file = row.source_file
+MERGE (p)-[:MANUFACTURED_BY]->(b)
+MERGE (p)-[:BELONGS_TO]->(c)
+WITH p, row
+CALL {
+    WITH p, row
+    UNWIND row.specifications AS spec
+    MERGE (s:Specification {type: spec.type, value: spec.value})
+    MERGE (p)-[:HAS_SPEC]->(s)
+}
+CALL {
+    WITH p, row
+    UNWIND row.features AS feature_text
+    MERGE (f:Feature {description: feature_text})
+    MERGE (p)-[:HAS_FEATURE]->(f)
+}
+"""
+
+def _number(value: str | None) -> float | None:
+    """Parse price list numbers like "5,281"; None (stored as null) when blank."""
+    number = parse_number(value)
+    return None if math.isnan(number) else number
+
+
 EXTRACTION_PROMPT = """
 You are an expert data extraction agent. Your task is to analyze the following text chunk from an auto parts catalog and extract all products, their brand, category, specifications, and features into a structured JSON format.
 
@@ -38,8 +122,10 @@ class Neo4jGraphBuilder:
         user = os.getenv("NEO4J_USER")
         password = os.getenv("NEO4J_PASSWORD")
         self.driver = GraphDatabase.driver(uri, auth=(user, password))
-        self.ollama_client = Client(host=os.getenv("OLLAMA_HOST"))
+        self.ollama_client = AsyncClient(host=os.getenv("OLLAMA_HOST"))
         self.llm_model = llm_model
+        # When set, every write goes to the staging labels (see build_graph)
+        self.staging = False
 
     def close(self):
         self.driver.close()
@@ -50,41 +136,143 @@ class Neo4jGraphBuilder:
             return [record for record in result]
 
     def build_graph(self):
+        """
+        Full blue/green rebuild: the new graph is written under staging labels
+        while readers keep using the live one, then swapped in atomically.
+        """
         logger.info("Starting knowledge graph build...")
-        self.run_query("MATCH (n) DETACH DELETE n")
-        logger.info("Cleared old graph data.")
-
         self._create_constraints()
-        self._ingest_csv("utils/data/tires.csv", "Tire")
-        self._ingest_csv("utils/data/data.csv", "Part")
-        self._ingest_text_file("utils/data/green_lubes.txt")
-        # Add more .txt files here
-        self._ingest_text_file("utils/data/dealer_tyres.txt")
-        self._ingest_text_file("utils/data/hiview_care.txt")
-        self._ingest_text_file("utils/data/hiview_tyres.txt")
+        # Leftovers from an interrupted rebuild
+        self._delete_labels([STAGING_PREFIX + label for label in GRAPH_LABELS])
 
+        self.staging = True
+        try:
+            for file_path, category in CSV_SOURCES.items():
+                self._ingest_csv(file_path, category)
+            asyncio.run(self.ingest_text_files(TEXT_SOURCES))
+        finally:
+            self.staging = False
+
+        self._swap_staged_graph()
         logger.success("Knowledge graph build complete.")
 
-    def _create_constraints(self):
-        self.run_query("DROP CONSTRAINT part_name IF EXISTS")
-        self.run_query(
-            "CREATE CONSTRAINT part_code IF NOT EXISTS FOR (p:Part) REQUIRE p.product_code IS UNIQUE"
-        )
-        self.run_query(
-            "CREATE CONSTRAINT brand_name IF NOT EXISTS FOR (b:Brand) REQUIRE b.name IS UNIQUE"
-        )
-        self.run_query(
-            "CREATE CONSTRAINT category_name IF NOT EXISTS FOR (c:Category) REQUIRE c.name IS UNIQUE"
-        )
+    def sync_graph(self) -> dict[str, int]:
+        """
+        Incremental sync of the CSV catalogs: diff against the live Part nodes by
+        product_code and apply only inserts, price/stock updates and deletions.
+        """
+        logger.info("Starting incremental catalog sync...")
+        self._create_constraints()
+        desired: dict[str, dict] = {}
+        for file_path, category in CSV_SOURCES.items():
+            for row in self._read_csv_rows(file_path, category):
+                desired[row["product_code"]] = row
+
+        current: dict[str, dict] = {
+            record["product_code"]: dict(record)
+            for record in self.run_query(
+                """
+                MATCH (p:Part) WHERE p.product_code IS NOT NULL
+                RETURN p.product_code AS product_code, p.name AS item_name,
+                       p.wholesale_price AS wholesale_price, p.retail_price AS retail_price,
+                       p.stock AS units
+                """
+            )
+        }
+        inserts = [row for code, row in desired.items() if code not in current]
+        updates = [
+            row
+            for code, row in desired.items()
+            if code in current
+            and any(row[field] != current[code][field] for field in SYNC_FIELDS)
+        ]
+        deletes = [code for code in current if code not in desired]
+
+        self.write_batches(CSV_INGEST_QUERY, inserts, "catalog inserts")
+        self.write_batches(CSV_UPDATE_QUERY, updates, "catalog updates")
+        self.write_batches(CSV_DELETE_QUERY, deletes, "catalog deletes")
+        stats = {"inserted": len(inserts), "updated": len(updates), "deleted": len(deletes)}
+        logger.success(f"Catalog sync complete: {stats}")
+        return stats
+
+    def _delete_labels(self, labels: list[str]) -> None:
+        predicate = " OR ".join(f"n:{label}" for label in labels)
         self.run_query(
-            "CREATE CONSTRAINT feature_desc IF NOT EXISTS FOR (f:Feature) REQUIRE f.description IS UNIQUE"
+            f"MATCH (n) WHERE {predicate} CALL {{ WITH n DETACH DELETE n }} IN TRANSACTIONS OF 10000 ROWS"
         )
+
+    def _swap_staged_graph(self) -> None:
+        """Replace the live graph with the staged one in a single transaction."""
+        live = " OR ".join(f"n:{label}" for label in GRAPH_LABELS)
+
+        def swap(tx):
+            tx.run(f"MATCH (n) WHERE {live} DETACH DELETE n").consume()
+            for label in GRAPH_LABELS:
+                tx.run(
+                    f"MATCH (n:{STAGING_PREFIX}{label}) REMOVE n:{STAGING_PREFIX}{label} SET n:{label}"
+                ).consume()
+
+        with self.driver.session() as session:
+            session.execute_write(swap)
+        logger.info("Swapped the staged graph in.")
+
+    def _create_constraints(self):
+        self.run_query("DROP CONSTRAINT part_name IF EXISTS")
+        # The staging labels get the same constraints so MERGE stays index-backed
+        for prefix in ("", STAGING_PREFIX):
+            self.run_query(
+                f"CREATE CONSTRAINT {prefix.lower()}part_code IF NOT EXISTS FOR (p:{prefix}Part) REQUIRE p.product_code IS UNIQUE"
+            )
+            self.run_query(
+                f"CREATE CONSTRAINT {prefix.lower()}brand_name IF NOT EXISTS FOR (b:{prefix}Brand) REQUIRE b.name IS UNIQUE"
+            )
+            self.run_query(
+                f"CREATE CONSTRAINT {prefix.lower()}category_name IF NOT EXISTS FOR (c:{prefix}Category) REQUIRE c.name IS UNIQUE"
+            )
+            self.run_query(
+                f"CREATE CONSTRAINT {prefix.lower()}feature_desc IF NOT EXISTS FOR (f:{prefix}Feature) REQUIRE f.description IS UNIQUE"
+            )
+            self.run_query(
+                f"CREATE CONSTRAINT {prefix.lower()}spec_val IF NOT EXISTS FOR (s:{prefix}Specification) REQUIRE (s.type, s.value) IS UNIQUE"
+            )
+        # Full-text index for customer part searches. standard-no-stop-words
+        # lowercases and splits codes like POW-35-MF-NSL on punctuation, and keeps
+        # short tokens such as "N50" that a stop-word list could drop.
         self.run_query(
-            "CREATE CONSTRAINT spec_val IF NOT EXISTS FOR (s:Specification) REQUIRE (s.type, s.value) IS UNIQUE"
+            f"""
+            CREATE FULLTEXT INDEX {PART_FULLTEXT_INDEX} IF NOT EXISTS
+            FOR (p:Part) ON EACH [p.name, p.product_code]
+            OPTIONS {{indexConfig: {{`fulltext.analyzer`: 'standard-no-stop-words'}}}}
+            """
         )
-        logger.info("Created/updated uniqueness constraints in Neo4j.")
+        logger.info("Created/updated uniqueness constraints and indexes in Neo4j.")
+
+    def write_batches(self, query: str, rows: list, label: str) -> int:
+        """Write rows with an UNWIND query, one managed write transaction per batch."""
+        if self.staging:
+            query = LABEL_PATTERN.sub(lambda m: f":{STAGING_PREFIX}{m.group(1)}", query)
+        start = time.perf_counter()
+        written = 0
+        with self.driver.session() as session:
+            for i in range(0, len(rows), GRAPH_BATCH_SIZE):
+                batch = rows[i : i + GRAPH_BATCH_SIZE]
+                try:
+                    session.execute_write(lambda tx: tx.run(query, rows=batch).consume())
+                    written += len(batch)
+                except Exception as e:
+                    logger.error(f"Failed to write batch {i // GRAPH_BATCH_SIZE + 1} of {label}: {e}")
+        elapsed = time.perf_counter() - start
+        rate = written / elapsed if elapsed else 0.0
+        logger.info(f"Wrote {written}/{len(rows)} rows from {label} in {elapsed:.2f}s ({rate:.0f} rows/s)")
+        return written
 
     def _ingest_csv(self, file_path, category):
+        rows = self._read_csv_rows(file_path, category)
+        self.write_batches(CSV_INGEST_QUERY, rows, file_path)
+        logger.info(f"Finished ingesting {file_path}.")
+
+    def _read_csv_rows(self, file_path: str, category: str) -> list[dict]:
+        rows: list[dict] = []
         with open(file_path, mode="r", encoding="utf-8") as file:
             reader = csv.DictReader(file)
             for row in reader:
@@ -98,107 +286,158 @@ class Neo4jGraphBuilder:
                     )
                     tire_size = size_match.group(1) if size_match else "Unknown"
 
-                    query = """
-                    MERGE (b:Brand {name: $brand_name})
-                    MERGE (c:Category {name: 'Tire'})
-                    MERGE (p:Part {product_code: $product_code})
-                    ON CREATE SET p.name = $item_name, p.wholesale_price = toFloat($wholesale_price), p.retail_price = toFloat($retail_price), p.stock = toInteger($units)
-                    MERGE (p)-[:MANUFACTURED_BY]->(b)
-                    MERGE (p)-[:BELONGS_TO]->(c)
-                    MERGE (s:Specification {type: 'Tire Size', value: $tire_size})
-                    MERGE (p)-[:HAS_SPEC]->(s)
-                    """
-                    self.run_query(
-                        query,
+                    rows.append(
                         {
                             "brand_name": brand_name,
+                            "category": category,
                             "product_code": row["product_code"],
                             "item_name": row["item_name"],
-                            "wholesale_price": row["wholesale_selling_price"],
-                            "retail_price": row["retail_selling_price"],
-                            "units": row["units"],
+                            "wholesale_price": _number(row["wholesale_selling_price"]),
+                            "retail_price": _number(row["retail_selling_price"]),
+                            "units": None if (units := _number(row["units"])) is None else int(units),
                             "tire_size": tire_size,
-                        },
+                        }
                     )
                 except Exception as e:
                     logger.warning(
                         f"Skipping row in {file_path} due to error: {e} | Row: {row}"
                     )
-        logger.info(f"Finished ingesting {file_path}.")
+        return rows
 
     def _ingest_text_file(self, file_path):
-        logger.info(f"Starting ingestion for text file: {file_path}")
-        with open(file_path, "r", encoding="utf-8") as f:
-            full_text = f.read()
+        asyncio.run(self.ingest_text_files([file_path]))
 
-        # Split text into manageable chunks (e.g., by product or paragraph)
-        chunks = full_text.split(
-            "###"
-        )  # Use a clear delimiter like '###' between product descriptions in your .txt files
+    def _extraction_cache_path(self, chunk: str) -> str:
+        # The prompt and model are part of the key so changing either re-extracts
+        key = hashlib.sha256(
+            f"{self.llm_model}\n{EXTRACTION_PROMPT}\n{chunk}".encode("utf-8")
+        ).hexdigest()
+        return os.path.join(EXTRACTION_CACHE_DIR, f"{key}.json")
 
-        for chunk in chunks:
-            if len(chunk.strip()) < 50:
-                continue  # Skip very small chunks
+    async def _extract_chunk(self, chunk: str) -> tuple[list[dict], bool]:
+        """Extract products from one chunk, returning (products, served_from_cache)."""
+        cache_path = self._extraction_cache_path(chunk)
+        if os.path.exists(cache_path):
+            with open(cache_path, "r", encoding="utf-8") as f:
+                return json.load(f), True
 
-            prompt = EXTRACTION_PROMPT.format(text_chunk=chunk)
+        prompt = EXTRACTION_PROMPT.format(text_chunk=chunk)
+        response = await self.ollama_client.generate(model=self.llm_model, prompt=prompt)
+        json_text = response["response"]
 
-            try:
-                response = self.ollama_client.generate(
-                    model=self.llm_model, prompt=prompt
-                )
-                json_text = response["response"]
+        # Clean the LLM output to get only the JSON
+        json_text = json_text[json_text.find("{") : json_text.rfind("}") + 1]
+        data = json.loads(json_text)
+        products = data.get("products") if isinstance(data.get("products"), list) else []
+
+        # Write atomically so a crash mid-write never leaves a truncated cache entry
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(products, f)
+        os.replace(tmp_path, cache_path)
+        return products, False
 
-                # Clean the LLM output to get only the JSON
-                json_text = json_text[json_text.find("{") : json_text.rfind("}") + 1]
-                data = json.loads(json_text)
+    async def _extract_file(
+        self, file_path: str, queue: asyncio.Queue, semaphore: asyncio.Semaphore, stats: dict[str, int]
+    ) -> None:
+        with open(file_path, "r", encoding="utf-8") as f:
+            full_text = f.read()
 
-                if "products" in data and isinstance(data["products"], list):
-                    for product in data["products"]:
-                        self._create_product_nodes(product, file_path)
+        # Use a clear delimiter like '###' between product descriptions in your .txt files
+        chunks = [chunk for chunk in full_text.split("###") if len(chunk.strip()) >= 50]
 
-            except json.JSONDecodeError:
-                logger.error(
-                    f"Failed to decode JSON from LLM output for chunk: {chunk[:100]}..."
+        async def extract(chunk: str) -> None:
+            async with semaphore:
+                try:
+                    products, cached = await self._extract_chunk(chunk)
+                except json.JSONDecodeError:
+                    logger.error(f"Failed to decode JSON from LLM output for chunk: {chunk[:100]}...")
+                    stats["failed"] += 1
+                    return
+                except Exception as e:
+                    logger.error(f"An error occurred during LLM extraction: {e}")
+                    stats["failed"] += 1
+                    return
+            stats["cached" if cached else "extracted"] += 1
+            rows = [row for p in products if (row := self._product_row(p, file_path))]
+            if rows:
+                await queue.put(rows)
+
+        await asyncio.gather(*(extract(chunk) for chunk in chunks))
+        logger.info(f"Finished extracting text file: {file_path} ({len(chunks)} chunks).")
+
+    async def _write_extracted(self, queue: asyncio.Queue) -> int:
+        """Write product rows to Neo4j as extractions complete, until a None sentinel."""
+        written = 0
+        pending: list[dict] = []
+        while True:
+            rows = await queue.get()
+            if rows is not None:
+                pending.extend(rows)
+            # Flush when a batch is full or nothing else is waiting, so the graph fills as we go
+            if pending and (rows is None or len(pending) >= GRAPH_BATCH_SIZE or queue.empty()):
+                written += await asyncio.to_thread(
+                    self.write_batches, PRODUCT_INGEST_QUERY, pending, "text extraction"
                 )
-            except Exception as e:
-                logger.error(f"An error occurred during LLM extraction: {e}")
-
-        logger.info(f"Finished ingesting text file: {file_path}.")
-
-    def _create_product_nodes(self, product_data: dict, source_file: str):
-        query = """
-        MERGE (b:Brand {name: $brand_name})
-        MERGE (c:Category {name: $category})
-        MERGE (p:Part {name: $product_name})
-        ON CREATE SET p.description = $description, p.source_file = $source_file
-        MERGE (p)-[:MANUFACTURED_BY]->(b)
-        MERGE (p)-[:BELONGS_TO]->(c)
-
-        WITH p
-        UNWIND $specifications AS spec
-        MERGE (s:Specification {type: spec.type, value: spec.value})
-        MERGE (p)-[:HAS_SPEC]->(s)
-
-        WITH p
-        UNWIND $features AS feature_text
-        MERGE (f:Feature {description: feature_text})
-        MERGE (p)-[:HAS_FEATURE]->(f)
+                pending = []
+            if rows is None:
+                return written
+
+    async def ingest_text_files(self, file_paths: list[str]) -> dict[str, int]:
+        """
+        Extract products from text files with a bounded pool of concurrent LLM calls.
+        Each chunk's extraction is cached on disk by content hash, so reruns only
+        re-extract new or changed chunks, and products are written to Neo4j while
+        other chunks are still being extracted.
         """
-        params = {
-            "brand_name": product_data.get("brand", "Unknown"),
-            "category": product_data.get("category", "Uncategorized"),
-            "product_name": product_data.get("product_name"),
+        os.makedirs(EXTRACTION_CACHE_DIR, exist_ok=True)
+        start = time.perf_counter()
+        stats = {"extracted": 0, "cached": 0, "failed": 0}
+        queue: asyncio.Queue = asyncio.Queue()
+        semaphore = asyncio.Semaphore(EXTRACTION_CONCURRENCY)
+        writer = asyncio.create_task(self._write_extracted(queue))
+        try:
+            await asyncio.gather(
+                *(self._extract_file(path, queue, semaphore, stats) for path in file_paths)
+            )
+        finally:
+            await queue.put(None)
+            stats["written"] = await writer
+        logger.info(
+            f"Text ingestion finished in {time.perf_counter() - start:.1f}s: {stats}"
+        )
+        return stats
+
+    @staticmethod
+    def _product_row(product_data: dict, source_file: str) -> dict | None:
+        """Flatten one LLM-extracted product into UNWIND parameters, or None if unnamed."""
+        if not isinstance(product_data, dict) or not product_data.get("product_name"):
+            return None
+        specifications: list[dict[str, str]] = []
+        for spec in product_data.get("specifications") or []:
+            if isinstance(spec, dict) and "type" in spec:
+                specifications.append({"type": str(spec["type"]), "value": str(spec.get("value", ""))})
+            elif isinstance(spec, dict):
+                # The model sometimes returns {"Viscosity": "5W-30"} instead of type/value pairs
+                specifications.extend({"type": str(k), "value": str(v)} for k, v in spec.items())
+        return {
+            "brand_name": product_data.get("brand") or "Unknown",
+            "category": product_data.get("category") or "Uncategorized",
+            "product_name": product_data["product_name"],
             "description": product_data.get("description", ""),
             "source_file": source_file,
-            "specifications": product_data.get("specifications", []),
-            "features": product_data.get("features", []),
+            "specifications": specifications,
+            "features": [str(f) for f in product_data.get("features") or [] if f],
         }
-        if params["product_name"]:  # Only run if a product name was extracted
-            self.run_query(query, params)
-            logger.debug(f"Ingested product: {params['product_name']}")
 
 
 if __name__ == "__main__":
+    import sys
+
+    # python -m utils.db.graph_builder [rebuild|sync]
     builder = Neo4jGraphBuilder()
-    builder.build_graph()
+    if len(sys.argv) > 1 and sys.argv[1] == "sync":
+        builder.sync_graph()
+    else:
+        builder.build_graph()
     builder.close()
@@ -5,12 +5,62 @@ from typing import Any
 
 
 import os
+import re
 from neo4j import AsyncGraphDatabase
 from dotenv import load_dotenv
 from loguru import logger
 
 load_dotenv()
 
+PART_FULLTEXT_INDEX = "part_name_fulltext"
+GRAPH_TOP_K: int = int(os.getenv("GRAPH_TOP_K", 5))
+# Filler words in customer messages (English and Swahili) that never name a part
+STOP_WORDS: set[str] = {
+    "a", "an", "and", "are", "do", "for", "have", "hi", "how", "i", "is", "it",
+    "me", "much", "need", "of", "please", "price", "the", "to", "want", "what",
+    "you", "your", "bei", "gani", "hello", "habari", "mna", "mnayo", "na", "naomba",
+    "ni", "niko", "nataka", "tafadhali", "ya", "za", "ziko",
+}
+# Characters with meaning in Lucene query syntax
+LUCENE_SPECIAL = re.compile(r'([+\-&|!(){}\[\]^"~*?:\\/])')
+
+
+def extract_search_terms(message: str, max_terms: int = 8) -> list[str]:
+    """Pull candidate part-name terms out of a free-form customer message."""
+    terms: list[str] = []
+    for token in re.findall(r"[A-Za-z0-9][A-Za-z0-9\-/.]*", message):
+        token = token.strip(".-/").lower()
+        if len(token) < 2 or token in STOP_WORDS or token in terms:
+            continue
+        terms.append(token)
+    return terms[:max_terms]
+
+
+# Where the standard analyzer (Unicode word breaks) splits inside a code: on hyphens
+# and slashes, and on a dot unless it sits between two digits or two letters, so
+# "12.4-24" is indexed as "12.4" and "24"
+ANALYZER_SPLIT = re.compile(r"[-/]|\.{2,}|(?<=\d)\.(?=[a-z])|(?<=[a-z])\.(?=\d)")
+
+
+def analyzer_tokens(term: str) -> list[str]:
+    """Split a punctuated term the way the part_name_fulltext index does."""
+    return [part.strip(".") for part in ANALYZER_SPLIT.split(term) if part.strip(".")]
+
+
+def build_fulltext_query(terms: list[str]) -> str:
+    """OR together terms; longer words get typo tolerance, codes also match as a phrase."""
+    clauses: list[str] = []
+    for term in terms:
+        escaped = LUCENE_SPECIAL.sub(r"\\\1", term)
+        if re.search(r"[-/.]", term):
+            # Match the code's index tokens in order
+            clauses.append(f'"{" ".join(analyzer_tokens(term))}"^3')
+        elif len(term) >= 5 and term.isalpha():
+            clauses.append(f"{escaped}~1")
+        else:
+            clauses.append(escaped)
+    return " OR ".join(clauses)
+
 
 class GraphRetriever:
     def __init__(self):
@@ -22,17 +72,26 @@ class GraphRetriever:
     async def close(self):
         await self._driver.close()
 
-    async def search_parts_by_name(self, part_name: str) -> tuple[list[Any], Any]:
-        """Find parts and their prices by name, using fuzzy search."""
-        query = """
-        MATCH (p:Part)-[:MANUFACTURED_BY]->(b:Brand)
-        WHERE toLower(p.name) CONTAINS toLower($part_name)
-        RETURN b.name AS brand, p.name AS part_name, p.product_code AS code, p.wholesale_price AS price
-        LIMIT 5
+    async def search_parts_by_name(
+        self, part_name: str, top_k: int = GRAPH_TOP_K
+    ) -> tuple[list[Any], Any]:
+        """Find parts and their prices from a customer message, using the full-text index."""
+        terms = extract_search_terms(part_name)
+        if not terms:
+            return [], None
+        query = f"""
+        CALL db.index.fulltext.queryNodes('{PART_FULLTEXT_INDEX}', $search, {{limit: $top_k}})
+        YIELD node AS p, score
+        OPTIONAL MATCH (p)-[:MANUFACTURED_BY]->(b:Brand)
+        RETURN b.name AS brand, p.name AS part_name, p.product_code AS code, p.wholesale_price AS price, score
+        ORDER BY score DESC
+        LIMIT $top_k
         """
         async with self._driver.session() as session:
-            result = await session.run(query, part_name=part_name)
-            values = [record.values() for record in await result.fetch(5)] # #Get 5 the top 5 results and the stash the rest
+            result = await session.run(
+                query, search=build_fulltext_query(terms), top_k=top_k
+            )
+            values = [record.values() for record in await result.fetch(top_k)]
             summary=await result.consume()
             return values, summary
 
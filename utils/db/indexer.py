@@ -0,0 +1,140 @@
+# utils/db/indexer.py
+"""
+Incremental Qdrant indexer for the knowledge base.
+Each source file is hashed; unchanged files are skipped, and for changed files
+only chunks whose content-derived point ID is new get embedded, while IDs that
+disappeared are deleted. Run it on demand with:
+    python -m utils.db.indexer
+"""
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any
+
+from dotenv import load_dotenv
+from loguru import logger
+from qdrant_client import models
+
+from utils.db.chunking import KNOWLEDGE_BASE
+from utils.db.qdrant import COLLECTION_NAME, HybridRetriever, standard_retriever
+
+# Load environment
+load_dotenv()
+
+MANIFEST_PATH: str = os.getenv("INDEX_MANIFEST_PATH", "utils/data/index_manifest.json")
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_manifest(collection_name: str) -> dict[str, dict[str, Any]]:
+    """Return {source_file: {"hash": str, "points": [ids]}} for the collection."""
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f).get(collection_name, {})
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(collection_name: str, files: dict[str, dict[str, Any]]) -> None:
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        manifest = {}
+    manifest[collection_name] = files
+    tmp_path = f"{MANIFEST_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+async def _delete_points(retriever: HybridRetriever, collection_name: str, ids: list[str]) -> None:
+    if ids:
+        await retriever.client.delete(
+            collection_name=collection_name,
+            points_selector=models.PointIdsList(points=ids),
+        )
+
+
+async def reindex(
+    knowledge_paths: list[str] = KNOWLEDGE_BASE,
+    collection_name: str = COLLECTION_NAME,
+    retriever: HybridRetriever = standard_retriever,
+) -> dict[str, int]:
+    """Bring the collection in line with the source files, touching only what changed."""
+    if retriever.client is None:
+        await retriever.initialize()
+    manifest = load_manifest(collection_name)
+    # A manifest is only trustworthy if the collection it describes still has data
+    if manifest and (
+        not await retriever.client.collection_exists(collection_name=collection_name)
+        or (await retriever.client.count(collection_name=collection_name)).count == 0
+    ):
+        logger.warning(f"Collection '{collection_name}' is empty, ignoring manifest.")
+        manifest = {}
+
+    stats = {"files_skipped": 0, "chunks_upserted": 0, "chunks_deleted": 0}
+    updated: dict[str, dict[str, Any]] = {}
+    try:
+        for path in knowledge_paths:
+            try:
+                digest = file_hash(path)
+            except OSError as e:
+                logger.error(f"Cannot read {path}: {e}")
+                # Leave its points alone rather than treating it as removed
+                if path in manifest:
+                    updated[path] = manifest[path]
+                continue
+            previous = manifest.get(path, {})
+            if previous.get("hash") == digest:
+                updated[path] = previous
+                stats["files_skipped"] += 1
+                continue
+
+            chunks = {chunk["id"]: chunk for chunk in retriever._iter_chunks([path])}
+            known = set(previous.get("points", []))
+            fresh = [chunk for point, chunk in chunks.items() if point not in known]
+            stale = [point for point in known if point not in chunks]
+
+            written: set[str] = set()
+            try:
+                result = await retriever.ingest_chunks(fresh, collection_name=collection_name, written=written)
+                await _delete_points(retriever, collection_name, stale)
+            except Exception:
+                # Keep the old hash so the file is retried, but not the points already written
+                updated[path] = {"hash": previous.get("hash"), "points": list(known | written)}
+                raise
+            stats["chunks_upserted"] += int(result["chunks"])
+            stats["chunks_deleted"] += len(stale)
+            if result["failed"]:
+                # Keep the old hash so the next run retries this file
+                logger.warning(f"{int(result['failed'])} chunks of {path} failed, will retry next run")
+                updated[path] = {"hash": previous.get("hash"), "points": list((known - set(stale)) | written)}
+            else:
+                updated[path] = {"hash": digest, "points": list(chunks)}
+            logger.info(f"Reindexed {path}: +{len(fresh)} -{len(stale)} chunks")
+    except Exception:
+        # Record what was written; files not reached yet keep their previous entries
+        for path, entry in manifest.items():
+            updated.setdefault(path, entry)
+        save_manifest(collection_name, updated)
+        raise
+
+    # Sources dropped from the knowledge base lose all their points
+    for path, entry in manifest.items():
+        if path not in updated:
+            await _delete_points(retriever, collection_name, entry.get("points", []))
+            stats["chunks_deleted"] += len(entry.get("points", []))
+            logger.info(f"Removed {path} from '{collection_name}'")
+
+    save_manifest(collection_name, updated)
+    logger.success(f"Incremental reindex of '{collection_name}' complete: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    asyncio.run(reindex())
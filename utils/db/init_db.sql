@@ -1,6 +1,7 @@
 -- SQL for creating all database tables for the Lane AI-Whatsapp application
 
 -- Drop tables in reverse order of dependency to avoid foreign key errors
+DROP TABLE IF EXISTS customer_last_order;
 DROP TABLE IF EXISTS order_items;
 DROP TABLE IF EXISTS orders;
 DROP TABLE IF EXISTS conversations;
@@ -65,7 +66,8 @@ CREATE TABLE orders (
 
 -- Indexes for fast lookups
 CREATE INDEX idx_orders_quote_id ON orders (quote_id);
-CREATE INDEX idx_orders_customer_id ON orders (customer_id);
+-- Serves both "orders for a customer" and "latest order for a customer"
+CREATE INDEX idx_orders_customer_created ON orders (customer_id, created_at DESC);
 
 -- -----------------------------------------------------
 -- Table: order_items
@@ -89,9 +91,178 @@ CREATE TABLE order_items (
 -- Index for fast lookups
 CREATE INDEX idx_order_items_order_id ON order_items (order_id);
 
+-- -----------------------------------------------------
+-- Table: customer_last_order
+-- Description: Each customer's most recent order with its items, kept current by
+-- the triggers below so the chat pipeline reads one row per message.
+-- -----------------------------------------------------
+CREATE TABLE customer_last_order (
+    customer_id INT PRIMARY KEY,
+    phone_number VARCHAR(20) NOT NULL,
+    customer_name VARCHAR(100),
+    location VARCHAR(100),
+    order_id INT NOT NULL,
+    quote_id VARCHAR(50) NOT NULL,
+    total_amount NUMERIC(10, 2) NOT NULL,
+    payment_status VARCHAR(20),
+    order_date TIMESTAMPTZ,
+    items JSONB NOT NULL DEFAULT '[]',
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+
+    CONSTRAINT fk_last_order_customer
+        FOREIGN KEY(customer_id)
+        REFERENCES customers(id)
+        ON DELETE CASCADE
+);
+
+CREATE UNIQUE INDEX idx_customer_last_order_phone ON customer_last_order (phone_number);
+
+-- Recompute one customer's row from orders/order_items (uses idx_orders_customer_created)
+CREATE OR REPLACE FUNCTION refresh_customer_last_order(p_customer_id INT) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO customer_last_order AS clo (
+        customer_id, phone_number, customer_name, location, order_id, quote_id,
+        total_amount, payment_status, order_date, items, updated_at
+    )
+    SELECT
+        c.id, c.phone_number, c.name, c.location, o.id, o.quote_id,
+        o.total_amount, o.payment_status, o.created_at,
+        COALESCE(
+            (SELECT JSONB_AGG(
+                 JSONB_BUILD_OBJECT(
+                     'item_name', oi.item_name,
+                     'product_code', oi.product_code,
+                     'quantity', oi.quantity,
+                     'unit_price', oi.unit_price
+                 ) ORDER BY oi.id)
+             FROM order_items oi WHERE oi.order_id = o.id),
+            '[]'::JSONB
+        ),
+        NOW()
+    FROM customers c
+    JOIN LATERAL (
+        SELECT * FROM orders
+        WHERE customer_id = c.id
+        ORDER BY created_at DESC, id DESC
+        LIMIT 1
+    ) o ON TRUE
+    WHERE c.id = p_customer_id
+    ON CONFLICT (customer_id) DO UPDATE SET
+        phone_number = EXCLUDED.phone_number,
+        customer_name = EXCLUDED.customer_name,
+        location = EXCLUDED.location,
+        order_id = EXCLUDED.order_id,
+        quote_id = EXCLUDED.quote_id,
+        total_amount = EXCLUDED.total_amount,
+        payment_status = EXCLUDED.payment_status,
+        order_date = EXCLUDED.order_date,
+        items = EXCLUDED.items,
+        updated_at = EXCLUDED.updated_at;
+
+    IF NOT FOUND THEN
+        -- The customer has no orders left
+        DELETE FROM customer_last_order WHERE customer_id = p_customer_id;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Rebuild every row in one pass, e.g. after a bulk load with triggers disabled
+CREATE OR REPLACE FUNCTION rebuild_customer_last_order() RETURNS VOID AS $$
+BEGIN
+    TRUNCATE customer_last_order;
+    INSERT INTO customer_last_order (
+        customer_id, phone_number, customer_name, location, order_id, quote_id,
+        total_amount, payment_status, order_date, items
+    )
+    SELECT
+        c.id, c.phone_number, c.name, c.location, o.id, o.quote_id,
+        o.total_amount, o.payment_status, o.created_at,
+        COALESCE(
+            (SELECT JSONB_AGG(
+                 JSONB_BUILD_OBJECT(
+                     'item_name', oi.item_name,
+                     'product_code', oi.product_code,
+                     'quantity', oi.quantity,
+                     'unit_price', oi.unit_price
+                 ) ORDER BY oi.id)
+             FROM order_items oi WHERE oi.order_id = o.id),
+            '[]'::JSONB
+        )
+    FROM (
+        SELECT DISTINCT ON (customer_id) *
+        FROM orders
+        ORDER BY customer_id, created_at DESC, id DESC
+    ) o
+    JOIN customers c ON c.id = o.customer_id;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION orders_refresh_last_order() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM refresh_customer_last_order(OLD.customer_id);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND (TG_OP = 'INSERT' OR NEW.customer_id <> OLD.customer_id) THEN
+        PERFORM refresh_customer_last_order(NEW.customer_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION order_items_refresh_last_order() RETURNS TRIGGER AS $$
+BEGIN
+    -- Only the customer's latest order is materialized, so other orders' items are ignored
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM refresh_customer_last_order(customer_id)
+        FROM customer_last_order WHERE order_id = OLD.order_id;
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.order_id <> OLD.order_id) THEN
+        PERFORM refresh_customer_last_order(customer_id)
+        FROM customer_last_order WHERE order_id = NEW.order_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION customers_refresh_last_order() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_customer_last_order(NEW.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_orders_last_order
+    AFTER INSERT OR UPDATE OR DELETE ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_refresh_last_order();
+
+CREATE TRIGGER trg_order_items_last_order
+    AFTER INSERT OR UPDATE OR DELETE ON order_items
+    FOR EACH ROW EXECUTE FUNCTION order_items_refresh_last_order();
+
+CREATE TRIGGER trg_customers_last_order
+    AFTER UPDATE OF name, location, phone_number ON customers
+    FOR EACH ROW EXECUTE FUNCTION customers_refresh_last_order();
+
+-- Tell the app which cached customer profiles to drop (see utils/db/customer_cache.py)
+CREATE OR REPLACE FUNCTION customers_notify_change() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM pg_notify('customer_changed', OLD.phone_number);
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.phone_number <> OLD.phone_number) THEN
+        PERFORM pg_notify('customer_changed', NEW.phone_number);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_customers_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON customers
+    FOR EACH ROW EXECUTE FUNCTION customers_notify_change();
+
 -- ---
 
-\echo 'All tables (customers, users, orders, order_items) created successfully.'
+\echo 'All tables (customers, users, orders, order_items, customer_last_order) created successfully.'
 
 -- SQL for inserting realistic Kenyan dummy data into all tables
 
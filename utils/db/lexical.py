@@ -0,0 +1,160 @@
+# utils/db/lexical.py
+"""
+In-process BM25 index over the same chunks that are embedded into Qdrant.
+Dense embeddings handle exact product codes (POW-35-MF-NSL) and tyre sizes
+(175/70R13) poorly, so these are indexed as whole tokens alongside their parts.
+"""
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Any, Iterator
+
+from loguru import logger
+
+from utils.db.chunking import KNOWLEDGE_BASE, iter_chunks, point_id
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Standard reciprocal-rank-fusion constant
+RRF_K = 60
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-/.][a-z0-9]+)*")
+TYRE_SIZE_PATTERN = re.compile(
+    r"\b(\d{3})\s*(?:[/ ]\s*(\d{2}))?\s*(z?r)\s*(\d{2})(c?)\b", re.IGNORECASE
+)
+
+
+def normalize_tyre_size(match: re.Match) -> str:
+    width, profile, construction, rim, commercial = match.groups()
+    size = f"{width}/{profile}" if profile else width
+    return f"{size}{construction.upper()}{rim}{commercial.upper()}"
+
+
+def normalize_code(code: str) -> str:
+    return re.sub(r"[\s\-_.]", "", code).upper()
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase tokens; compound codes are kept whole and also split into parts."""
+    tokens: list[str] = []
+    for match in TYRE_SIZE_PATTERN.finditer(text):
+        tokens.append(normalize_tyre_size(match).lower())
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if any(sep in token for sep in "-/."):
+            tokens.extend(part for part in re.split(r"[-/.]", token) if part)
+    return tokens
+
+
+class LexicalIndex:
+    """BM25 over chunk text plus exact lookups by product code and tyre size."""
+
+    def __init__(self, knowledge_paths: list[str] = KNOWLEDGE_BASE):
+        self.knowledge_paths = knowledge_paths
+        self.docs: list[dict[str, Any]] = []
+        self.postings: dict[str, list[tuple[int, int]]] = {}
+        self.doc_lengths: list[int] = []
+        self.avg_length: float = 0.0
+        self.codes: dict[str, list[int]] = {}
+        self.tyre_sizes: dict[str, list[int]] = {}
+        self._signature: tuple = ()
+
+    def _source_signature(self) -> tuple:
+        signature = []
+        for path in self.knowledge_paths:
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append((path, None, None))
+        return tuple(signature)
+
+    def ensure_built(self) -> None:
+        """(Re)build the index when the source files have changed since the last build."""
+        signature = self._source_signature()
+        if signature != self._signature:
+            self.build(iter_chunks(self.knowledge_paths))
+            self._signature = signature
+
+    def build(self, chunks: Iterator[dict[str, Any]]) -> None:
+        docs: list[dict[str, Any]] = []
+        postings: dict[str, list[tuple[int, int]]] = defaultdict(list)
+        codes: dict[str, list[int]] = defaultdict(list)
+        tyre_sizes: dict[str, list[int]] = defaultdict(list)
+        lengths: list[int] = []
+        for doc_id, chunk in enumerate(chunks):
+            text = chunk["text"]
+            docs.append(
+                {
+                    **chunk.get("metadata", {}),
+                    "id": point_id(chunk["source_file"], text),
+                    "text": text,
+                    "source_file": chunk["source_file"],
+                }
+            )
+            counts = Counter(tokenize(text))
+            for token, tf in counts.items():
+                postings[token].append((doc_id, tf))
+            lengths.append(sum(counts.values()))
+            if code := chunk.get("metadata", {}).get("product_code"):
+                codes[normalize_code(code)].append(doc_id)
+            for match in TYRE_SIZE_PATTERN.finditer(text):
+                sizes = tyre_sizes[normalize_tyre_size(match)]
+                if not sizes or sizes[-1] != doc_id:
+                    sizes.append(doc_id)
+
+        self.docs = docs
+        self.postings = dict(postings)
+        self.doc_lengths = lengths
+        self.avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+        self.codes = dict(codes)
+        self.tyre_sizes = dict(tyre_sizes)
+        logger.info(f"Lexical index built: {len(docs)} chunks, {len(self.postings)} terms")
+
+    def exact_match(self, query: str) -> list[dict[str, Any]]:
+        """Chunks for a query that is just a product code or a tyre size, else []."""
+        self.ensure_built()
+        query = query.strip()
+        if doc_ids := self.codes.get(normalize_code(query)):
+            return [self.docs[i] for i in doc_ids]
+        match = TYRE_SIZE_PATTERN.fullmatch(query)
+        if match and (doc_ids := self.tyre_sizes.get(normalize_tyre_size(match))):
+            return [self.docs[i] for i in doc_ids]
+        return []
+
+    def search(self, query: str, limit: int = 10) -> list[tuple[dict[str, Any], float]]:
+        """Top chunks by BM25 score."""
+        self.ensure_built()
+        if not self.docs:
+            return []
+        scores: dict[int, float] = defaultdict(float)
+        n_docs = len(self.docs)
+        for token in set(tokenize(query)):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / self.avg_length)
+                scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [(self.docs[doc_id], score) for doc_id, score in ranked]
+
+
+def reciprocal_rank_fusion(
+    *rankings: list[dict[str, Any]], limit: int, k: int = RRF_K
+) -> list[dict[str, Any]]:
+    """Fuse ranked lists of chunks (each with an 'id') by reciprocal rank."""
+    fused: dict[str, float] = defaultdict(float)
+    chunks: dict[str, dict[str, Any]] = {}
+    for ranking in rankings:
+        for rank, chunk in enumerate(ranking):
+            fused[chunk["id"]] += 1 / (k + rank + 1)
+            chunks.setdefault(chunk["id"], chunk)
+    ordered = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [{**chunks[chunk_id], "score": round(score, 5)} for chunk_id, score in ordered]
+
+
+# Shared instance, built lazily on first search
+lexical_index: LexicalIndex = LexicalIndex()
@@ -1,11 +1,16 @@
 # utils/db/qdrant.py
+import asyncio
+import time
 from qdrant_client.models import PointStruct
-from typing import Any
+from typing import Any, Iterable, Iterator
 from loguru import logger
 from ollama import AsyncClient
 from qdrant_client import AsyncQdrantClient, models
 from dotenv import load_dotenv
 from dependancies import embedding_client
+from utils.db.chunking import CHUNK_MAX_CHARS, CHUNK_OVERLAP, iter_chunks, point_id
+from utils.db.embedding_cache import embedding_cache
+from utils.db.lexical import lexical_index, reciprocal_rank_fusion
 import os
 
 # Load environment
@@ -15,7 +20,25 @@ QDRANT_HOST = "http://qdrant:6333"
 embedding_model_name = "nomic-embed-text:latest"
 COLLECTION_NAME = "lane_data_collection"
 DIMENSION = 768
-CHUNK_SIZE = 50
+# Upper bound for brochure sections; catalog records are always one chunk each
+CHUNK_SIZE = CHUNK_MAX_CHARS
+# Texts per Ollama /api/embed call and how many of those calls may run at once
+EMBED_BATCH_SIZE: int = int(os.getenv("EMBED_BATCH_SIZE", 64))
+EMBED_MAX_IN_FLIGHT: int = int(os.getenv("EMBED_MAX_IN_FLIGHT", 4))
+# Each ranker contributes limit * FUSION_DEPTH candidates to rank fusion
+FUSION_DEPTH = 4
+
+
+def _iter_batches(items: Iterable[Any], batch_size: int) -> Iterator[list[Any]]:
+    """Group an iterable into lists of at most batch_size items."""
+    batch: list[Any] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 
 class HybridRetriever:
@@ -30,7 +53,7 @@ class HybridRetriever:
         self.chunk_size = chunk_size
         self.client = None
         self.embedding_client = embedding_client
-        self.vector_cache: dict[str, list[dict]] = {}
+        self.embedding_cache = embedding_cache
 
     async def initialize(self):
         """Initialize the Qdrant client connection"""
@@ -46,47 +69,149 @@ class HybridRetriever:
             logger.error(f"Failed to initialize Qdrant client: {e}")
             raise
 
-    async def _get_embedding(self, text: str | list[str]) -> list[float]:
+    async def _get_embedding(self, text: str) -> list[float]:
         """Helper method to get embeddings for text"""
         try:
-            response = await self.embedding_client.embeddings(
-                model=embedding_model_name, prompt=text
-            )
-            return response["embedding"]
+            return (await self._get_embeddings([text]))[0]
         except ValueError as e:
             logger.debug(f"Embedding error for text: {str(e)}")
             raise
 
+    async def _get_embeddings(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed many texts, serving repeats from the embedding cache and sending
+        only the misses to the Ollama batch embed API in a single call.
+        """
+        vectors = await self.embedding_cache.get_many(embedding_model_name, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            response = await self.embedding_client.embed(
+                model=embedding_model_name, input=[texts[i] for i in missing]
+            )
+            fresh: list[list[float]] = response["embeddings"]
+            for i, vector in zip(missing, fresh):
+                vectors[i] = vector
+            await self.embedding_cache.put_many(
+                embedding_model_name, [texts[i] for i in missing], fresh
+            )
+        return vectors
+
+    def _iter_chunks(self, knowledge_paths: list[str]) -> Iterator[dict[str, Any]]:
+        """Lazily yield structure-aware chunks from the knowledge base files"""
+        for chunk in iter_chunks(
+            knowledge_paths, max_chars=self.chunk_size, overlap=CHUNK_OVERLAP
+        ):
+            chunk["id"] = point_id(chunk["source_file"], chunk["text"])
+            yield chunk
+
+    async def _ensure_collection(self, collection_name: str) -> None:
+        if not await self.client.collection_exists(collection_name=collection_name):
+            await self.client.create_collection(
+                collection_name=collection_name,
+                vectors_config=models.VectorParams(
+                    size=self.dimension, distance=models.Distance.COSINE, on_disk=True
+                ),
+                timeout=60,
+            )
+            logger.info(f"Collection '{collection_name}' created successfully.")
+
+    async def _embed_and_upsert(
+        self, collection_name: str, batch: list[dict[str, Any]]
+    ) -> list[str]:
+        """Embed one batch and write it to Qdrant. Returns the IDs of the points written."""
+        try:
+            vectors = await self._get_embeddings([chunk["text"] for chunk in batch])
+            await self.client.upsert(
+                collection_name=collection_name,
+                points=[
+                    models.PointStruct(
+                        id=chunk["id"],
+                        vector=vector,
+                        payload={
+                            **chunk.get("metadata", {}),
+                            "text": chunk["text"],
+                            "source_file": chunk["source_file"],
+                        },
+                    )
+                    for chunk, vector in zip(batch, vectors)
+                ],
+                wait=False,
+            )
+            return [chunk["id"] for chunk in batch]
+        except Exception as e:
+            logger.error(f"Failed to ingest batch starting at chunk {batch[0]['id']}: {e}")
+            return []
+
     async def initialize_knowledge_base(
-        self, knowledge_paths
-    ) -> list[dict[str, int | str | list[float]]]:
-        """Process files and create chunks with embeddings"""
-        chunks = []
-        chunk_id = 0
+        self,
+        knowledge_paths: list[str],
+        collection_name: str | None = None,
+        batch_size: int = EMBED_BATCH_SIZE,
+        max_in_flight: int = EMBED_MAX_IN_FLIGHT,
+    ) -> dict[str, float]:
+        """Chunk, embed and upsert the knowledge base files into Qdrant."""
+        return await self.ingest_chunks(
+            self._iter_chunks(knowledge_paths),
+            collection_name=collection_name,
+            batch_size=batch_size,
+            max_in_flight=max_in_flight,
+        )
 
-        for path in knowledge_paths:
-            try:
-                with open(file=path, mode="r", encoding="UTF-8") as file:
-                    text = file.read()
-                    for i in range(0, len(text), self.chunk_size):
-                        chunk_content: str = text[i : i + self.chunk_size]
-                        embedding: list[float] = await self._get_embedding(
-                            chunk_content
-                        )
-
-                        chunks.append(
-                            {
-                                "id": chunk_id,
-                                "text": chunk_content,
-                                "vector": embedding,
-                                "source_file": path,
-                            }
-                        )
-                        chunk_id += 1
-            except ValueError as e:
-                logger.ValueError(f"Error processing {path}: {str(e)}")
-                continue
-        return chunks
+    async def ingest_chunks(
+        self,
+        chunks: Iterable[dict[str, Any]],
+        collection_name: str | None = None,
+        batch_size: int = EMBED_BATCH_SIZE,
+        max_in_flight: int = EMBED_MAX_IN_FLIGHT,
+        written: set[str] | None = None,
+    ) -> dict[str, float]:
+        """
+        Embed and upsert chunks into Qdrant.
+        Chunks are embedded batch_size at a time with at most max_in_flight
+        embed calls outstanding, and each batch is written as soon as it is
+        embedded so vectors are never accumulated in memory. The IDs of the
+        points written are added to `written` as each batch lands, so a caller
+        still knows what was stored if ingestion fails part way.
+        """
+        collection_name = collection_name or self.collection_name
+        if self.client is None:
+            await self.initialize()
+        await self._ensure_collection(collection_name)
+
+        in_flight: set[asyncio.Task] = set()
+        written = set() if written is None else written
+        seen = 0
+        start = time.perf_counter()
+        for batch in _iter_batches(chunks, batch_size):
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = await asyncio.wait(
+                    in_flight, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    written.update(task.result())
+                elapsed = time.perf_counter() - start
+                logger.info(
+                    f"Embedded {len(written)}/{seen} chunks ({len(written) / elapsed:.1f} chunks/s)"
+                )
+            seen += len(batch)
+            in_flight.add(
+                asyncio.create_task(self._embed_and_upsert(collection_name, batch))
+            )
+        if in_flight:
+            done, _ = await asyncio.wait(in_flight)
+            for task in done:
+                written.update(task.result())
+
+        elapsed = time.perf_counter() - start
+        stats = {
+            "chunks": len(written),
+            "failed": seen - len(written),
+            "seconds": round(elapsed, 2),
+            "chunks_per_second": round(len(written) / elapsed, 1) if elapsed else 0.0,
+            "embedding_cache": dict(self.embedding_cache.counters),
+        }
+        logger.success(f"Knowledge base ingested into '{collection_name}': {stats}")
+        return stats
 
     async def setup_qdrant_collection(self, collection_name: str, chunks: list):
         """
@@ -140,25 +265,35 @@ class HybridRetriever:
     async def vector_search(
         self, question: str, collection_name: str, limit: int = 3
     ) -> list[dict]:
-        """Perform vector similarity search"""
+        """
+        Hybrid search: BM25 and dense results fused by reciprocal rank.
+        A query that is just a known product code or tyre size is answered from
+        the lexical index alone, without an embedding call.
+        """
         try:
             if self.client is None:
                 await self.initialize()  # Ensure client exists
 
-            # Check cache first
-            if question in self.vector_cache:
-                return self.vector_cache[question]
+            if exact := lexical_index.exact_match(question):
+                return [{**chunk, "score": 1.0} for chunk in exact[:limit]]
 
+            candidates = limit * FUSION_DEPTH
+            lexical_hits = [
+                chunk for chunk, _ in lexical_index.search(question, limit=candidates)
+            ]
             embedded_question: list[float] = await self._get_embedding(text=question)
 
             search_res: list = await self.client.search(
                 collection_name=collection_name,
                 query_vector=embedded_question,
-                limit=limit,
+                limit=candidates,
                 # score_threshold=0.7,
             )
+            dense_hits = [
+                {**(point.payload or {}), "id": str(point.id)} for point in search_res
+            ]
 
-            return search_res
+            return reciprocal_rank_fusion(lexical_hits, dense_hits, limit=limit)
 
         except ValueError as e:
             logger.debug(f"Search error: {str(e)}")
@@ -1,44 +1,37 @@
 #!/usr/bin/env python3
 from utils.db.base import execute_query
+from utils.db.customer_cache import customer_cache
 from typing import Any
-async def get_customer_details(user_number: str) -> list:
-    """Get all customer details for personalised LLM responses"""
+async def _load_customer_details(user_number: str) -> list:
     query = """
-    SELECT * FROM customers WHERE phone_number = :user_number;
+    SELECT id, name, location, account_type, is_repeat_customer
+    FROM customers WHERE phone_number = :user_number;
     """
     return await execute_query(query, {"user_number": user_number})
 
+
+async def get_customer_details(user_number: str) -> list:
+    """Get the customer details used for personalised LLM responses, cached"""
+    return await customer_cache.get(user_number, _load_customer_details)
+
+
 async def get_last_order(user_phone_number: str) -> list[dict[str, Any]]:
     """
     Get the most recent order details for a customer, including all line items,
     based on their phone number. Returns a list containing a single dictionary
     for the last order, or an empty list if no orders are found.
+    Reads the customer_last_order row kept current by triggers (see init_db.sql).
     """
     query = """
     SELECT
-        o.quote_id,
-        o.total_amount,
-        o.payment_status,
-        o.created_at AS order_date,
-        c.name AS customer_name,
-        c.location,
-        -- Aggregate all items of the order into a single JSON array
-        JSON_AGG(
-            JSON_BUILD_OBJECT(
-                'item_name', oi.item_name,
-                'product_code', oi.product_code,
-                'quantity', oi.quantity,
-                'unit_price', oi.unit_price
-            )
-        ) AS items
-    FROM customers c
-    JOIN orders o ON c.id = o.customer_id
-    JOIN order_items oi ON o.id = oi.order_id
-    WHERE c.phone_number = :user_phone_number
-    -- Group by all non-aggregated columns to get a single row per order
-    GROUP BY o.id, c.id
-    -- Order by date to find the most recent one
-    ORDER BY o.created_at DESC
-    LIMIT 1;
+        quote_id,
+        total_amount,
+        payment_status,
+        order_date,
+        customer_name,
+        location,
+        items
+    FROM customer_last_order
+    WHERE phone_number = :user_phone_number;
     """
     return await execute_query(query, {"user_phone_number": user_phone_number})
@@ -0,0 +1,189 @@
+# utils/job_queue.py
+import json
+import os
+from typing import Any
+
+import redis.asyncio as redis
+from loguru import logger
+from redis.exceptions import ResponseError
+
+# Logger file path
+logger.add("./logs/queue.log", rotation="10 MB")
+
+JOB_STREAM: str = os.getenv("JOB_STREAM", "whatsapp:jobs")
+DEAD_LETTER_STREAM: str = f"{JOB_STREAM}:dead"
+CONSUMER_GROUP: str = os.getenv("JOB_CONSUMER_GROUP", "llm_workers")
+# Cap the stream length so acknowledged history does not grow forever
+STREAM_MAXLEN: int = 10_000
+# A job not acked within this window is handed to another worker
+VISIBILITY_TIMEOUT_MS: int = int(os.getenv("JOB_VISIBILITY_TIMEOUT_MS", 300_000))
+MAX_DELIVERIES: int = int(os.getenv("JOB_MAX_DELIVERIES", 3))
+# Consumer name that failed jobs are parked under until XAUTOCLAIM retries them
+RETRY_CONSUMER = "retry"
+
+
+async def ensure_consumer_group(client: redis.Redis) -> None:
+    """Create the stream and consumer group if they do not already exist."""
+    try:
+        await client.xgroup_create(
+            name=JOB_STREAM, groupname=CONSUMER_GROUP, id="0", mkstream=True
+        )
+        logger.info(f"Created consumer group '{CONSUMER_GROUP}' on '{JOB_STREAM}'")
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def enqueue_job(client: redis.Redis, job: dict[str, Any]) -> str:
+    """Persist a job on the stream and return its stream ID."""
+    job_id = await client.xadd(
+        JOB_STREAM,
+        {"payload": json.dumps(job)},
+        maxlen=STREAM_MAXLEN,
+        approximate=True,
+    )
+    logger.info(f"Enqueued job {job_id} for user {job.get('user_number')}")
+    return job_id
+
+
+async def enqueue_jobs(client: redis.Redis, jobs: list[dict[str, Any]]) -> list[str]:
+    """Persist several jobs in one pipelined round trip, in order."""
+    if not jobs:
+        return []
+    async with client.pipeline(transaction=False) as pipe:
+        for job in jobs:
+            pipe.xadd(
+                JOB_STREAM,
+                {"payload": json.dumps(job)},
+                maxlen=STREAM_MAXLEN,
+                approximate=True,
+            )
+        job_ids = await pipe.execute()
+    logger.info(f"Enqueued {len(job_ids)} jobs for users {sorted({job.get('user_number') for job in jobs})}")
+    return job_ids
+
+
+async def read_jobs(
+    client: redis.Redis, consumer: str, count: int = 1, block_ms: int = 5000
+) -> list[tuple[str, dict[str, Any]]]:
+    """Read new jobs for this consumer, blocking up to block_ms when idle."""
+    response = await client.xreadgroup(
+        groupname=CONSUMER_GROUP,
+        consumername=consumer,
+        streams={JOB_STREAM: ">"},
+        count=count,
+        block=block_ms,
+    )
+    jobs: list[tuple[str, dict[str, Any]]] = []
+    for _, entries in response or []:
+        for job_id, fields in entries:
+            jobs.append((job_id, json.loads(fields["payload"])))
+    return jobs
+
+
+async def claim_stale_jobs(
+    client: redis.Redis, consumer: str, count: int = 10
+) -> list[tuple[str, dict[str, Any]]]:
+    """
+    Take over jobs whose worker died or stalled past the visibility timeout.
+    Jobs that have already been delivered MAX_DELIVERIES times are moved to the
+    dead-letter stream instead of being retried again.
+    """
+    _, entries, _ = await client.xautoclaim(
+        name=JOB_STREAM,
+        groupname=CONSUMER_GROUP,
+        consumername=consumer,
+        min_idle_time=VISIBILITY_TIMEOUT_MS,
+        start_id="0-0",
+        count=count,
+    )
+    jobs: list[tuple[str, dict[str, Any]]] = []
+    for job_id, fields in entries:
+        if not fields:
+            # The entry was trimmed from the stream, nothing left to retry
+            await ack_job(client, job_id)
+            continue
+        pending = await client.xpending_range(
+            name=JOB_STREAM, groupname=CONSUMER_GROUP, min=job_id, max=job_id, count=1
+        )
+        deliveries = pending[0]["times_delivered"] if pending else 0
+        if deliveries > MAX_DELIVERIES:
+            logger.error(f"Job {job_id} exceeded {MAX_DELIVERIES} deliveries, dead-lettering")
+            await client.xadd(DEAD_LETTER_STREAM, fields, maxlen=STREAM_MAXLEN, approximate=True)
+            await ack_job(client, job_id)
+            continue
+        logger.warning(f"Reclaimed stale job {job_id} (delivery {deliveries})")
+        job = json.loads(fields["payload"])
+        # Lets the handler tell whether a failure will be retried
+        job["deliveries"] = deliveries
+        jobs.append((job_id, job))
+    return jobs
+
+
+async def ack_job(client: redis.Redis, job_id: str) -> None:
+    """Acknowledge a finished job so it is never redelivered."""
+    await client.xack(JOB_STREAM, CONSUMER_GROUP, job_id)
+
+
+async def keep_alive(client: redis.Redis, consumer: str, job_ids: list[str]) -> None:
+    """
+    Reset the idle time of jobs this consumer still holds, so jobs that wait a
+    long time for a generation slot are not reclaimed by another worker.
+    JUSTID leaves the delivery count alone.
+    """
+    if job_ids:
+        await client.xclaim(
+            JOB_STREAM, CONSUMER_GROUP, consumer, min_idle_time=0, message_ids=job_ids, justid=True
+        )
+
+
+async def hand_over(client: redis.Redis, job_id: str, consumer: str) -> None:
+    """Move a pending job to the consumer that is handling its user's messages."""
+    await client.xclaim(
+        JOB_STREAM, CONSUMER_GROUP, consumer, min_idle_time=0, message_ids=[job_id], justid=True
+    )
+
+
+async def park_for_retry(client: redis.Redis, job_id: str) -> None:
+    """
+    Move a failed job out of this consumer's pending list. It is retried once
+    it has been idle for VISIBILITY_TIMEOUT_MS, like a job from a dead worker.
+    """
+    await hand_over(client, job_id, RETRY_CONSUMER)
+
+
+async def read_handed_over(
+    client: redis.Redis, consumer: str, exclude: set[str], count: int = 10
+) -> list[tuple[str, dict[str, Any]]]:
+    """
+    Jobs in this consumer's pending list that it is not working on yet, i.e.
+    ones handed over by other workers. Read with XPENDING and XRANGE rather
+    than XREADGROUP so the delivery count is not bumped.
+    """
+    pending = await client.xpending_range(
+        name=JOB_STREAM,
+        groupname=CONSUMER_GROUP,
+        min="-",
+        max="+",
+        count=count + len(exclude),
+        consumername=consumer,
+    )
+    deliveries = {entry["message_id"]: entry["times_delivered"] for entry in pending}
+    job_ids = [job_id for job_id in deliveries if job_id not in exclude][:count]
+    if not job_ids:
+        return []
+    async with client.pipeline(transaction=False) as pipe:
+        for job_id in job_ids:
+            pipe.xrange(JOB_STREAM, min=job_id, max=job_id, count=1)
+        results = await pipe.execute()
+    jobs: list[tuple[str, dict[str, Any]]] = []
+    for job_id, entries in zip(job_ids, results):
+        if not entries:
+            # Trimmed from the stream, nothing left to run
+            await ack_job(client, job_id)
+            continue
+        _, fields = entries[0]
+        job = json.loads(fields["payload"])
+        job["deliveries"] = deliveries[job_id]
+        jobs.append((job_id, job))
+    return jobs
@@ -0,0 +1,158 @@
+# utils/llm/agent.py
+"""
+Single-pass tool calling loop.
+Context is gathered once, then the model is called with the tools available.
+Every tool it asks for runs concurrently and all of the outputs go back in the
+next call; a reply without tool calls is the answer. Most messages need one
+LLM call, messages with tools usually two.
+"""
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterator
+
+import redis.asyncio as redis
+from fastapi import Request
+from loguru import logger
+
+from schemas import LlmRequestPayload
+from utils.llm.llm_base import (
+    LLM_TIMEOUT_SECONDS,
+    available_functions,
+    prepare_messages,
+    stream_chat,
+)
+from utils.llm.text_processing import PARTIAL_MESSAGE_MIN_CHARS, THINK_CLOSE, THINK_OPEN
+from utils.llm.tool_executor import tool_executor
+
+# LLM calls allowed per message; the last one is made without tools so it must answer
+AGENT_MAX_ITERATIONS: int = int(os.getenv("AGENT_MAX_ITERATIONS", 3))
+AGENT_METRICS_KEY = "metrics:agent"
+# Visible characters after which a call with tools enabled is taken to be answering.
+# The first WhatsApp segment needs at least PARTIAL_MESSAGE_MIN_CHARS anyway.
+ANSWER_COMMIT_CHARS: int = PARTIAL_MESSAGE_MIN_CHARS
+
+
+def visible_text(raw: str) -> str | None:
+    """The text after the <think> block in raw so far, or None while it is still open."""
+    stripped = raw.lstrip()
+    if len(stripped) < len(THINK_OPEN) and THINK_OPEN.startswith(stripped):
+        # Possibly the start of the tag
+        return None
+    if not stripped.startswith(THINK_OPEN):
+        return raw
+    end = raw.find(THINK_CLOSE)
+    return None if end < 0 else raw[end + len(THINK_CLOSE) :]
+
+
+async def _call_tool(name: str, arguments: dict[str, Any]) -> Any:
+    function_to_call = available_functions.get(name)
+    if function_to_call is None:
+        return f"Function {name} not found"
+    return await tool_executor.run(name, function_to_call, arguments)
+
+
+async def execute_tool_calls(tool_calls: list[Any]) -> list[dict[str, str]]:
+    """Run every requested tool at once and return one tool message per call."""
+
+    async def run(tool) -> dict[str, str]:
+        name = tool.function.name
+        logger.info(f"Calling function: {name} with arguments {tool.function.arguments}")
+        try:
+            output = await _call_tool(name, tool.function.arguments)
+        except Exception as e:
+            # Let the model see the failure and recover instead of failing the message
+            logger.error(f"Tool {name} failed: {e}")
+            output = f"Error calling {name}: {e}"
+        logger.info(f"Function output:{output}")
+        return {"role": "tool", "content": str(output), "tool_name": name}
+
+    return list(await asyncio.gather(*(run(tool) for tool in tool_calls)))
+
+
+class AgentRun:
+    """One customer message through the tool loop, with its call counts."""
+
+    def __init__(
+        self,
+        request: Request,
+        llm_request_payload: LlmRequestPayload,
+        max_iterations: int = AGENT_MAX_ITERATIONS,
+    ):
+        self.request = request
+        self.llm_request_payload = llm_request_payload
+        self.max_iterations = max_iterations
+        self.llm_calls = 0
+        self.tool_names: list[str] = []
+        # Context sections that made it into the prompt, e.g. "history" or "last_order"
+        self.context_sections: list[str] = []
+
+    async def stream(self) -> AsyncIterator[str]:
+        """
+        Yield the answer's raw content deltas as they are generated.
+        A call with tools enabled may narrate before asking for one ("let me check..."),
+        so its content is held back until ANSWER_COMMIT_CHARS of visible text have
+        arrived without a tool call; a shorter reply is released when the call ends.
+        The final call, made without tools, streams from the first token.
+        The whole loop shares one LLM_TIMEOUT_SECONDS deadline; errors are raised.
+        """
+        deadline = asyncio.get_running_loop().time() + LLM_TIMEOUT_SECONDS
+        messages, usage = await prepare_messages(self.request, self.llm_request_payload)
+        self.context_sections = usage["sections"]
+        for iteration in range(1, self.max_iterations + 1):
+            use_tools = iteration < self.max_iterations
+            self.llm_calls += 1
+            content: list[str] = []
+            tool_calls: list[Any] = []
+            streaming = not use_tools
+            async for message in stream_chat(
+                self.request.app.state.llm_client, messages, deadline, use_tools=use_tools
+            ):
+                if message.tool_calls:
+                    tool_calls.extend(message.tool_calls)
+                if not message.content:
+                    continue
+                content.append(message.content)
+                if streaming:
+                    yield message.content
+                elif not tool_calls:
+                    raw = "".join(content)
+                    visible = visible_text(raw)
+                    if visible is not None and len(visible.strip()) >= ANSWER_COMMIT_CHARS:
+                        streaming = True
+                        yield raw
+            if not tool_calls:
+                if content and not streaming:
+                    yield "".join(content)
+                return
+            if streaming:
+                # Rare: tools asked for after a long answer, which has already gone out
+                logger.warning(f"Tool calls after {len(''.join(content))} streamed characters")
+            self.tool_names += [tool.function.name for tool in tool_calls]
+            messages.append(
+                {"role": "assistant", "content": "".join(content), "tool_calls": tool_calls}
+            )
+            messages.extend(await execute_tool_calls(tool_calls))
+
+    async def record(self, client: redis.Redis) -> None:
+        """Add this run to the shared counters read by /metrics."""
+        logger.info(f"Message used {self.llm_calls} LLM calls and tools {self.tool_names}")
+        try:
+            async with client.pipeline(transaction=False) as pipe:
+                pipe.hincrby(AGENT_METRICS_KEY, "messages", 1)
+                pipe.hincrby(AGENT_METRICS_KEY, "llm_calls", self.llm_calls)
+                pipe.hincrby(AGENT_METRICS_KEY, "tool_calls", len(self.tool_names))
+                pipe.hset(AGENT_METRICS_KEY, "updated_at", int(time.time()))
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to record agent metrics: {e}")
+        await tool_executor.flush(client)
+
+
+async def agent_stats(client: redis.Redis) -> dict[str, float]:
+    counters = {key: int(value) for key, value in (await client.hgetall(AGENT_METRICS_KEY)).items()}
+    messages = counters.get("messages", 0)
+    return {
+        **counters,
+        "llm_calls_per_message": round(counters.get("llm_calls", 0) / messages, 2) if messages else 0.0,
+    }
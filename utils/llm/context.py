@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# utils/llm/context.py
+import asyncio
+import time
+from typing import Any, Awaitable
+
+import redis.asyncio as redis
+from loguru import logger
+
+from schemas import LlmRequestPayload
+from utils.catalog import product_catalog
+from utils.cache import history_store
+from utils.db.graph_retriever import graph_retriever
+from utils.db.qdrant import COLLECTION_NAME, standard_retriever
+from utils.db.query import get_last_order
+from utils.llm.image_processor import read_image
+
+# Per-source budgets in seconds. A source that overruns is dropped from the prompt.
+CONTEXT_TIMEOUTS: dict[str, float] = {
+    "graph": 2.0,
+    "vector": 3.0,
+    "image": 30.0,
+    "history": 0.5,
+    "last_order": 1.5,
+}
+
+
+async def _image_context(media_file_path: str) -> tuple[str, list[Any]]:
+    """Describe the image with the vision model, then search the knowledge base with it."""
+    image_inference = await read_image(media_file_path=media_file_path)
+    image_inference_query: str = image_inference.get("message", {}).get("content", "")
+    image_search_results = await standard_retriever.vector_search(
+        question=image_inference_query, collection_name=COLLECTION_NAME
+    )
+    return image_inference_query, image_search_results
+
+
+async def _timed_source(
+    name: str, awaitable: Awaitable[Any], timeout: float
+) -> tuple[str, Any, float, bool]:
+    """Await a single context source, returning (name, result, latency_ms, ok)."""
+    start = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(awaitable, timeout=timeout)
+        return name, result, (time.perf_counter() - start) * 1000, True
+    except asyncio.TimeoutError:
+        logger.warning(f"Context source '{name}' timed out after {timeout}s")
+    except Exception as e:
+        logger.error(f"Context source '{name}' failed: {e}")
+    return name, None, (time.perf_counter() - start) * 1000, False
+
+
+async def gather_context(
+    redis_client: redis.Redis, llm_request_payload: LlmRequestPayload
+) -> tuple[dict[str, Any], dict[str, float]]:
+    """
+    Fan out to every context backend at once.
+    Sources that time out or fail are simply missing from the returned context,
+    so a slow backend shrinks the prompt instead of stalling the reply.
+    Returns the context keyed by source name and the per-source latency in ms.
+    """
+    sources: dict[str, Awaitable[Any]] = {}
+    if llm_request_payload.media_file_path:
+        sources["image"] = _image_context(llm_request_payload.media_file_path)
+    elif llm_request_payload.user_message:
+        sources["graph"] = graph_retriever.search_parts_by_name(
+            llm_request_payload.user_message
+        )
+        sources["vector"] = standard_retriever.vector_search(
+            question=llm_request_payload.user_message,
+            collection_name=COLLECTION_NAME,
+        )
+    if llm_request_payload.user_number and llm_request_payload.personal_context:
+        sources["history"] = history_store.get(llm_request_payload.user_number)
+        sources["last_order"] = get_last_order(
+            user_phone_number=llm_request_payload.user_number
+        )
+
+    results = await asyncio.gather(
+        *(
+            _timed_source(name, awaitable, CONTEXT_TIMEOUTS[name])
+            for name, awaitable in sources.items()
+        )
+    )
+
+    context: dict[str, Any] = {}
+    latencies: dict[str, float] = {}
+    if llm_request_payload.user_message:
+        # In-process and sub-millisecond, so it needs no timeout or task
+        start = time.perf_counter()
+        try:
+            context["catalog"] = product_catalog.lookup_message(
+                llm_request_payload.user_message
+            )
+        except Exception as e:
+            logger.error(f"Context source 'catalog' failed: {e}")
+        latencies["catalog"] = round((time.perf_counter() - start) * 1000, 3)
+    for name, result, latency_ms, ok in results:
+        latencies[name] = round(latency_ms, 1)
+        if ok:
+            context[name] = result
+    logger.info(f"Context latencies (ms): {latencies}")
+    return context, latencies
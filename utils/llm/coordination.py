@@ -0,0 +1,135 @@
+# utils/llm/coordination.py
+"""
+Coordination between worker replicas through Valkey.
+ValkeySemaphore caps concurrent generations across every worker, and
+UserLeases makes one worker at a time responsible for a customer, so that
+worker's MessageScheduler can keep their messages in order and coalesce them.
+Both are leases that the holder renews, so a crashed worker's share is freed
+when its lease runs out.
+"""
+import asyncio
+import contextlib
+import os
+import uuid
+from typing import AsyncIterator
+
+import redis.asyncio as redis
+from loguru import logger
+
+# How long a slot or user stays taken without being renewed
+COORDINATION_LEASE_MS: int = int(os.getenv("COORDINATION_LEASE_MS", 60_000))
+SEMAPHORE_POLL_SECONDS: float = 0.2
+
+# Drop holders whose lease ran out, then take a slot if one is free
+ACQUIRE_SLOT_SCRIPT = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now_ms - tonumber(ARGV[2]))
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[1]) then
+    redis.call('ZADD', KEYS[1], now_ms, ARGV[3])
+    return 1
+end
+return 0
+"""
+
+RENEW_SLOT_SCRIPT = """
+local now = redis.call('TIME')
+return redis.call('ZADD', KEYS[1], 'XX', 'CH', tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000), ARGV[1])
+"""
+
+# Returns the owner after the call: ARGV[1] if it took or already held the lease
+ACQUIRE_USER_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if not owner or owner == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return ARGV[1]
+end
+return owner
+"""
+
+RELEASE_USER_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class ValkeySemaphore:
+    """Counting semaphore shared by every worker; holders are ZSET members scored by last renewal."""
+
+    def __init__(self, client: redis.Redis, key: str, limit: int, lease_ms: int = COORDINATION_LEASE_MS):
+        self.client = client
+        self.key = key
+        self.limit = limit
+        self.lease_ms = lease_ms
+        self._acquire = client.register_script(ACQUIRE_SLOT_SCRIPT)
+        self._renew = client.register_script(RENEW_SLOT_SCRIPT)
+
+    async def _keep(self, token: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_ms / 3000)
+            try:
+                await self._renew(keys=[self.key], args=[token])
+            except Exception as e:
+                logger.warning(f"Failed to renew slot on {self.key}: {e}")
+
+    @contextlib.asynccontextmanager
+    async def slot(self, low_priority: bool = False) -> AsyncIterator[None]:
+        """
+        Wait for a free slot and hold it, renewing the lease, until the block exits.
+        A low-priority holder only takes a slot while another one stays free, so
+        background work never keeps a reply waiting (unless the limit is 1).
+        """
+        token = uuid.uuid4().hex
+        limit = max(self.limit - 1, 1) if low_priority else self.limit
+        while not await self._acquire(keys=[self.key], args=[limit, self.lease_ms, token]):
+            await asyncio.sleep(SEMAPHORE_POLL_SECONDS)
+        keeper = asyncio.create_task(self._keep(token))
+        try:
+            yield
+        finally:
+            keeper.cancel()
+            try:
+                await self.client.zrem(self.key, token)
+            except Exception as e:
+                # The lease runs out on its own
+                logger.warning(f"Failed to release slot on {self.key}: {e}")
+
+
+class UserLeases:
+    """Which worker is handling each customer's messages right now."""
+
+    def __init__(self, client: redis.Redis, consumer: str, lease_ms: int = COORDINATION_LEASE_MS):
+        self.client = client
+        self.consumer = consumer
+        self.lease_ms = lease_ms
+        self.held: set[str] = set()
+        self._acquire = client.register_script(ACQUIRE_USER_SCRIPT)
+        self._release = client.register_script(RELEASE_USER_SCRIPT)
+
+    @staticmethod
+    def _key(user_number: str) -> str:
+        return f"worker:user:{user_number}"
+
+    async def acquire(self, user_number: str) -> str:
+        """Take or refresh the lease; returns the consumer that holds it afterwards."""
+        owner = await self._acquire(keys=[self._key(user_number)], args=[self.consumer, self.lease_ms])
+        if owner == self.consumer:
+            self.held.add(user_number)
+        return owner
+
+    async def release(self, user_number: str) -> None:
+        self.held.discard(user_number)
+        try:
+            await self._release(keys=[self._key(user_number)], args=[self.consumer])
+        except Exception as e:
+            logger.warning(f"Failed to release lease for {user_number}: {e}")
+
+    async def renew(self) -> None:
+        """Refresh every lease this worker holds."""
+        for user_number in list(self.held):
+            if await self.acquire(user_number) != self.consumer:
+                # Expired and taken by another worker, e.g. after a long stall
+                self.held.discard(user_number)
+                logger.warning(f"Lost the lease for {user_number}")
@@ -1,26 +1,25 @@
 #!/usr/bin/env python3
+import asyncio
 from collections import defaultdict, deque
 from datetime import datetime, timedelta
 import os
 from re import search
-from typing import Any
+from typing import Any, AsyncIterator
 import uuid
 
-from dependancies import llm_client
 from dotenv import load_dotenv
 from fastapi import Request
 from loguru import logger
 from ollama import AsyncClient
 from schemas import CustomerDetails, GenerationRequest, LlmRequestPayload, UserOrders
 from transformers.utils import get_json_schema
-from utils.cache import add_to_chat_history, get_chat_history
-from utils.db.graph_retriever import graph_retriever
-from utils.db.qdrant import COLLECTION_NAME, standard_retriever
-from utils.db.query import get_last_order
+from utils.llm.context import gather_context
 from utils.llm.image_processor import read_image
 from utils.llm.prompt import BTB_SYSTEM_PROMPT, BTC_SYSTEM_PROMPT, SECURITY_POST_PROMPT
+from utils.llm.prompt_builder import build_user_prompt
 from utils.llm.text_processing import convert_llm_output_to_readable
 from utils.llm.tools import (
+    catalog_lookup,
     format_quotation,
     low_similarity,
     payment_methods,
@@ -33,6 +32,8 @@ load_dotenv()
 # Adding logging information
 logger.add("./logs/llm_app", rotation="10 MB")
 llm_model = "qwen3:8b"
+# Upper bound for a single generation before it is cancelled
+LLM_TIMEOUT_SECONDS: float = float(os.getenv("LLM_TIMEOUT_SECONDS", 120))
 
 
 class ChatHistory:
@@ -105,126 +106,127 @@ language_codes = {
 }
 
 
-internet_search_results: list[dict[str, str]] = [{}]
 tools: list[Any] = [
     get_json_schema(format_quotation),
     get_json_schema(payment_methods),
     get_json_schema(send_invoice),
     get_json_schema(low_similarity),
-    get_json_schema(read_image)
+    get_json_schema(read_image),
+    get_json_schema(catalog_lookup),
 ]
 available_functions={
             "format_quotation": format_quotation,
             "payment_methods": payment_methods,
             "send_invoice": send_invoice,
             "low_similarity": low_similarity,
-            "read_image":read_image
+            "read_image":read_image,
+            "catalog_lookup": catalog_lookup,
         }
 chat_history = ChatHistory()
 
 
 # Optimized LLM pipeline
-async def tool_checker(user_message:str) -> None:
-    """ 
-    Runs the tool call
+GENERATION_OPTIONS: dict[str, Any] = {
+    "temperature": 0.1,
+    # "max_tokens": 100,  # For smaller screens and less complications
+    "top_p": 0.95,
+    "top_k": 20,
+    "min_p": 0,
+    "repeat_penalty": 1,
+}
+PIPELINE_ERROR_MESSAGE = "I'm sorry, I encountered a system error and could not process your request. Please try again later."
+
+
+async def prepare_messages(
+    request: Request, llm_request_payload: LlmRequestPayload
+) -> tuple[list[Any], dict[str, Any]]:
     """
-    messages=[{"role":"user", "content":user_message}]
-    response = await llm_client.chat(
-        model=llm_model,
-        messages=messages,
-        tools=tools,
-        stream=False,
-        options={
-            "temperature": 0.1,
-            # "max_tokens": 100,  # For smaller screens and less complications
-            "top_p": 0.95,
-            "top_k": 20,
-            "min_p": 0,
-            "repeat_penalty": 1,
+    Gather the context and append this turn's user message to the conversation.
+    Returns the messages and the prompt usage from build_user_prompt.
+    """
+    # Redis client
+    redis_client = request.app.state.redis
+
+    # Load the context from every backend concurrently
+    context, _ = await gather_context(
+        redis_client=redis_client, llm_request_payload=llm_request_payload
+    )
+    graph_search_results, _ = context.get("graph", ([], None))
+    image_inference_query, image_search_results = context.get("image", ("", []))
+
+    # The system prompt stays the first message untouched; only this turn varies
+    final_user_content, usage = build_user_prompt(
+        question_lines=[
+            f"Answer the user's query: {llm_request_payload.user_message}"
+            if llm_request_payload.user_message
+            else "",
+            f"Answer the image query: {image_inference_query}" if image_inference_query else "",
+            f"Answer the caption attached to the media: {llm_request_payload.image_caption}"
+            if llm_request_payload.image_caption
+            else "",
+            #SECURITY_POST_PROMPT, # Append security rules to every prompt
+        ],
+        sources={
+            "catalog": context.get("catalog", []),
+            "customer": llm_request_payload.customer_details if llm_request_payload.personal_context else [],
+            "account_type": [] if llm_request_payload.personal_context else llm_request_payload.customer_details,
+            "graph": graph_search_results,
+            "vector": context.get("vector", []),
+            "image": image_search_results,
+            "last_order": context.get("last_order", []),
+            "history_summary": context.get("history", {}).get("summary", ""),
+            "history": context.get("history", {}).get("turns", []),
         },
     )
-    return response
+    llm_request_payload.messages.append({"role":"user", "content":final_user_content})
+    return llm_request_payload.messages, usage
 
-async def llm_pipeline(request: Request, llm_request_payload: LlmRequestPayload) -> Any:
-    image_search_results: list = []
-    vector_search_results: list = []
-    graph_search_results: list[Any] = []
-    image_inference_query: str = ""
-    try:
-        # Redis client
-        redis_client = request.app.state.redis
 
-        if llm_request_payload.media_file_path:
-            image_inference = await read_image(
-                media_file_path=llm_request_payload.media_file_path
-            )
-            image_inference_query = image_inference.get("message", {}).get(
-                "content", ""
-            )
-            image_search_results.append(
-                await standard_retriever.vector_search(
-                    question=image_inference_query, collection_name="lane_data_collection"
-                )
-            )
-        # Load the context
-        elif llm_request_payload.user_message:
-            graph_search_results, graph_search_summary = (
-                await graph_retriever.search_parts_by_name(
-                    llm_request_payload.user_message
-                )
-            )
-            vector_search_results.append(
-                await standard_retriever.vector_search(
-                    question=llm_request_payload.user_message,
-                    collection_name=COLLECTION_NAME,
-                )
-            )
-        # Load the chat history db
-        chat_history: list[Any] = await get_chat_history(
-            client=redis_client, user_number=llm_request_payload.user_number
-        )
-        last_order: list[dict[str, Any]] = await get_last_order(
-            user_phone_number=llm_request_payload.user_number
-        )
-
-
-        final_user_content: str = (
-            f"Given this context: {vector_search_results}."
-            f"Structured data from the the knowledge graph{graph_search_results}\n"
-            f"Given the results from a search from the images {image_search_results}\n"
-            f"Given the internet search results {internet_search_results}\n"
-            f"And this chat history: {chat_history}.\n"
-            f"Last user order if available {last_order}\n"
-            f"And these customer details: {llm_request_payload.customer_details}.\n"
-            f"Answer the user's query: {llm_request_payload.user_message}\n"
-            f"Answer the image query {image_inference_query}\n"
-            f"Answer the caption attached to the media {llm_request_payload.image_caption}\n"
-            #f"{SECURITY_POST_PROMPT}" # Append security rules to every prompt
-        )
-        llm_request_payload.messages.append({"role":"user", "content":final_user_content})
-        response = await llm_client.chat(
+async def stream_chat(
+    client: AsyncClient,
+    messages: list[Any],
+    deadline: float,
+    use_tools: bool = True,
+) -> AsyncIterator[Any]:
+    """
+    Stream a chat completion, yielding each chunk's message as Ollama produces it.
+    deadline is an event loop time; the whole stream is cancelled once it passes.
+    """
+    loop = asyncio.get_running_loop()
+    stream = await asyncio.wait_for(
+        client.chat(
             model=llm_model,
-            messages=llm_request_payload.messages,
-            tools=tools,
-            stream=False,
-            options={
-                "temperature": 0.1,
-                # "max_tokens": 100,  # For smaller screens and less complications
-                "top_p": 0.95,
-                "top_k": 20,
-                "min_p": 0,
-                "repeat_penalty": 1,
-            },
-        )
-        return response
+            messages=messages,
+            # Same tool schemas on every call keeps the prompt prefix cacheable
+            tools=tools if use_tools else None,
+            stream=True,
+            options=GENERATION_OPTIONS,
+        ),
+        timeout=deadline - loop.time(),
+    )
+    chunks = stream.__aiter__()
+    while True:
+        try:
+            chunk = await asyncio.wait_for(chunks.__anext__(), timeout=deadline - loop.time())
+        except StopAsyncIteration:
+            return
+        yield chunk.message
+
+
+async def llm_pipeline_stream(
+    request: Request, llm_request_payload: LlmRequestPayload
+) -> AsyncIterator[str]:
+    """
+    Yields raw content deltas as Ollama produces them, <think> blocks included.
+    The whole generation is bounded by LLM_TIMEOUT_SECONDS. Errors are raised,
+    since part of the answer may already have been delivered by the caller.
+    """
+    deadline = asyncio.get_running_loop().time() + LLM_TIMEOUT_SECONDS
+    try:
+        messages, _ = await prepare_messages(request, llm_request_payload)
+        async for message in stream_chat(request.app.state.llm_client, messages, deadline):
+            if message.content:
+                yield message.content
     except Exception as e:
-        logger.debug(f"Error generating repsonse with llm  {str(e)}", exc_info=True)
-        return {
-            "message": {
-                "content": "I'm sorry, I encountered a system error and could not process your request. Please try again later."
-            }
-        }
-
-
-# Optimized chatbot response for tool calling
-
+        logger.debug(f"Error streaming repsonse with llm  {str(e)}", exc_info=True)
+        raise
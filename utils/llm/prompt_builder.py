@@ -0,0 +1,158 @@
+# utils/llm/prompt_builder.py
+"""
+Token-budgeted assembly of the per-message prompt.
+Each context source is rendered as compact text and added by priority until
+the budget is spent, so prefill time on the Ollama host stays bounded no
+matter how long the chat history or how many search hits there are.
+The system prompt is not built here: it stays the first message, byte for
+byte, so Ollama can reuse its KV cache across requests.
+"""
+import math
+import os
+from decimal import Decimal
+from typing import Any, Callable
+
+from loguru import logger
+
+# Tokens available for context plus the question, on top of the system prompt
+PROMPT_TOKEN_BUDGET: int = int(os.getenv("PROMPT_TOKEN_BUDGET", 2048))
+# Rough characters per token for qwen3 on mixed English/Swahili text
+CHARS_PER_TOKEN: float = 3.5
+# Longest single chunk or message kept from any source
+MAX_ITEM_CHARS: int = 600
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _clip(text: Any, limit: int = MAX_ITEM_CHARS) -> str:
+    text = " ".join(str(text).split())
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+def _price(value: Any) -> str:
+    # NUMERIC columns (order totals, unit prices) come back from Postgres as Decimal
+    return f"Ksh {value:,.0f}" if isinstance(value, (int, float, Decimal)) else "n/a"
+
+
+def catalog_lines(matches: list[dict[str, Any]]) -> list[str]:
+    return [
+        f"- {item['item_name']} (`{item['product_code']}`): retail {_price(item.get('retail_selling_price'))}, "
+        f"wholesale {_price(item.get('wholesale_selling_price'))}, stock {item.get('units') or 0:.0f}"
+        + (f", discount {item['discount']:g}%" if item.get("discount") else "")
+        for item in matches
+    ]
+
+
+def customer_lines(customer_details: list[dict[str, Any]]) -> list[str]:
+    if not customer_details:
+        return []
+    customer = customer_details[0]
+    fields = [
+        f"{label}: {customer[key]}"
+        for key, label in (("name", "Name"), ("location", "Location"), ("account_type", "Account type"))
+        if customer.get(key)
+    ]
+    if customer.get("is_repeat_customer"):
+        fields.append("Repeat customer: yes")
+    return ["- " + ", ".join(fields)] if fields else []
+
+
+def account_type_lines(customer_details: list[dict[str, Any]]) -> list[str]:
+    # Only the pricing tier, for prompts that leave out the rest of the profile
+    if not customer_details or not customer_details[0].get("account_type"):
+        return []
+    return [f"- {customer_details[0]['account_type']}"]
+
+
+def graph_lines(values: list[list[Any]]) -> list[str]:
+    # Rows are [brand, part_name, code, price, score] from search_parts_by_name
+    return [
+        f"- {row[1]} by {row[0] or 'unknown brand'} (`{row[2]}`): wholesale {_price(row[3])}"
+        for row in values
+        if len(row) >= 4
+    ]
+
+
+def chunk_lines(chunks: list[dict[str, Any]]) -> list[str]:
+    return [f"- {_clip(chunk.get('text', ''))}" for chunk in chunks if chunk.get("text")]
+
+
+def last_order_lines(last_order: list[dict[str, Any]]) -> list[str]:
+    if not last_order:
+        return []
+    order = last_order[0]
+    items = ", ".join(
+        f"{item.get('item_name')} x{item.get('quantity')}" for item in order.get("items") or []
+    )
+    return [
+        f"- Quote {order.get('quote_id')} on {order.get('order_date')}: {items}; "
+        f"total {_price(order.get('total_amount'))}, {order.get('payment_status')}"
+    ]
+
+
+def history_lines(history: list[dict[str, str]]) -> list[str]:
+    # Newest first, so trimming to the budget drops the oldest turns
+    return [
+        f"- Customer: {_clip(turn.get('user_message', ''), 300)}\n  You: {_clip(turn.get('llm_response', ''), 300)}"
+        for turn in reversed(history)
+    ]
+
+
+def summary_lines(summary: str) -> list[str]:
+    return [_clip(summary, 1000)]
+
+
+# Fill order when the budget is tight; sections are rendered in this order too
+SECTIONS: list[tuple[str, str, Callable[[Any], list[str]]]] = [
+    ("catalog", "Exact catalog matches with current prices", catalog_lines),
+    ("customer", "Customer", customer_lines),
+    ("account_type", "Customer account type", account_type_lines),
+    ("graph", "Matching parts from the knowledge graph", graph_lines),
+    ("vector", "Relevant product information", chunk_lines),
+    ("image", "Products matching the customer's image", chunk_lines),
+    ("last_order", "Customer's last order", last_order_lines),
+    ("history_summary", "Summary of the earlier conversation", summary_lines),
+    ("history", "Recent conversation, newest first", history_lines),
+]
+
+
+def build_user_prompt(
+    question_lines: list[str],
+    sources: dict[str, Any],
+    budget: int = PROMPT_TOKEN_BUDGET,
+) -> tuple[str, dict[str, Any]]:
+    """
+    Render the context sections and the question into the final user message.
+    The question is always kept; sections are filled by priority, item by item,
+    until the token budget runs out. Empty sections are left out entirely.
+    Returns the prompt and a usage summary: token counts, dropped items and the
+    sections that made it into the prompt.
+    """
+    question = "\n".join(line for line in question_lines if line)
+    remaining = budget - estimate_tokens(question)
+    rendered: dict[str, list[str]] = {}
+    usage: dict[str, Any] = {"dropped": []}
+    for name, title, render in SECTIONS:
+        lines = render(sources[name]) if sources.get(name) else []
+        kept: list[str] = []
+        header_cost = estimate_tokens(title) + 2
+        for line in lines:
+            cost = estimate_tokens(line) + 1 + (header_cost if not kept else 0)
+            if cost > remaining:
+                break
+            kept.append(line)
+            remaining -= cost
+        if kept:
+            rendered[name] = [f"{title}:", *kept]
+        if len(kept) < len(lines):
+            usage["dropped"].append(f"{name}:{len(lines) - len(kept)}")
+
+    blocks = ["\n".join(rendered[name]) for name, _, _ in SECTIONS if name in rendered]
+    prompt = "\n\n".join([*blocks, question])
+    usage["sections"] = list(rendered)
+    usage["tokens"] = estimate_tokens(prompt)
+    usage["budget"] = budget
+    logger.info(f"Prompt assembled: {usage}")
+    return prompt, usage
@@ -0,0 +1,268 @@
+# utils/llm/response_cache.py
+"""
+Response cache for repeated customer questions.
+An exact tier in Valkey is keyed on the normalized message; a semantic tier in
+Qdrant matches paraphrases by embedding similarity. Both are scoped to the
+catalog version, system prompt and pricing tier, so a price change invalidates
+every answer. A message that passes is_cacheable is answered from a prompt with
+only the customer's pricing tier (no profile, last order or chat history), so
+the answer can be stored for everyone in that tier. Messages that depend on
+the customer (orders, invoices, media) are never cached.
+"""
+import hashlib
+import os
+import re
+import time
+import uuid
+from typing import Any
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+from loguru import logger
+from qdrant_client import models
+
+from utils.catalog import product_catalog
+from utils.db.embedding_cache import normalize_text
+from utils.db.lexical import tokenize
+from utils.db.qdrant import DIMENSION, HybridRetriever, standard_retriever
+from utils.metrics import SharedCounters, hit_rate
+
+# Load environment
+load_dotenv()
+
+RESPONSE_CACHE_COLLECTION = "response_cache"
+RESPONSE_CACHE_METRICS_KEY = "metrics:response_cache"
+RESPONSE_CACHE_TTL_SECONDS: int = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 24 * 3600))
+# Cosine similarity needed for a paraphrase to reuse an answer
+RESPONSE_CACHE_SIMILARITY: float = float(os.getenv("RESPONSE_CACHE_SIMILARITY", 0.93))
+RESPONSE_CACHE_ENABLED: bool = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+
+# Words that tie a question to the customer's own orders, account or history (English and Swahili)
+PERSONAL_CONTEXT_PATTERN = re.compile(
+    r"\b(my|mine|me|our|i ordered|order|orders|invoice|receipt|delivery|deliver|"
+    r"history|last|previous|again|same|paid|payment|account|balance|"
+    r"agizo|oda|yangu|wangu|changu|zangu|langu|letu|yetu|tena|jana|ankara|malipo|risiti)\b",
+    re.IGNORECASE,
+)
+# Tools whose output does not depend on who is asking
+CACHEABLE_TOOLS: set[str] = {"catalog_lookup", "payment_methods", "low_similarity"}
+# Prompt sections (see prompt_builder.SECTIONS) that make an answer specific to one customer
+PERSONAL_SECTIONS: set[str] = {"customer", "last_order", "history_summary", "history"}
+DEFAULT_PRICING_TIER = "B2C"
+
+
+def normalize_query(message: str) -> str:
+    """normalize_text without punctuation that does not change the question."""
+    return normalize_text(re.sub(r"[^\w\s/.\-]", " ", message))
+
+
+def entity_key(message: str) -> str:
+    """
+    Codes, sizes and quantities in the message. 'battery N50' and 'battery N70'
+    embed almost identically, so paraphrases only match when these agree.
+    """
+    return " ".join(sorted({token for token in tokenize(message) if any(c.isdigit() for c in token)}))
+
+
+def pricing_tier(customer_details: list[dict[str, Any]]) -> str:
+    """Account type that decides which prices the customer is quoted."""
+    if customer_details and customer_details[0].get("account_type"):
+        return str(customer_details[0]["account_type"])
+    return DEFAULT_PRICING_TIER
+
+
+def is_cacheable(
+    user_message: str,
+    media_file_path: str = "",
+    tool_names: list[str] | None = None,
+    context_sections: list[str] | None = None,
+) -> bool:
+    if not user_message or media_file_path:
+        return False
+    if any(name not in CACHEABLE_TOOLS for name in tool_names or []):
+        return False
+    if PERSONAL_SECTIONS.intersection(context_sections or []):
+        return False
+    return not PERSONAL_CONTEXT_PATTERN.search(user_message)
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        retriever: HybridRetriever = standard_retriever,
+        collection_name: str = RESPONSE_CACHE_COLLECTION,
+        ttl: int = RESPONSE_CACHE_TTL_SECONDS,
+        similarity: float = RESPONSE_CACHE_SIMILARITY,
+    ):
+        self.retriever = retriever
+        self.collection_name = collection_name
+        self.ttl = ttl
+        self.similarity = similarity
+        self._collection_ready = False
+        self._purged_version = ""
+        self.counters = SharedCounters(
+            RESPONSE_CACHE_METRICS_KEY, ["exact_hits", "semantic_hits", "misses", "skipped", "stored"]
+        )
+
+    def namespace(self, system_prompt: str, tier: str = DEFAULT_PRICING_TIER) -> str:
+        """Scope for cached answers: catalog version, the prompt that produced them and the pricing tier."""
+        prompt_digest = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:12]
+        return f"{product_catalog.current_version()}:{prompt_digest}:{tier}"
+
+    @staticmethod
+    def _exact_key(namespace: str, query: str) -> str:
+        digest = hashlib.sha256(query.encode("utf-8")).hexdigest()
+        return f"resp:{namespace}:{digest}"
+
+    async def _ensure_collection(self) -> None:
+        if self._collection_ready:
+            return
+        if self.retriever.client is None:
+            await self.retriever.initialize()
+        client = self.retriever.client
+        if not await client.collection_exists(collection_name=self.collection_name):
+            await client.create_collection(
+                collection_name=self.collection_name,
+                vectors_config=models.VectorParams(
+                    size=DIMENSION, distance=models.Distance.COSINE
+                ),
+            )
+            for field, schema in (
+                ("namespace", models.PayloadSchemaType.KEYWORD),
+                ("catalog_version", models.PayloadSchemaType.KEYWORD),
+                ("entities", models.PayloadSchemaType.KEYWORD),
+                ("created_at", models.PayloadSchemaType.FLOAT),
+            ):
+                await client.create_payload_index(
+                    collection_name=self.collection_name, field_name=field, field_schema=schema
+                )
+            logger.info(f"Collection '{self.collection_name}' created successfully.")
+        self._collection_ready = True
+
+    async def lookup(
+        self,
+        client: redis.Redis,
+        user_message: str,
+        system_prompt: str,
+        media_file_path: str = "",
+        tier: str = DEFAULT_PRICING_TIER,
+    ) -> str | None:
+        """Cached answer for the message in the customer's pricing tier, or None. Never raises."""
+        if not RESPONSE_CACHE_ENABLED:
+            return None
+        if not is_cacheable(user_message, media_file_path):
+            self.counters["skipped"] += 1
+            return None
+        try:
+            namespace = self.namespace(system_prompt, tier)
+            query = normalize_query(user_message)
+            if cached := await client.get(self._exact_key(namespace, query)):
+                self.counters["exact_hits"] += 1
+                return cached
+
+            await self._ensure_collection()
+            vector = await self.retriever._get_embedding(text=query)
+            hits = await self.retriever.client.search(
+                collection_name=self.collection_name,
+                query_vector=vector,
+                query_filter=models.Filter(
+                    must=[
+                        models.FieldCondition(key="namespace", match=models.MatchValue(value=namespace)),
+                        models.FieldCondition(key="entities", match=models.MatchValue(value=entity_key(query))),
+                        models.FieldCondition(key="created_at", range=models.Range(gte=time.time() - self.ttl)),
+                    ]
+                ),
+                limit=1,
+                score_threshold=self.similarity,
+            )
+            if hits:
+                self.counters["semantic_hits"] += 1
+                logger.info(f"Semantic cache hit ({hits[0].score:.3f}) for '{user_message}'")
+                return hits[0].payload["response"]
+        except Exception as e:
+            logger.warning(f"Response cache lookup failed: {e}")
+        self.counters["misses"] += 1
+        return None
+
+    async def store(
+        self,
+        client: redis.Redis,
+        user_message: str,
+        system_prompt: str,
+        response: str,
+        media_file_path: str = "",
+        tool_names: list[str] | None = None,
+        context_sections: list[str] | None = None,
+        tier: str = DEFAULT_PRICING_TIER,
+    ) -> None:
+        """
+        Cache a generated answer if nothing that produced it was specific to the
+        customer: no personal context in the prompt and only cacheable tools.
+        """
+        if not RESPONSE_CACHE_ENABLED or not response:
+            return
+        if not is_cacheable(user_message, media_file_path, tool_names, context_sections):
+            return
+        try:
+            namespace = self.namespace(system_prompt, tier)
+            query = normalize_query(user_message)
+            await client.set(self._exact_key(namespace, query), response, ex=self.ttl)
+
+            await self._ensure_collection()
+            await self._purge_stale_versions()
+            vector = await self.retriever._get_embedding(text=query)
+            await self.retriever.client.upsert(
+                collection_name=self.collection_name,
+                points=[
+                    models.PointStruct(
+                        id=str(uuid.uuid5(uuid.NAMESPACE_URL, f"{namespace}#{query}")),
+                        vector=vector,
+                        payload={
+                            "namespace": namespace,
+                            "catalog_version": product_catalog.current_version(),
+                            "entities": entity_key(query),
+                            "query": query,
+                            "response": response,
+                            "created_at": time.time(),
+                        },
+                    )
+                ],
+            )
+            self.counters["stored"] += 1
+        except Exception as e:
+            logger.warning(f"Response cache store failed: {e}")
+
+    async def _purge_stale_versions(self) -> None:
+        """Drop semantic entries from older catalog versions once per version change."""
+        version = product_catalog.current_version()
+        if version == self._purged_version:
+            return
+        for selector in (
+            models.Filter(
+                must_not=[
+                    models.FieldCondition(
+                        key="catalog_version", match=models.MatchValue(value=version)
+                    )
+                ]
+            ),
+            models.Filter(
+                must=[
+                    models.FieldCondition(
+                        key="created_at", range=models.Range(lt=time.time() - self.ttl)
+                    )
+                ]
+            ),
+        ):
+            await self.retriever.client.delete(
+                collection_name=self.collection_name,
+                points_selector=models.FilterSelector(filter=selector),
+            )
+        self._purged_version = version
+
+    async def stats(self, client: redis.Redis) -> dict[str, float]:
+        counters = await self.counters.read(client)
+        return {**counters, "hit_rate": hit_rate(counters, ["exact_hits", "semantic_hits"])}
+
+
+# Shared instance used by the WhatsApp pipeline
+response_cache: ResponseCache = ResponseCache()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# utils/llm/scheduler.py
+import asyncio
+import os
+from collections import defaultdict
+from typing import Any, AsyncContextManager, Awaitable, Callable
+
+from loguru import logger
+
+# Generations allowed against the Ollama host at the same time
+LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", 2))
+# How long to wait for follow-up messages from the same user before generating
+COALESCE_WINDOW_SECONDS: float = float(os.getenv("COALESCE_WINDOW_SECONDS", 1.0))
+
+JobHandler = Callable[[dict[str, Any]], Awaitable[None]]
+# Returns a context manager holding one generation slot, e.g. ValkeySemaphore.slot
+SlotFactory = Callable[[], AsyncContextManager[None]]
+
+
+def merge_jobs(jobs: list[dict[str, Any]]) -> dict[str, Any]:
+    """Fold a burst of text messages from one user into a single job."""
+    if len(jobs) == 1:
+        return jobs[0]
+    merged = dict(jobs[0])
+    merged["user_message"] = "\n".join(
+        job["user_message"] for job in jobs if job.get("user_message")
+    )
+    # The burst is answered once, so it is on its last try if any of its jobs is
+    merged["deliveries"] = max(job.get("deliveries", 1) for job in jobs)
+    return merged
+
+
+class MessageScheduler:
+    """
+    Runs jobs in arrival order per user, with a global cap on concurrent generations.
+    Text messages that queue up for the same user while they wait are coalesced
+    into one generation. Media messages are never merged since the pipeline
+    handles a single attachment per request.
+    The cap is local unless `slot` is given; workers pass a Valkey-backed one so
+    it holds across replicas. `on_idle` is called with a user number once the
+    last queued job for that user has been handled.
+    """
+
+    def __init__(
+        self,
+        handler: JobHandler,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        coalesce_window: float = COALESCE_WINDOW_SECONDS,
+        slot: SlotFactory | None = None,
+        on_idle: Callable[[str], Awaitable[None]] | None = None,
+    ):
+        self.handler = handler
+        self.coalesce_window = coalesce_window
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._slot: SlotFactory = slot or (lambda: self._semaphore)
+        self.on_idle = on_idle
+        self._pending: dict[str, list[tuple[dict[str, Any], asyncio.Future]]] = defaultdict(list)
+        self._drainers: dict[str, asyncio.Task] = {}
+        self.generations: int = 0
+        self.coalesced: int = 0
+
+    def submit(self, job: dict[str, Any]) -> asyncio.Future:
+        """Queue a job and return a future that resolves once it has been handled."""
+        user_number: str = job.get("user_number", "")
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._pending[user_number].append((job, future))
+        if user_number not in self._drainers:
+            self._drainers[user_number] = asyncio.create_task(self._drain(user_number))
+        return future
+
+    def _take_batch(self, user_number: str) -> list[tuple[dict[str, Any], asyncio.Future]]:
+        """Pop the next run of jobs that can share one generation."""
+        pending = self._pending[user_number]
+        if pending[0][0].get("media_id"):
+            return [pending.pop(0)]
+        count = 1
+        while count < len(pending) and not pending[count][0].get("media_id"):
+            count += 1
+        batch = pending[:count]
+        del pending[:count]
+        return batch
+
+    async def _drain(self, user_number: str) -> None:
+        batch: list[tuple[dict[str, Any], asyncio.Future]] = []
+        try:
+            while self._pending.get(user_number):
+                await asyncio.sleep(self.coalesce_window)
+                batch = self._take_batch(user_number)
+                if len(batch) > 1:
+                    self.coalesced += len(batch) - 1
+                    logger.info(f"Coalesced {len(batch)} messages from {user_number}")
+                job = merge_jobs([job for job, _ in batch])
+                try:
+                    async with self._slot():
+                        self.generations += 1
+                        await self.handler(job)
+                except Exception as e:
+                    logger.error(f"Scheduled job for {user_number} failed: {e}", exc_info=True)
+                    for _, future in batch:
+                        future.set_exception(e)
+                else:
+                    for _, future in batch:
+                        future.set_result(None)
+                batch = []
+                if self.on_idle is not None and not self._pending.get(user_number):
+                    # Jobs submitted while this runs are picked up by the loop
+                    await self.on_idle(user_number)
+        finally:
+            # Cancel anything left behind if the drainer itself was cancelled
+            for _, future in batch + self._pending.pop(user_number, []):
+                if not future.done():
+                    future.cancel()
+            self._drainers.pop(user_number, None)
@@ -37,3 +37,76 @@ def convert_llm_output_to_readable(llm_output: str) -> str:
 
     clean_text = "\n\n".join(formatted_paragraphs)
     return clean_text
+
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+# A partial WhatsApp message is cut at the first sentence end after this many characters
+PARTIAL_MESSAGE_MIN_CHARS = 160
+SENTENCE_END = re.compile(r"(?<=[.!?:])\s+(?=[A-Z*_`•\-\d])|\n\s*\n")
+
+
+class IncrementalReadableConverter:
+    """
+    Incremental mode of convert_llm_output_to_readable for streamed output.
+    Tokens are fed in as they arrive; <think> blocks are dropped on the fly,
+    even when a tag is split across chunks, and visible text is released as
+    sentence-aligned segments of at least min_chars, each already cleaned.
+    """
+
+    def __init__(self, min_chars: int = PARTIAL_MESSAGE_MIN_CHARS):
+        self.min_chars = min_chars
+        self._pending = ""  # raw text not yet classified as thinking or visible
+        self._thinking = False
+        self._visible = ""  # visible text not yet released as a segment
+
+    def _strip_think(self, chunk: str) -> str:
+        """Return the visible part of chunk, holding back a possible partial tag."""
+        self._pending += chunk
+        visible: list[str] = []
+        while self._pending:
+            tag = THINK_CLOSE if self._thinking else THINK_OPEN
+            index = self._pending.find(tag)
+            if index >= 0:
+                if not self._thinking:
+                    visible.append(self._pending[:index])
+                self._pending = self._pending[index + len(tag) :]
+                self._thinking = not self._thinking
+                continue
+            # Keep any suffix that could be the start of the tag for the next chunk
+            keep = next(
+                (n for n in range(min(len(tag) - 1, len(self._pending)), 0, -1)
+                 if tag.startswith(self._pending[-n:])),
+                0,
+            )
+            if not self._thinking:
+                visible.append(self._pending[: len(self._pending) - keep])
+            self._pending = self._pending[len(self._pending) - keep :]
+            break
+        return "".join(visible)
+
+    def feed_visible(self, chunk: str) -> str:
+        """Visible text in chunk with <think> blocks removed, for token-level streaming."""
+        return self._strip_think(chunk)
+
+    def feed(self, chunk: str) -> list[str]:
+        """Add a chunk and return any segments that are now complete."""
+        self._visible += self._strip_think(chunk)
+        segments: list[str] = []
+        while len(self._visible) >= self.min_chars:
+            match = SENTENCE_END.search(self._visible, self.min_chars)
+            if not match:
+                break
+            segment, self._visible = self._visible[: match.start()], self._visible[match.end() :]
+            if readable := convert_llm_output_to_readable(segment):
+                segments.append(readable)
+        return segments
+
+    def flush(self) -> list[str]:
+        """Release whatever visible text is left once the stream ends."""
+        if not self._thinking:
+            self._visible += self._pending
+        self._pending = ""
+        remainder, self._visible = self._visible, ""
+        readable = convert_llm_output_to_readable(remainder)
+        return [readable] if readable else []
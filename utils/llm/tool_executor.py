@@ -0,0 +1,131 @@
+# utils/llm/tool_executor.py
+"""
+Runs the LLM tools without blocking the event loop.
+Coroutine tools are awaited directly and hand their CPU-bound steps (invoice
+PDFs) to run_in_process. Sync tools go to a process pool when they are
+CPU-bound (PDF rendering), to a thread pool when they block on the network or
+disk, and run inline only when they are known to be sub-millisecond.
+Every call gets a timeout and is counted per tool.
+"""
+import asyncio
+import functools
+import inspect
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable
+
+import redis.asyncio as redis
+from loguru import logger
+
+TOOL_THREAD_WORKERS: int = int(os.getenv("TOOL_THREAD_WORKERS", 8))
+TOOL_PROCESS_WORKERS: int = int(os.getenv("TOOL_PROCESS_WORKERS", 2))
+DEFAULT_TOOL_TIMEOUT_SECONDS: float = 30.0
+TOOL_TIMEOUTS: dict[str, float] = {
+    "format_quotation": 20.0,
+    "low_similarity": 10.0,
+    "send_invoice": 30.0,
+    "read_image": 60.0,
+    "catalog_lookup": 2.0,
+    "payment_methods": 2.0,
+}
+# Where sync tools run; anything not listed goes to the thread pool
+CPU_BOUND_TOOLS: set[str] = {"format_quotation"}
+INLINE_TOOLS: set[str] = {"catalog_lookup", "payment_methods"}
+TOOL_METRICS_KEY = "metrics:tools"
+
+
+class ToolTimeoutError(Exception):
+    pass
+
+
+class ToolExecutor:
+    def __init__(self, thread_workers: int = TOOL_THREAD_WORKERS):
+        self.thread_pool = ThreadPoolExecutor(max_workers=thread_workers, thread_name_prefix="tool")
+        self.process_pool: Executor | None = None
+        # Per tool: calls, errors, timeouts, total_ms; pushed to Valkey by flush()
+        self._pending: dict[str, dict[str, float]] = defaultdict(lambda: defaultdict(float))
+
+    def set_process_pool(self, process_pool: Executor | None) -> None:
+        """Use the pool created in the app lifespan or worker for CPU-bound tools."""
+        self.process_pool = process_pool
+
+    def _executor_for(self, name: str) -> Executor | None:
+        if name in INLINE_TOOLS:
+            return None
+        if name in CPU_BOUND_TOOLS and self.process_pool is not None:
+            return self.process_pool
+        return self.thread_pool
+
+    async def run(self, name: str, function: Callable[..., Any], arguments: dict[str, Any]) -> Any:
+        """
+        Call a tool with its timeout. On timeout the caller gets ToolTimeoutError;
+        a sync tool already running in a pool is left to finish on its own.
+        """
+        timeout = TOOL_TIMEOUTS.get(name, DEFAULT_TOOL_TIMEOUT_SECONDS)
+        counters = self._pending[name]
+        counters["calls"] += 1
+        start = time.perf_counter()
+        try:
+            if inspect.iscoroutinefunction(function):
+                return await asyncio.wait_for(function(**arguments), timeout=timeout)
+            executor = self._executor_for(name)
+            if executor is None:
+                return function(**arguments)
+            future = asyncio.get_running_loop().run_in_executor(
+                executor, functools.partial(function, **arguments)
+            )
+            return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            counters["timeouts"] += 1
+            raise ToolTimeoutError(f"{name} did not finish within {timeout}s")
+        except Exception:
+            counters["errors"] += 1
+            raise
+        finally:
+            latency_ms = (time.perf_counter() - start) * 1000
+            counters["total_ms"] += latency_ms
+            logger.info(f"Tool {name} took {latency_ms:.1f}ms")
+
+    async def run_in_process(self, function: Callable[..., Any], *args: Any) -> Any:
+        """
+        Run the CPU-bound step of a coroutine tool in the process pool, or the
+        thread pool when there is none. function and args must be picklable;
+        the calling tool's own timeout still applies.
+        """
+        executor = self.process_pool or self.thread_pool
+        return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(function, *args))
+
+    async def flush(self, client: redis.Redis) -> None:
+        """Add the counters collected since the last flush to the shared Valkey hash."""
+        pending, self._pending = self._pending, defaultdict(lambda: defaultdict(float))
+        if not pending:
+            return
+        try:
+            async with client.pipeline(transaction=False) as pipe:
+                for name, counters in pending.items():
+                    for field, value in counters.items():
+                        pipe.hincrbyfloat(TOOL_METRICS_KEY, f"{name}:{field}", value)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to record tool metrics: {e}")
+
+    def shutdown(self) -> None:
+        self.thread_pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def tool_stats(client: redis.Redis) -> dict[str, dict[str, float]]:
+    """Per-tool call, error and timeout counts with the mean latency."""
+    stats: dict[str, dict[str, float]] = defaultdict(dict)
+    for key, value in (await client.hgetall(TOOL_METRICS_KEY)).items():
+        name, field = key.rsplit(":", 1)
+        stats[name][field] = float(value)
+    for counters in stats.values():
+        calls = counters.get("calls", 0)
+        counters["avg_ms"] = round(counters.pop("total_ms", 0) / calls, 1) if calls else 0.0
+    return dict(stats)
+
+
+# Shared instance used by the agent loop
+tool_executor: ToolExecutor = ToolExecutor()
@@ -7,8 +7,14 @@ from loguru import logger
 from ddgs import DDGS
 from utils.whatsapp import send_invoice_whatsapp
 from dependancies import MAX_RESULTS
+from utils.catalog import product_catalog
+from utils.llm.tool_executor import tool_executor
 
-def send_invoice(user_order: UserOrders) -> None:
+def render_invoice(user_order: UserOrders) -> str:
+    """Render the invoice PDF and return its filename; runs in the tool process pool."""
+    return Order(user_order).create_invoice_pdf()
+
+async def send_invoice(user_order: UserOrders) -> None:
     """
     Using the customer's details and the request to generate an invoice pdf for the order and confirmation.Create it and send it to the user via whatsapp
     Args:
@@ -27,8 +33,9 @@ def send_invoice(user_order: UserOrders) -> None:
                     payment_status: str
                     payment_date: datetime
     """
-    invoice_filename: str=Order(user_order).create_invoice_pdf()
-    send_invoice_whatsapp(recipient_number=user_order.customer_contact, invoice_filename=invoice_filename)
+    # ReportLab rendering is CPU-bound, so it goes to the process pool
+    invoice_filename: str = await tool_executor.run_in_process(render_invoice, user_order)
+    await send_invoice_whatsapp(recipient_number=user_order.customer_contact, invoice_filename=invoice_filename)
 
 def format_quotation(
     quote_id: str,
@@ -110,6 +117,25 @@ def payment_methods(
     return new_payment
 
 
+def catalog_lookup(
+    query: str, product_codes: list[str] | None = None, quantities: list[int] | None = None
+) -> dict[str, Any]:
+    """
+    Your only task is to look up exact prices and stock for parts in the Lane catalog. Use it whenever the user mentions a product code, a tyre size or a product name, and to price an order before quoting it.
+    Args:
+        query: Product code, tyre size (e.g. 175/70R13), brand or product name from the user's message
+        product_codes: Product codes to price, if the user wants a quote
+        quantities: Quantity for each product code, in the same order
+    """
+    matches = product_catalog.lookup_message(query)
+    if not matches:
+        matches = product_catalog.by_brand(query)[:5] or product_catalog.search_name(query)
+    result: dict[str, Any] = {"matches": matches}
+    if product_codes:
+        result["quote"] = product_catalog.quote(product_codes, quantities or [1] * len(product_codes))
+    return result
+
+
 # Tool 3: Internet search after low embedding similarity results
 def low_similarity(user_message: str, max_results:int=MAX_RESULTS) -> list[dict[str, str]]:
     """
@@ -0,0 +1,85 @@
+# utils/metrics.py
+"""
+Counters shared by the API and worker processes.
+Each process counts in memory and periodically adds its counts to a Valkey
+hash, so /metrics reports the totals no matter which process did the work.
+"""
+import asyncio
+import os
+
+import redis.asyncio as redis
+from loguru import logger
+
+METRICS_FLUSH_SECONDS: float = float(os.getenv("METRICS_FLUSH_SECONDS", 10))
+
+
+class SharedCounters(dict):
+    """
+    This process's counters for one component, all-time. flush() adds whatever
+    has not been pushed yet to the Valkey hash `key`, which holds the totals.
+    """
+
+    def __init__(self, key: str, fields: list[str]):
+        super().__init__({field: 0 for field in fields})
+        self.key = key
+        self._flushed: dict[str, int] = {}
+        _registry.append(self)
+
+    def _unflushed(self) -> dict[str, int]:
+        return {
+            field: value - self._flushed.get(field, 0)
+            for field, value in self.items()
+            if value != self._flushed.get(field, 0)
+        }
+
+    async def flush(self, client: redis.Redis) -> None:
+        """Add the counts collected since the last flush to the shared hash."""
+        pending = self._unflushed()
+        if not pending:
+            return
+        try:
+            async with client.pipeline(transaction=False) as pipe:
+                for field, value in pending.items():
+                    pipe.hincrby(self.key, field, value)
+                await pipe.execute()
+        except Exception as e:
+            # Left unflushed, so the next flush retries them
+            logger.warning(f"Failed to flush {self.key}: {e}")
+            return
+        for field, value in pending.items():
+            self._flushed[field] = self._flushed.get(field, 0) + value
+
+    async def read(self, client: redis.Redis) -> dict[str, int]:
+        """Totals across every process, including this one's unflushed counts."""
+        shared = {field: int(value) for field, value in (await client.hgetall(self.key)).items()}
+        pending = self._unflushed()
+        return {field: shared.get(field, 0) + pending.get(field, 0) for field in {*self, *shared}}
+
+
+_registry: list[SharedCounters] = []
+
+
+def hit_rate(counters: dict[str, int], hit_fields: list[str], miss_field: str = "misses") -> float:
+    hits = sum(counters.get(field, 0) for field in hit_fields)
+    lookups = hits + counters.get(miss_field, 0)
+    return round(hits / lookups, 3) if lookups else 0.0
+
+
+async def flush_all(client: redis.Redis) -> None:
+    for counters in _registry:
+        await counters.flush(client)
+
+
+async def run_flusher(client: redis.Redis, stop: asyncio.Event | None = None) -> None:
+    """Flush every registered counter set periodically, and once more on the way out."""
+    stop = stop or asyncio.Event()
+    try:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=METRICS_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            await flush_all(client)
+    except asyncio.CancelledError:
+        await flush_all(client)
+        raise
@@ -0,0 +1,57 @@
+# utils/routers/api.py
+import json
+from typing import AsyncIterator
+
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
+from loguru import logger
+
+from schemas import GenerationRequest, LlmRequestPayload
+from utils.llm.llm_base import PIPELINE_ERROR_MESSAGE, llm_pipeline_stream
+from utils.llm.prompt import BTB_SYSTEM_PROMPT
+from utils.llm.text_processing import IncrementalReadableConverter
+
+router = APIRouter(
+    prefix="/api",
+    tags=["API"],
+)
+
+
+def sse_event(data: dict, event: str = "") -> str:
+    """Format one server-sent event."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+async def stream_generation(request: Request, generation_request: GenerationRequest) -> AsyncIterator[str]:
+    payload = LlmRequestPayload(
+        user_message=generation_request.prompt,
+        user_number="",
+        messages=[{"role": "system", "content": BTB_SYSTEM_PROMPT}],
+        customer_details=[],
+        media_file_path="",
+        image_caption="",
+    )
+    converter = IncrementalReadableConverter()
+    try:
+        async for delta in llm_pipeline_stream(request=request, llm_request_payload=payload):
+            if await request.is_disconnected():
+                logger.info("Web client disconnected, stopping generation.")
+                return
+            if token := converter.feed_visible(delta):
+                yield sse_event({"token": token})
+        yield sse_event({}, event="done")
+    except Exception as e:
+        logger.error(f"Web generation failed: {e}")
+        yield sse_event({"detail": PIPELINE_ERROR_MESSAGE}, event="error")
+
+
+@router.post("/generate")
+async def generate(request: Request, generation_request: GenerationRequest):
+    """Stream the answer to the web form as server-sent events, one per token."""
+    return StreamingResponse(
+        stream_generation(request, generation_request),
+        media_type="text/event-stream",
+        # Stop nginx and similar proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
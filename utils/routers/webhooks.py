@@ -2,22 +2,31 @@
 import hashlib
 from datetime import datetime, timezone
 import hmac
+import json
 import os
 from typing import Any, Optional
 
-from fastapi import APIRouter, HTTPException, Query, Request, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Query, Request
 from fastapi.responses import PlainTextResponse
 import httpx
 import uuid
 from schemas import CustomerDetails, GenerationRequest, LlmRequestPayload
-from utils.cache import add_to_chat_history, is_message_processed
+from utils.cache import (
+    claim_message_ids,
+    count_webhook_event,
+    history_store,
+    release_message_ids,
+)
 from utils.db.query import get_customer_details
-from utils.llm.llm_base import available_functions, llm_model, llm_pipeline, tool_checker, tools
+from utils.job_queue import enqueue_jobs
+from utils.llm.agent import AgentRun
+from utils.llm.llm_base import PIPELINE_ERROR_MESSAGE
 from utils.llm.prompt import BTB_SYSTEM_PROMPT
+from utils.llm.response_cache import is_cacheable, pricing_tier, response_cache
+from utils.webhook_parser import is_status_callback, iter_messages, parse_webhook
 from utils.whatsapp import ACCESS_TOKEN, whatsapp_messenger
-from utils.llm.text_processing import convert_llm_output_to_readable
+from utils.llm.text_processing import IncrementalReadableConverter
 from loguru import logger
-from ollama import chat
 # Add logging path
 logger.add("./logs/webhooks.log", rotation="1 week")
 router = APIRouter(
@@ -83,88 +92,116 @@ async def process_message_in_background(
     user_number: str,
     media_id: str,
     image_caption: str,
+    final_attempt: bool = True,
 ):
-    """This function runs in the background to process and respond to messages."""
+    """
+    This function runs in the background to process and respond to messages.
+    Failures before anything has reached the customer are raised, so the worker
+    leaves the job pending for redelivery; on the final attempt the customer
+    gets PIPELINE_ERROR_MESSAGE instead. Once part of a reply is out, errors
+    are only logged, since a retry would send it twice.
+    """
     logger.info(f"Background task started for user {user_number}.")
     media_file_path: str = ""
-    final_response_content:str=""
       # Redis client
     redis_client = request.app.state.redis
+    replied: bool = False
     try:
         customer_details: list[Any] = await get_customer_details(user_number)
+        tier = pricing_tier(customer_details)
+        # Repeated catalog questions are answered without retrieval or generation
+        if not media_id and (
+            cached_response := await response_cache.lookup(
+                client=redis_client, user_message=user_message, system_prompt=BTB_SYSTEM_PROMPT, tier=tier
+            )
+        ):
+            await whatsapp_messenger(llm_text_output=cached_response, recipient_number=user_number)
+            replied = True
+            await history_store.append(
+                user_number=user_number,
+                user_message=user_message,
+                llm_response=cached_response,
+                llm_client=request.app.state.llm_client,
+            )
+            return
         if media_id:
             media_file_path: str = await download_whatsapp_media(media_id=media_id)
         # Prepare the data for llm to ingest
         messages: list[dict[str, str]] = [
             {"role": "system", "content": BTB_SYSTEM_PROMPT},     
         ]
-
-        # Get final response from model with function outputs
-        tool_call_payload = LlmRequestPayload(
-            user_message=user_message,
-            user_number="",
-            messages=messages,
-            customer_details=[],
-            media_file_path=media_file_path,
-            image_caption=image_caption,
+        agent_run = AgentRun(
+            request=request,
+            llm_request_payload=LlmRequestPayload(
+                user_message=user_message,
+                user_number=user_number,
+                messages=messages,
+                customer_details=customer_details,
+                media_file_path=media_file_path,
+                image_caption=image_caption,
+                # Answered for the pricing tier rather than the customer, so it can be cached
+                personal_context=bool(media_id) or not is_cacheable(user_message),
+            ),
         )
-        llm_response=chat(llm_model,messages=[{"role":"user", "content":user_message or media_file_path}], tools=tools )
-        #llm_response =await tool_checker(user_message=user_message)
-
-        logger.info(llm_response)
-        if not llm_response or "message" not in llm_response:
-            logger.error(f"Received invalid or None response from LLM pipeline for user {user_number}.")
-            # Send a generic error message
-            whatsapp_messenger(
-                llm_text_output="I'm sorry, I'm having trouble processing your request right now. Please try again in a moment.",
-                recipient_number=user_number
-            )
-            return
 
-        if llm_response.message.tool_calls:
-            for tool in llm_response.message.tool_calls:
-                # Ensure the function is available, and then call it
-                if function_to_call := available_functions.get(tool.function.name):
-                    logger.info(f"Calling function: {tool.function.name}")
-                    logger.info(f"Arguments:'{tool.function.arguments}")        
-                    # Get the actual function object
-                    output = function_to_call(**tool.function.arguments)
-                    logger.info(f"Function output:{output}")
-                else:
-                    logger.info(f"Function {tool.function.name}not found")
-
-            if llm_response.message.tool_calls:
-                messages.append(llm_response.message)
-                messages.append({'role': 'tool', 'content': str(output), 'tool_name': tool.function.name})
-
-            llm_pipeline_payload = LlmRequestPayload(
-            user_message=user_message,
-            user_number=user_number,
-            messages=messages,
-            customer_details=customer_details,
-            media_file_path=media_file_path,
-            image_caption=image_caption,
-        )
-            final_response =await llm_pipeline(request=request, llm_request_payload=llm_pipeline_payload)
-            logger.info('Final response:', final_response.message.content)
-            if not final_response.message.content:
-                logger.warning(f"LLM returned empty content for user {user_number}. Sending fallback.")
-                final_response_content = "I'm not sure how to respond to that. Could you please rephrase your request."
-            else:
-                final_response_content=final_response.message.content 
-        cleaned_response = convert_llm_output_to_readable(final_response_content)
-        whatsapp_messenger(
-            llm_text_output=cleaned_response, recipient_number=user_number
-        )
-        await add_to_chat_history(
-            client=redis_client,
+        # Send the answer a few sentences at a time as it is generated
+        converter = IncrementalReadableConverter()
+        segments: list[str] = []
+        generated: bool = False
+        try:
+            async for delta in agent_run.stream():
+                for segment in converter.feed(delta):
+                    await whatsapp_messenger(llm_text_output=segment, recipient_number=user_number)
+                    segments.append(segment)
+                    replied = True
+            for segment in converter.flush():
+                await whatsapp_messenger(llm_text_output=segment, recipient_number=user_number)
+                segments.append(segment)
+                replied = True
+            generated = bool(segments)
+        except Exception as e:
+            if not replied:
+                raise
+            logger.error(f"Generation failed for user {user_number}: {e}", exc_info=True)
+            segments.append(PIPELINE_ERROR_MESSAGE)
+            await whatsapp_messenger(llm_text_output=PIPELINE_ERROR_MESSAGE, recipient_number=user_number)
+        finally:
+            await agent_run.record(redis_client)
+
+        if not segments:
+            logger.warning(f"LLM returned empty content for user {user_number}. Sending fallback.")
+            segments.append("I'm not sure how to respond to that. Could you please rephrase your request.")
+            await whatsapp_messenger(llm_text_output=segments[0], recipient_number=user_number)
+            replied = True
+        final_response_content = "\n\n".join(segments)
+        logger.info(f"Final response: {final_response_content}")
+        if generated:
+            await response_cache.store(
+                client=redis_client,
+                user_message=user_message,
+                system_prompt=BTB_SYSTEM_PROMPT,
+                response=final_response_content,
+                media_file_path=media_file_path,
+                tool_names=agent_run.tool_names,
+                context_sections=agent_run.context_sections,
+                tier=tier,
+            )
+        await history_store.append(
             user_number=user_number,
             user_message=user_message,
-            llm_response=cleaned_response,
+            llm_response=final_response_content,
+            llm_client=request.app.state.llm_client,
         )
     
     except Exception as e:
-        logger.error(f"Background task failed for {user_number}: {e}", exc_info=True)
+        if replied:
+            logger.error(f"Background task failed for {user_number} after replying: {e}", exc_info=True)
+            return
+        if not final_attempt:
+            logger.warning(f"Background task failed for {user_number} before replying, leaving it for retry: {e}")
+            raise
+        logger.error(f"Background task failed for {user_number} on its final attempt: {e}", exc_info=True)
+        await whatsapp_messenger(llm_text_output=PIPELINE_ERROR_MESSAGE, recipient_number=user_number)
 
 
 @router.get("")
@@ -180,7 +217,7 @@ async def verify_whatsapp_webhook(
 
 
 @router.post("")
-async def handle_whatsapp_message(request: Request, background_tasks: BackgroundTasks):
+async def handle_whatsapp_message(request: Request):
     """Handles incoming messages from WhatsApp."""
     # signature = (
     #     request.headers.get("x-hub-signature-256", "").split("sha256=")[-1].strip()
@@ -189,49 +226,44 @@ async def handle_whatsapp_message(request: Request, background_tasks: Background
     #     raise HTTPException(status_code=403, detail="Invalid signature")
 
     try:
-        data = await request.json()
+        body = await request.body()
+        # Delivery/read receipts are most of the traffic; skip them without parsing
+        if is_status_callback(body):
+            await count_webhook_event(request.app.state.redis, "status_callbacks")
+            return PlainTextResponse("OK")
+
+        data = json.loads(body)
         if not data.get("entry"):
             raise HTTPException(status_code=400, detail="Invalid payload structure")
-        value = data["entry"][0]["changes"][0].get("value", {})
-        if not value:
-            return PlainTextResponse("OK")
 
-        user_message: str = ""
-        media_id: str = ""
-        user_number: str = ""
-        image_caption: str = ""
-        for entry in data.get("entry", []):
-            for change in entry.get("changes", []):
-                contact_info = change.get("value", {}).get("contacts", [])
-                if contact_info:
-                    user_number = contact_info[0].get("wa_id")
-                messages = change.get("value", {}).get("messages", [])
-                if messages and messages[0].get("type") == "text":
-                    user_message = messages[0].get("text", {}).get("body")
-                    break
-                if messages and messages[0].get("type") == "image":
-                    media_id: str = messages[0].get("image", {}).get("id")
-                    image_caption: str = messages[0].get("image", {}).get("caption", "")
-                    break
-            if user_message or media_id:
-                break
-
-        if not (user_message or media_id):
-            logger.info("Webhook received, but no processable text message found.")
-            return PlainTextResponse("No text message found", status_code=200)
-
-        # Queue the processing and response to happen in the background
-        background_tasks.add_task(
-            process_message_in_background,
-            request,
-            user_message,
-            user_number,
-            media_id,
-            image_caption,
+        # Claim every message ID in the delivery at once; redeliveries are dropped here
+        message_ids: list[str] = [
+            message["id"] for message in iter_messages(data) if message.get("id")
+        ]
+        if not message_ids:
+            return PlainTextResponse("OK")
+        fresh_ids: set[str] = set(
+            await claim_message_ids(request.app.state.redis, message_ids)
         )
+        if not fresh_ids:
+            return PlainTextResponse("Duplicate", status_code=200)
+
+        jobs = parse_webhook(data, message_ids=fresh_ids)
+        if not jobs:
+            logger.info("Webhook received, but no processable message found.")
+            return PlainTextResponse("No processable message found", status_code=200)
+
+        # Persist one job per message so workers pick them up, even across restarts
+        try:
+            await enqueue_jobs(client=request.app.state.redis, jobs=jobs)
+        except Exception:
+            # Let Meta's redelivery through rather than losing the messages
+            await release_message_ids(request.app.state.redis, list(fresh_ids))
+            raise
 
         logger.info(
-            f"Webhook from {user_number} acknowledged and queued for processing."
+            f"Webhook with {len(jobs)} messages from {sorted({job['user_number'] for job in jobs})} "
+            "acknowledged and queued for processing."
         )
         return PlainTextResponse("Message processed", status_code=200)
 
@@ -1,8 +1,11 @@
-from requests.models import Response
-
-
-import requests
+import asyncio
+import json
+import random
+import time
 from typing import Any
+
+import httpx
+import redis.asyncio as redis
 from loguru import logger
 import os
 from datetime import datetime
@@ -13,22 +16,257 @@ logger.add("./logs/whatsapp.log", rotation="10 MB")
 API_VERSION = "v22.0"
 PHONE_NUMBER_ID: int = int(os.getenv("PHONE_NUMBER_ID", 0))
 ACCESS_TOKEN="EAARQrAKzcHUBPPCf9WLEP60NEAzmBLOkBvJKHaep4dCO2UcFor4OdGbIRYXDBr1tv6usnZB1LyQSJT8B8Ufjexf9AQeZBFywAlhSLIA7O2fEaVVK99bA5moZCKZAPMEUuOJgchxQWVpAX7bL8ZCMKKYheGZCz0xvVNWd96OQ7x8QcsgArzeZC9P9GDW4YcPjMhE2yMPss6St61cI0ZAZBu9fIg4NjvHbc8lt2srtcr4wZD"
+# Overridable so the sender can be pointed at a local mock server
+GRAPH_API_BASE: str = os.getenv("GRAPH_API_BASE", "https://graph.facebook.com")
 current_time: datetime = datetime.now(pytz.timezone('Africa/Nairobi'))
 
-@logger.catch
-def whatsapp_messenger(llm_text_output: Any, recipient_number: str):
-    """Send llm response via whatsapp."""
-    if not ACCESS_TOKEN:
-        raise ValueError("ACCESS_TOKEN is not valid")
+# Cloud API default throughput is 80 messages per second per business number
+MESSAGES_PER_SECOND: float = float(os.getenv("WHATSAPP_MESSAGES_PER_SECOND", 80))
+# Recipients with parked messages, scored by when their oldest one is due; each
+# recipient's messages wait in order in the list at OUTBOX_QUEUE_KEY
+OUTBOX_KEY = "whatsapp:outbox:due"
+OUTBOX_QUEUE_KEY = "whatsapp:outbox:{to}"
+# Entries parked one by one before the outbox kept per-recipient order
+LEGACY_OUTBOX_KEY = "whatsapp:outbox"
+# How long a flusher has a recipient to itself before another may take over
+OUTBOX_CLAIM_SECONDS: float = 60.0
+OUTBOX_MAX_ATTEMPTS: int = 6
+OUTBOX_BASE_DELAY_SECONDS: float = 2.0
+OUTBOX_MAX_DELAY_SECONDS: float = 600.0
+# Statuses worth retrying; anything else (bad number, bad payload) never succeeds
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# KEYS: due set, recipient queue. Queue the entry; a recipient's first entry sets when it is due.
+PARK_SCRIPT = """
+redis.call('RPUSH', KEYS[2], ARGV[1])
+if redis.call('LLEN', KEYS[2]) == 1 then
+    redis.call('ZADD', KEYS[1], ARGV[2], ARGV[3])
+end
+return 1
+"""
+# KEYS: recipient queue. Queue the entry only if earlier ones are still waiting.
+QUEUE_BEHIND_SCRIPT = """
+if redis.call('LLEN', KEYS[1]) > 0 then
+    redis.call('RPUSH', KEYS[1], ARGV[1])
+    return 1
+end
+return 0
+"""
+# KEYS: due set. Take a due recipient by pushing its score past the claim period.
+CLAIM_SCRIPT = """
+local due = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if due and tonumber(due) <= tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+    return 1
+end
+return 0
+"""
+# KEYS: due set, recipient queue. Drop the head; forget the recipient once nothing is left.
+POP_SCRIPT = """
+redis.call('LPOP', KEYS[2])
+local left = redis.call('LLEN', KEYS[2])
+if left == 0 then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+end
+return left
+"""
 
-    url = f"https://graph.facebook.com/{API_VERSION}/{PHONE_NUMBER_ID}/messages"
 
-    headers: dict[str, str] = {
-        "Authorization": f"Bearer {ACCESS_TOKEN}",
-        "Content-Type": "application/json",
-    }
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursting up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class WhatsAppSender:
+    """
+    Sends Graph API messages over one shared keep-alive connection pool.
+    Sends are rate limited to the number's throughput, and failed sends are
+    parked in a Valkey outbox and retried with exponential backoff. Once a
+    message to a recipient is parked, later messages to them queue behind it,
+    so a reply's segments still arrive in order.
+    """
+
+    def __init__(
+        self,
+        access_token: str = ACCESS_TOKEN,
+        phone_number_id: int = PHONE_NUMBER_ID,
+        base_url: str = GRAPH_API_BASE,
+        rate_per_second: float = MESSAGES_PER_SECOND,
+    ):
+        self.url = f"/{API_VERSION}/{phone_number_id}/messages"
+        self.access_token = access_token
+        self.base_url = base_url
+        self.bucket = TokenBucket(rate=rate_per_second)
+        self.outbox: redis.Redis | None = None
+        self._client: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created lazily so the pool binds to the running event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={
+                    "Authorization": f"Bearer {self.access_token}",
+                    "Content-Type": "application/json",
+                },
+                timeout=httpx.Timeout(15.0, connect=5.0),
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+            )
+        return self._client
+
+    def set_outbox(self, client: redis.Redis) -> None:
+        """Attach the Valkey client used to persist failed sends."""
+        self.outbox = client
+        self._park_script = client.register_script(PARK_SCRIPT)
+        self._queue_behind_script = client.register_script(QUEUE_BEHIND_SCRIPT)
+        self._claim_script = client.register_script(CLAIM_SCRIPT)
+        self._pop_script = client.register_script(POP_SCRIPT)
+
+    @staticmethod
+    def _entry(payload: dict[str, Any], attempts: int) -> str:
+        return json.dumps({"payload": payload, "attempts": attempts})
+
+    @staticmethod
+    def _delay(attempts: int) -> float:
+        delay = min(OUTBOX_MAX_DELAY_SECONDS, OUTBOX_BASE_DELAY_SECONDS * 2**attempts)
+        return delay * random.uniform(0.8, 1.2)
+
+    async def _post(self, payload: dict[str, Any]) -> bool | None:
+        """One delivery attempt: True on success, None if worth retrying, False if not."""
+        await self.bucket.acquire()
+        try:
+            response = await self.client.post(self.url, json=payload)
+        except httpx.TransportError as e:
+            logger.error(f"Transport error sending to {payload.get('to')}: {e}")
+            return None
+        if response.status_code == 200:
+            return True
+        logger.error(
+            f"Failed to send message to {payload.get('to')}. Status: {response.status_code} and {response.text}"
+        )
+        return None if response.status_code in RETRYABLE_STATUS_CODES else False
 
-    payload: dict[str, str | dict[str, Any]] = {
+    async def send(self, payload: dict[str, Any]) -> bool:
+        """
+        Send one message. Returns True on success; retryable failures go to the
+        outbox, as does anything sent while earlier messages to the recipient wait there.
+        """
+        if not self.access_token:
+            raise ValueError("ACCESS_TOKEN is not valid")
+        to = str(payload.get("to"))
+        if self.outbox is not None and await self._queue_behind_script(
+            keys=[OUTBOX_QUEUE_KEY.format(to=to)], args=[self._entry(payload, 0)]
+        ):
+            logger.info(f"Queued message to {to} behind its parked messages")
+            return False
+        result = await self._post(payload)
+        if result is None:
+            await self._park(payload)
+        return bool(result)
+
+    async def send_batch(self, payloads: list[dict[str, Any]]) -> list[bool]:
+        """Send many messages concurrently; the token bucket keeps the pace."""
+        return list(await asyncio.gather(*(self.send(payload) for payload in payloads)))
+
+    async def _park(self, payload: dict[str, Any]) -> None:
+        to = str(payload.get("to"))
+        if self.outbox is None:
+            logger.warning(f"No outbox configured, dropping message to {to}")
+            return
+        delay = self._delay(0)
+        await self._park_script(
+            keys=[OUTBOX_KEY, OUTBOX_QUEUE_KEY.format(to=to)],
+            args=[self._entry(payload, 1), time.time() + delay, to],
+        )
+        logger.info(f"Parked message to {to} in outbox, retry in {delay:.1f}s")
+
+    async def _flush_recipient(self, to: str) -> None:
+        """Deliver a claimed recipient's queue in order, stopping at the first retryable failure."""
+        queue_key = OUTBOX_QUEUE_KEY.format(to=to)
+        while (entry := await self.outbox.lindex(queue_key, 0)) is not None:
+            item = json.loads(entry)
+            result = await self._post(item["payload"])
+            if result is None and item["attempts"] + 1 < OUTBOX_MAX_ATTEMPTS:
+                # The head keeps its place and everything behind it keeps waiting
+                delay = self._delay(item["attempts"])
+                async with self.outbox.pipeline(transaction=True) as pipe:
+                    pipe.lset(queue_key, 0, self._entry(item["payload"], item["attempts"] + 1))
+                    pipe.zadd(OUTBOX_KEY, {to: time.time() + delay})
+                    await pipe.execute()
+                logger.info(f"Message to {to} still failing, retry in {delay:.1f}s")
+                return
+            if result is None:
+                logger.error(f"Giving up on message to {to} after {item['attempts'] + 1} attempts")
+            await self._pop_script(keys=[OUTBOX_KEY, queue_key], args=[to])
+
+    async def _flush_legacy(self, limit: int) -> int:
+        """Re-send entries parked under LEGACY_OUTBOX_KEY before an upgrade."""
+        due = await self.outbox.zrangebyscore(LEGACY_OUTBOX_KEY, 0, time.time(), start=0, num=limit)
+        taken = 0
+        for entry in due:
+            if not await self.outbox.zrem(LEGACY_OUTBOX_KEY, entry):
+                continue
+            taken += 1
+            await self.send(json.loads(entry)["payload"])
+        return taken
+
+    async def flush_outbox(self, limit: int = 100) -> int:
+        """Retry every recipient whose parked messages are due. Returns the number taken."""
+        if self.outbox is None:
+            return 0
+        now = time.time()
+        due = await self.outbox.zrangebyscore(OUTBOX_KEY, 0, now, start=0, num=limit)
+        taken = 0
+        for to in due:
+            # Claimed for a while so concurrent flushers never resend or reorder a recipient
+            if not await self._claim_script(keys=[OUTBOX_KEY], args=[to, now, now + OUTBOX_CLAIM_SECONDS]):
+                continue
+            taken += 1
+            await self._flush_recipient(to)
+        return taken + await self._flush_legacy(limit)
+
+    async def run_outbox(self, stop: asyncio.Event, interval: float = 1.0) -> None:
+        """Flush the outbox until `stop` is set."""
+        while not stop.is_set():
+            try:
+                await self.flush_outbox()
+            except Exception as e:
+                logger.error(f"Outbox flush failed: {e}")
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Shared sender, one connection pool per process
+whatsapp_sender: WhatsAppSender = WhatsAppSender()
+
+
+def text_payload(llm_text_output: Any, recipient_number: str) -> dict[str, Any]:
+    return {
         "messaging_product": "whatsapp",
         "recipient_type": "individual",
         "to": f"{recipient_number}",  # for prod
@@ -37,30 +275,23 @@ def whatsapp_messenger(llm_text_output: Any, recipient_number: str):
             "body": llm_text_output,
         },
     }
-  
-    response = requests.post(url, headers=headers, json=payload)
-    #response.raise_for_status()  # Raises exception for HTTP errors
-    if response.status_code != 200:
-        logger.error(f"Failed to send message to {recipient_number}. Status: {response.status_code} and {response.json()}")
-    
-    """
-    except requests.exceptions.RequestException as e:
-        logger.debug(f"Error making request: {e}")
-        if hasattr(e, "response") and e.response:
-            logger.debug(f"Error details: {e.response.text}")
-"""
-def send_invoice_whatsapp( recipient_number: str|int, invoice_filename:str):
-    """Send llm response via whatspp."""
-    if not ACCESS_TOKEN:
-        raise ValueError("ACCESS_TOKEN is not valid")
 
-    url: str = f"https://graph.facebook.com/{API_VERSION}/{PHONE_NUMBER_ID}/messages"
 
-    headers: dict[str, str] = {
-        "Authorization": f"Bearer {ACCESS_TOKEN}",
-        "Content-Type": "application/json",
-    }
+@logger.catch
+async def whatsapp_messenger(llm_text_output: Any, recipient_number: str) -> bool:
+    """Send llm response via whatsapp."""
+    return await whatsapp_sender.send(text_payload(llm_text_output, recipient_number))
 
+
+async def broadcast_whatsapp(llm_text_output: Any, recipient_numbers: list[str]) -> list[bool]:
+    """Send the same text to many customers in one rate-limited batch."""
+    return await whatsapp_sender.send_batch(
+        [text_payload(llm_text_output, number) for number in recipient_numbers]
+    )
+
+
+async def send_invoice_whatsapp( recipient_number: str|int, invoice_filename:str) -> bool:
+    """Send llm response via whatspp."""
     payload: dict[str, str | dict[str, str]] = {
         "messaging_product": "whatsapp",
         "recipient_type": "individual",
@@ -72,11 +303,7 @@ def send_invoice_whatsapp( recipient_number: str|int, invoice_filename:str):
             "filename": f"{invoice_filename}",
         },
     }
-    
-    response: Response = requests.post(url, headers=headers, json=payload)
-    #response.raise_for_status()  # Raises exception for HTTP errors
-    if response.status_code != 200:
-        logger.error(f"Failed to send message to {recipient_number}.Status: {response.status_code} and {response.json()}")
-        
+    return await whatsapp_sender.send(payload)
+
 # used for testing
 # whatsapp_messenger("This is the test for lantern")
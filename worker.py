@@ -0,0 +1,218 @@
+# worker.py
+"""
+LLM worker entry point.
+Pulls WhatsApp jobs off the Valkey stream written by the webhook, runs the
+pipeline and acks them. Run one or more of these next to the API:
+    python worker.py
+"""
+import asyncio
+import os
+import signal
+import socket
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+from fastapi import FastAPI, Request
+from loguru import logger
+from ollama import AsyncClient
+
+from utils.catalog import product_catalog
+from utils.cache import history_store
+from utils.db.customer_cache import customer_cache
+from utils.job_queue import (
+    MAX_DELIVERIES,
+    ack_job,
+    claim_stale_jobs,
+    ensure_consumer_group,
+    hand_over,
+    keep_alive,
+    park_for_retry,
+    read_handed_over,
+    read_jobs,
+)
+from utils.llm.coordination import COORDINATION_LEASE_MS, UserLeases, ValkeySemaphore
+from utils.llm.scheduler import LLM_MAX_CONCURRENCY, MessageScheduler
+from utils.llm.tool_executor import TOOL_PROCESS_WORKERS, tool_executor
+from utils.metrics import run_flusher
+from utils.routers.webhooks import process_message_in_background
+from utils.whatsapp import whatsapp_sender
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger.add("./logs/worker.log", rotation="1 week", level="INFO")
+
+VALKEY_HOST: str = os.getenv("VALKEY_HOST", "")
+VALKEY_PORT: int = int(os.getenv("VALKEY_PORT", 6379))
+# Jobs held in memory (queued or generating) before the worker stops reading
+MAX_INFLIGHT_JOBS: int = int(os.getenv("MAX_INFLIGHT_JOBS", 16))
+CLAIM_INTERVAL_SECONDS: int = 30
+# Well inside both the user lease and the stream's visibility timeout
+HEARTBEAT_SECONDS: float = COORDINATION_LEASE_MS / 3000
+LLM_SLOTS_KEY = "worker:llm_slots"
+
+
+def build_app() -> FastAPI:
+    """Create the shared clients the pipeline expects to find on app.state."""
+    app = FastAPI()
+    app.state.llm_client = AsyncClient(host=os.getenv("OLLAMA_HOST"))
+    app.state.embedding_client = AsyncClient("http://ollama_embedding:11434")
+    redis_pool = redis.ConnectionPool(
+        host=VALKEY_HOST, port=VALKEY_PORT, db=0, decode_responses=True
+    )
+    app.state.redis = redis.Redis(connection_pool=redis_pool)
+    return app
+
+
+async def run_job(request: Request, leases: UserLeases, job: dict[str, Any]) -> None:
+    # The lease may have been released between jobs; take it back before replying
+    await leases.acquire(job.get("user_number", ""))
+    await process_message_in_background(
+        request,
+        job.get("user_message", ""),
+        job.get("user_number", ""),
+        job.get("media_id", ""),
+        job.get("image_caption", ""),
+        final_attempt=job.get("deliveries", 1) >= MAX_DELIVERIES,
+    )
+
+
+async def ack_when_done(
+    client: redis.Redis, job_id: str, future: asyncio.Future, held: dict[str, str]
+) -> None:
+    """Ack once the scheduler has handled the job; failures are parked for reclaim."""
+    try:
+        await future
+        await ack_job(client, job_id)
+    except Exception as e:
+        logger.error(f"Job {job_id} not acked: {e}")
+        try:
+            await park_for_retry(client, job_id)
+        except Exception as park_error:
+            logger.error(f"Failed to park job {job_id} for retry: {park_error}")
+    finally:
+        held.pop(job_id, None)
+
+
+async def heartbeat(
+    client: redis.Redis, leases: UserLeases, held: dict[str, str], stop: asyncio.Event
+) -> None:
+    """Renew this worker's user leases and keep its held jobs from looking stale."""
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=HEARTBEAT_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await leases.renew()
+            await keep_alive(client, leases.consumer, list(held))
+        except Exception as e:
+            logger.warning(f"Worker heartbeat failed: {e}")
+
+
+async def consume(
+    request: Request,
+    scheduler: MessageScheduler,
+    leases: UserLeases,
+    held: dict[str, str],
+    stop: asyncio.Event,
+) -> None:
+    """
+    Feed new, handed-over and reclaimed jobs to the scheduler until asked to stop.
+    A job for a customer another worker is already handling is handed over to
+    that worker, so each customer's messages stay in order on one scheduler.
+    """
+    client: redis.Redis = request.app.state.redis
+    consumer = leases.consumer
+    inflight: set[asyncio.Task] = set()
+    next_claim: float = 0.0
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        try:
+            if len(inflight) >= MAX_INFLIGHT_JOBS:
+                await asyncio.wait(inflight, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            jobs = await read_handed_over(
+                client, consumer=consumer, exclude=set(held), count=MAX_INFLIGHT_JOBS - len(inflight)
+            )
+            if loop.time() >= next_claim:
+                # Pick up jobs abandoned by crashed or stalled workers
+                jobs += await claim_stale_jobs(client, consumer=consumer)
+                next_claim = loop.time() + CLAIM_INTERVAL_SECONDS
+            if len(jobs) < MAX_INFLIGHT_JOBS - len(inflight):
+                jobs += await read_jobs(
+                    client,
+                    consumer=consumer,
+                    count=MAX_INFLIGHT_JOBS - len(inflight) - len(jobs),
+                    # Come back soon for handed-over jobs when already busy
+                    block_ms=1000 if held else 5000,
+                )
+            for job_id, job in jobs:
+                user_number = job.get("user_number", "")
+                owner = await leases.acquire(user_number)
+                if owner != consumer:
+                    await hand_over(client, job_id, owner)
+                    logger.info(f"Handed job {job_id} for {user_number} over to {owner}")
+                    continue
+                held[job_id] = user_number
+                task = asyncio.create_task(
+                    ack_when_done(client, job_id, scheduler.submit(job), held)
+                )
+                inflight.add(task)
+                task.add_done_callback(inflight.discard)
+        except Exception as e:
+            logger.error(f"Consumer {consumer} failed: {e}", exc_info=True)
+            await asyncio.sleep(1)
+    if inflight:
+        await asyncio.wait(inflight)
+
+
+async def main() -> None:
+    app = build_app()
+    # The pipeline only reads request.app, so a bare scope is enough outside uvicorn
+    request = Request({"type": "http", "app": app, "headers": []})
+    await ensure_consumer_group(app.state.redis)
+    whatsapp_sender.set_outbox(app.state.redis)
+    product_catalog.load()
+    process_pool = ProcessPoolExecutor(max_workers=TOOL_PROCESS_WORKERS)
+    tool_executor.set_process_pool(process_pool)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    name = f"{socket.gethostname()}-{os.getpid()}"
+    leases = UserLeases(app.state.redis, consumer=name)
+    # LLM_MAX_CONCURRENCY is shared by every worker replica, not per process
+    llm_slots = ValkeySemaphore(app.state.redis, LLM_SLOTS_KEY, limit=LLM_MAX_CONCURRENCY)
+    # History folds take a slot too, but only while one stays free for replies
+    history_store.set_llm_slot(lambda: llm_slots.slot(low_priority=True))
+    scheduler = MessageScheduler(
+        handler=lambda job: run_job(request, leases, job),
+        slot=llm_slots.slot,
+        on_idle=leases.release,
+    )
+    held: dict[str, str] = {}
+    consumer = asyncio.create_task(consume(request, scheduler, leases, held, stop))
+    beats = asyncio.create_task(heartbeat(app.state.redis, leases, held, stop))
+    outbox = asyncio.create_task(whatsapp_sender.run_outbox(stop))
+    metrics = asyncio.create_task(run_flusher(app.state.redis, stop))
+    customers = asyncio.create_task(customer_cache.listen_for_changes(stop))
+    logger.info(f"Worker {name} started.")
+
+    await stop.wait()
+    logger.info(f"Worker {name} draining...")
+    await asyncio.gather(consumer, outbox, metrics, customers, beats)
+    await history_store.drain()
+    await whatsapp_sender.close()
+    process_pool.shutdown(wait=True)
+    tool_executor.shutdown()
+    await app.state.redis.close()
+    logger.info(f"Worker {name} stopped.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())